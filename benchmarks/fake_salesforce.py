@@ -0,0 +1,685 @@
+#! /usr/bin/env python
+
+""" A local stand-in for the Salesforce APIs used by py_salesforce, so the benchmarks (see run.py) don't need a real org. The records are generated from the index of the record, so every run downloads the same data.
+
+ USAGE:
+	python benchmarks/fake_salesforce.py [--port 8000] [--latency 0.05] [--page-size 2000] [--records 100000] [--wide-fields 500] [--children 10] [--null-offset 3] [--job-polls 0]
+
+	--port: Port of the server, 0 uses a free port (the port is printed as "PORT <port>").
+	--latency: Seconds added to each request, default 0.
+	--page-size: Number of records of each query page, default 2000 (the REST API default).
+	--records: Number of records of each Object, default 100000.
+	--wide-fields: Number of custom fields of the Wide__c Object, default 500.
+	--children: Number of child records of each parent record in the Parent-to-Child subqueries, default 10.
+	--child-page-size: Number of child records returned with the parent record, the next ones are returned using the "nextRecordsUrl" of the subquery, default 20.
+	--text-size: Length of the long text (textarea) values, default 200.
+	--distinct-records: The records repeat every this number of records (only the first ones are created and encoded, so the server isn't slower than the client), default 20000.
+	--null-offset: The Child-to-Parent relations of the records number null-offset, null-offset+7, null-offset+14 ... are null, default 3 (0 makes the relations of the first record null).
+	--job-polls: Number of times the state of a Bulk API 2.0 query job is checked before it is complete, default 0 (complete on the first check).
+	--no-gzip: Don't compress the responses (by default they are compressed with gzip when the client accepts it, as Salesforce does).
+
+ The server supports:
+	The SOAP login (any username and password).
+	The "query" and "queryAll" resources, with the pages followed using "nextRecordsUrl". Only the columns, the Child-to-Parent relations (e.g. Account.Name), the Parent-to-Child subqueries, COUNT() and LIMIT of the queries are used, and two conditions: IsDeleted=true returns the deleted records (every 50th record), and a condition on SystemModstamp or LastModifiedDate (e.g. SystemModstamp>=2016-01-01T00:00:00Z) returns the modified records (every 10th record). The other conditions are ignored.
+	The "sobjects" and "sobjects/<Object>/describe" resources, the describe returns 304 (Not Modified) when If-Modified-Since is sent.
+	The "composite/batch" resource (GET subrequests only).
+	The "composite/sobjects" resource (sObject Collections), the records are not saved, each record gets a new Id.
+	The Bulk API 2.0 query jobs ("jobs/query"): create, state, results in CSV chunks of maxRecords records followed using the "Sforce-Locator" header, and delete. The jobs are kept until they are deleted.
+
+ The requests are saved in LOG, and add_fault() makes the next matching requests fail (e.g. with status 503 or 504), to check the retries (see regression.py).
+
+ The Objects are Account, Case, User and Wide__c. Case has the Account and Owner relations, Account has the Owner relation and the Cases child relation."""
+
+import sys
+import re
+import csv
+import json
+import time
+import gzip
+import itertools
+import threading
+import argparse
+import urlparse
+import cStringIO
+import BaseHTTPServer
+import SocketServer
+
+API_VERSION="v35.0"
+
+# Fields of the Objects: name, type and the Object referenced by the relation
+OBJECTS={
+	"User":[
+		("Id","id",None),
+		("Name","string",None),
+		("Email","email",None),
+		("IsActive","boolean",None),
+	],
+	"Account":[
+		("Id","id",None),
+		("Name","string",None),
+		("Industry","picklist",None),
+		("AnnualRevenue","currency",None),
+		("NumberOfEmployees","int",None),
+		("OwnerId","reference","User"),
+		("CreatedDate","datetime",None),
+		("SystemModstamp","datetime",None),
+	],
+	"Case":[
+		("Id","id",None),
+		("CaseNumber","string",None),
+		("Subject","string",None),
+		("Status","picklist",None),
+		("Priority","picklist",None),
+		("IsClosed","boolean",None),
+		("Description","textarea",None),
+		("AccountId","reference","Account"),
+		("OwnerId","reference","User"),
+		("CreatedDate","datetime",None),
+		("ClosedDate","datetime",None),
+		("SystemModstamp","datetime",None),
+	],
+}
+
+# Id prefix of each Object
+PREFIXES={"User":"005","Account":"001","Case":"500","Wide__c":"a00"}
+
+# Child relations: relation name, child Object, field of the child Object
+CHILD_RELATIONS={"Account":[("Cases","Case","AccountId")]}
+
+# Types of the fields of the Wide__c Object, used in turn
+WIDE_TYPES=("string","double","boolean","date","datetime","int","picklist","currency","textarea","percent")
+
+PICKLIST_VALUES=("New","Working","Escalated","On Hold","Closed")
+
+LAST_MODIFIED="Fri, 01 Jan 2016 00:00:00 GMT"
+
+
+# Settings of the server, changed by the command line arguments or start_server()
+SETTINGS={
+	"latency":0.0,
+	"page_size":2000,
+	"records":100000,
+	"wide_fields":500,
+	"children":10,
+	"child_page_size":20,
+	"text_size":200,
+	"distinct_records":20000,
+	"null_offset":3,
+	"job_polls":0,
+	"gzip":True,
+}
+
+# Requests received by the server (method and path), and the faults of the next requests (see add_fault())
+LOG=[]
+FAULTS=[]
+FAULTS_LOCK=threading.Lock()
+
+
+def add_fault(method,pattern,status,count=1):
+	""" This function makes the next "count" requests having this method and a path matching the pattern (regular expression) fail with this status, e.g. add_fault("POST","composite/sobjects",504)"""
+
+	with FAULTS_LOCK:
+		FAULTS.append({"method":method,"pattern":pattern,"status":status,"count":count})
+
+
+def take_fault(method,path):
+	""" This function returns the status of the fault matching a request (the count of the fault is decreased), or None if there is no fault"""
+
+	with FAULTS_LOCK:
+		for fault in FAULTS:
+			if fault["method"]==method and fault["count"]>0 and re.search(fault["pattern"],path):
+				fault["count"]-=1
+				return fault["status"]
+	return None
+
+
+def object_fields(name):
+	""" This function returns the fields of an Object (the Wide__c fields depend on the wide_fields setting) ... returns a List of tuples (name, type, referenced Object), or None if the Object doesn't exist"""
+
+	if name=="Wide__c":
+		return [("Id","id",None),("Name","string",None)]+[ ("Field_%03d__c" % i,WIDE_TYPES[i%len(WIDE_TYPES)],None) for i in range(1,SETTINGS["wide_fields"]+1) ]
+	return OBJECTS.get(name)
+
+
+def record_id(object_name,i):
+	""" This function returns the Id of the record number i of an Object"""
+
+	return "%s%012dAAA" % (PREFIXES.get(object_name,"a01"),i)
+
+
+def field_value(object_name,field,sf_type,reference,i):
+	""" This function returns the value of a field of the record number i"""
+
+	if sf_type=="id":
+		return record_id(object_name,i)
+	if sf_type=="reference":
+		return record_id(reference,i%1000)
+	if field=="CaseNumber":
+		return "%08d" % i
+	if sf_type in ("string","email"):
+		return "%s %d" % (field,i)
+	if sf_type=="textarea":
+		text="Lorem ipsum dolor sit amet, %d. " % i
+		return (text*(SETTINGS["text_size"]/len(text)+1))[:SETTINGS["text_size"]]
+	if sf_type=="picklist":
+		return PICKLIST_VALUES[i%len(PICKLIST_VALUES)]
+	if sf_type=="boolean":
+		return i%2==0
+	if sf_type=="int":
+		return i
+	if sf_type in ("double","currency","percent"):
+		return i*1.25
+	if sf_type=="date":
+		return "2016-%02d-%02d" % (i%12+1,i%28+1)
+	if sf_type=="datetime":
+		return "2016-%02d-%02dT%02d:%02d:00.000+0000" % (i%12+1,i%28+1,i%24,i%60)
+	return None
+
+
+def split_columns(text):
+	""" This function splits the columns of a SELECT on the commas that are not between brackets ... returns a List of columns"""
+
+	columns=[]
+	depth=0
+	start=0
+	for i,char in enumerate(text):
+		if char=="(":
+			depth+=1
+		elif char==")":
+			depth-=1
+		elif char=="," and depth==0:
+			columns.append(text[start:i].strip())
+			start=i+1
+	columns.append(text[start:].strip())
+	return [ column for column in columns if column ]
+
+
+def parse_query(soql):
+	""" This function parses the parts of a query used by the server ... returns a dictionary having the "object", the "columns", the "subqueries" (relation name and columns), "count" (SELECT COUNT()), "limit", and the "step" and "offset" of the numbers of the records matching the conditions (see record_number()), or None if the query is not valid"""
+
+	match=re.match(r"\s*SELECT\s+(.*?)\s+FROM\s+(\w+)(.*)$",soql,re.IGNORECASE|re.DOTALL)
+	if not match:
+		return None
+
+	# Remove the subqueries before finding the FROM of the main query
+	depth=0
+	select_end=None
+	for m in re.finditer(r"[()]|\bFROM\b",soql,re.IGNORECASE):
+		if m.group(0)=="(":
+			depth+=1
+		elif m.group(0)==")":
+			depth-=1
+		elif depth==0:
+			select_end=m.start()
+			break
+	if select_end is None:
+		return None
+
+	select=re.sub(r"^\s*SELECT\s+","",soql[:select_end],flags=re.IGNORECASE)
+	rest=soql[select_end+4:].split(None,1)
+	if not rest:
+		return None
+	where=rest[1] if len(rest)>1 else ""
+	limit=re.search(r"\bLIMIT\s+(\d+)",where,re.IGNORECASE)
+
+	# The deleted records, or the modified records
+	step,offset=1,0
+	if re.search(r"\bIsDeleted\s*=\s*true\b",where,re.IGNORECASE):
+		step,offset=50,49
+	elif re.search(r"\b(SystemModstamp|LastModifiedDate)\s*>",where,re.IGNORECASE):
+		step,offset=10,0
+
+	columns=[]
+	subqueries=[]
+	for column in split_columns(select):
+		if column.startswith("("):
+			subquery=parse_query(column[1:-1])
+			if subquery is not None:
+				subqueries.append((subquery["object"],subquery["columns"]))
+		else:
+			columns.append(column)
+
+	return {
+		"object":rest[0],
+		"columns":columns,
+		"subqueries":subqueries,
+		"count":[ column.upper() for column in columns ]==["COUNT()"],
+		"limit":int(limit.group(1)) if limit else None,
+		"step":step,
+		"offset":offset,
+	}
+
+
+# Fields and relations of each Object by lower case name, created on first use
+FIELD_INDEXES={}
+
+
+def field_index(object_name):
+	""" This function returns the fields of an Object by lower case name, and the relation names and the Objects referenced by the relations by lower case relation name (e.g. ("Owner","User") for "owner")"""
+
+	index=FIELD_INDEXES.get(object_name)
+	if index is None:
+		fields=object_fields(object_name)
+		index=FIELD_INDEXES[object_name]=(dict([ (field[0].lower(),field) for field in fields ]),dict([ (field[0][:-2].lower(),(field[0][:-2],field[2])) for field in fields if field[2] ]))
+	return index
+
+
+def build_record(object_name,columns,i,subqueries=()):
+	""" This function creates the record number i of an Object having the columns of a query, with the Child-to-Parent relations as nested dictionaries (every 7th relation is null) and the results of the Parent-to-Child subqueries. The names of the relations and of the fields have the case of the describe, like Salesforce, whatever their case in the query ... returns a dictionary"""
+
+	record={"attributes":{"type":object_name,"url":"/services/data/"+API_VERSION+"/sobjects/"+object_name+"/"+record_id(object_name,i)}}
+	for column in columns:
+		path=column.split(".")
+		target=record
+		target_object=object_name
+		index=i
+		for name in path[:-1]:
+			name,parent=field_index(target_object)[1].get(name.lower(),(name,None))
+			if parent is None or index%7==SETTINGS["null_offset"]:
+				target[name]=None
+				target=None
+				break
+			index=index%1000
+			if not isinstance(target.get(name),dict):
+				target[name]={"attributes":{"type":parent,"url":"/services/data/"+API_VERSION+"/sobjects/"+parent+"/"+record_id(parent,index)}}
+			target=target[name]
+			target_object=parent
+
+		if target is not None:
+			field=field_index(target_object)[0].get(path[-1].lower(),(path[-1],"string",None))
+			target[field[0]]=field_value(target_object,field[0],field[1],field[2],index)
+
+	for relation,child_columns in subqueries:
+		record[relation]=child_result(object_name,relation,child_columns,i,0)
+
+	return record
+
+
+def child_result(object_name,relation,columns,parent,start):
+	""" This function creates the result of a Parent-to-Child subquery for the parent record number parent, from the child record number start ... returns a dictionary having "totalSize", "done", "records" and "nextRecordsUrl", or None if the parent record has no child records (every 5th parent record)"""
+
+	children=dict([ (name.lower(),child) for name,child,field in CHILD_RELATIONS.get(object_name,[]) ])
+	total=SETTINGS["children"] if parent%5!=4 else 0
+	if relation.lower() not in children or total==0:
+		return None
+
+	end=min(start+SETTINGS["child_page_size"],total)
+	result={"totalSize":total,"done":end>=total,"records":[ build_record(children[relation.lower()],columns,parent*SETTINGS["children"]+j) for j in range(start,end) ]}
+	if end<total:
+		result["nextRecordsUrl"]="/services/data/"+API_VERSION+"/query/"+register_cursor({"object":object_name,"relation":relation,"columns":columns,"parent":parent})+"-"+str(end)
+	return result
+
+
+# Queries having more pages, by cursor
+CURSORS={}
+CURSOR_KEYS={}
+CURSORS_LOCK=threading.Lock()
+
+
+def register_cursor(state):
+	""" This function saves the state of a query having more pages, the same query always gets the same cursor ... returns the cursor used in the "nextRecordsUrl" """
+
+	key=json.dumps(state,sort_keys=True)
+	with CURSORS_LOCK:
+		cursor=CURSOR_KEYS.get(key)
+		if cursor is None:
+			cursor=CURSOR_KEYS[key]="01g%012d" % len(CURSORS)
+			CURSORS[cursor]=key
+		return cursor
+
+
+# JSON of the records of the pages, by query and first record (the records repeat every "distinct_records" records)
+RECORD_BLOCKS={}
+RECORD_BLOCKS_LOCK=threading.Lock()
+
+
+def record_block(query,start,end):
+	""" This function returns the JSON of the records of a page, the records are created once and reused by the next pages having the same records (the record number i is the same as the record number i+distinct_records), so the server is not slower than the client ... returns the JSON text"""
+
+	period=SETTINGS["distinct_records"]
+	key=(register_cursor(query),start%period,end-start)
+	with RECORD_BLOCKS_LOCK:
+		block=RECORD_BLOCKS.get(key)
+	if block is None:
+		block=json.dumps([ build_record(query["object"],query["columns"],record_number(query,i)%period,query["subqueries"]) for i in range(start,end) ])
+		with RECORD_BLOCKS_LOCK:
+			RECORD_BLOCKS[key]=block
+	return block
+
+
+def query_total(query):
+	""" This function returns the number of records of a query"""
+
+	total=len(xrange(query["offset"],SETTINGS["records"],query["step"]))
+	return total if query["limit"] is None else min(query["limit"],total)
+
+
+def record_number(query,i):
+	""" This function returns the number of the record i of the result of a query (the query only returns the records matching its conditions)"""
+
+	return i*query["step"]+query["offset"]
+
+
+def query_page(query,start):
+	""" This function creates a page of a query from the record number start ... returns the JSON text of the page"""
+
+	total=query_total(query)
+	if query["count"]:
+		return json.dumps({"totalSize":total,"done":True,"records":[]})
+
+	end=min(start+SETTINGS["page_size"],total)
+	next_url=', "nextRecordsUrl": "/services/data/'+API_VERSION+'/query/'+register_cursor(query)+'-'+str(end)+'"' if end<total else ""
+	return '{"totalSize": %d, "done": %s%s, "records": %s}' % (total,"true" if end>=total else "false",next_url,record_block(query,start,end))
+
+
+# Bulk API 2.0 query jobs by Id
+JOBS={}
+JOB_IDS=itertools.count(1)
+JOBS_LOCK=threading.Lock()
+
+
+def column_name(object_name,column):
+	""" This function returns the name of a column of a query with the case of the describe, e.g. "Account.Owner.Name" for "account.owner.name" """
+
+	names=[]
+	path=column.split(".")
+	for name in path[:-1]:
+		name,object_name=field_index(object_name)[1].get(name.lower(),(name,None))
+		names.append(name)
+		if object_name is None:
+			return ".".join(names+path[len(names):])
+	names.append(field_index(object_name)[0].get(path[-1].lower(),(path[-1],))[0])
+	return ".".join(names)
+
+
+def csv_value(record,column):
+	""" This function returns the value of a column of a record (build_record()) as it is written in the CSV results of the Bulk API, null values are empty"""
+
+	value=record
+	for name in column.split("."):
+		if not isinstance(value,dict):
+			return ""
+		value=value.get(name)
+	if value is None:
+		return ""
+	if isinstance(value,bool):
+		return "true" if value else "false"
+	return str(value)
+
+
+def bulk_results(query,start,size):
+	""" This function creates a chunk of the CSV results of a query job from the record number start ... returns the CSV text and the locator of the next chunk (None for the last chunk)"""
+
+	total=query_total(query)
+	end=min(start+size,total)
+	columns=[ column_name(query["object"],column) for column in query["columns"] ]
+
+	output=cStringIO.StringIO()
+	writer=csv.writer(output,lineterminator="\n")
+	writer.writerow(columns)
+	for i in range(start,end):
+		record=build_record(query["object"],query["columns"],record_number(query,i)%SETTINGS["distinct_records"])
+		writer.writerow([ csv_value(record,column) for column in columns ])
+	return output.getvalue(),str(end) if end<total else None
+
+
+def describe(object_name):
+	""" This function creates the describe of an Object ... returns the dictionary of the describe"""
+
+	fields=[]
+	for name,sf_type,reference in object_fields(object_name):
+		fields.append({
+			"name":name,
+			"label":name.replace("__c","").replace("_"," "),
+			"type":sf_type,
+			"filterable":sf_type!="textarea",
+			"referenceTo":[reference] if reference else [],
+			"relationshipName":name[:-2] if reference else None,
+			"length":255 if sf_type in ("string","picklist","email") else 0,
+		})
+
+	child_relations=[ {"relationshipName":relation,"childSObject":child,"field":field} for relation,child,field in CHILD_RELATIONS.get(object_name,[]) ]
+	return {"name":object_name,"label":object_name,"queryable":True,"fields":fields,"childRelationships":child_relations}
+
+
+def route(method,path,headers):
+	""" This function runs a REST request ... returns the status, the content (a python object, JSON text or None) and the extra headers"""
+
+	url=urlparse.urlparse(path)
+	prefix="/services/data/"+API_VERSION+"/"
+	if not url.path.startswith(prefix):
+		return 404,[{"errorCode":"NOT_FOUND","message":"The requested resource does not exist"}],{}
+	resource=url.path[len(prefix):]
+
+	if resource in ("query","query/","queryAll","queryAll/"):
+		soql=urlparse.parse_qs(url.query).get("q",[""])[0]
+		query=parse_query(soql)
+		if query is None or object_fields(query["object"]) is None:
+			return 400,[{"errorCode":"MALFORMED_QUERY","message":"Invalid query: "+soql}],{}
+		return 200,query_page(query,0),{}
+
+	match=re.match(r"query/(\w+)-(\d+)$",resource)
+	if match:
+		with CURSORS_LOCK:
+			state=CURSORS.get(match.group(1))
+		if state is None:
+			return 400,[{"errorCode":"INVALID_QUERY_LOCATOR","message":"invalid query locator"}],{}
+		state=json.loads(state)
+		if "relation" in state:
+			return 200,child_result(state["object"],state["relation"],state["columns"],state["parent"],int(match.group(2))),{}
+		return 200,query_page(state,int(match.group(2))),{}
+
+	if resource=="sobjects":
+		return 200,{"encoding":"UTF-8","maxBatchSize":200,"sobjects":[ {"name":name,"label":name,"queryable":True} for name in sorted(OBJECTS.keys()+["Wide__c"]) ]},{"Last-Modified":LAST_MODIFIED}
+
+	match=re.match(r"jobs/query/(\w+)(/results)?$",resource)
+	if match:
+		with JOBS_LOCK:
+			job=JOBS.get(match.group(1))
+			if job is not None and not match.group(2):
+				job["polls"]+=1
+		if job is None:
+			return 404,[{"errorCode":"NOT_FOUND","message":"The requested resource does not exist"}],{}
+		complete=job["polls"]>SETTINGS["job_polls"]
+		if not match.group(2):
+			return 200,{"id":match.group(1),"operation":job["operation"],"object":job["query"]["object"],"state":"JobComplete" if complete else "InProgress"},{}
+		if not complete:
+			return 400,[{"errorCode":"INVALIDJOBSTATE","message":"The job is not complete"}],{}
+
+		params=urlparse.parse_qs(url.query)
+		content,locator=bulk_results(job["query"],int(params.get("locator",["0"])[0]),int(params.get("maxRecords",["50000"])[0]))
+		return 200,content,{"Content-Type":"text/csv","Sforce-Locator":locator or "null"}
+
+	match=re.match(r"sobjects/(\w+)/describe$",resource)
+	if match:
+		if object_fields(match.group(1)) is None:
+			return 404,[{"errorCode":"NOT_FOUND","message":"The requested resource does not exist"}],{}
+		if headers.get("If-Modified-Since"):
+			return 304,None,{"Last-Modified":LAST_MODIFIED}
+		return 200,describe(match.group(1)),{"Last-Modified":LAST_MODIFIED}
+
+	return 404,[{"errorCode":"NOT_FOUND","message":"The requested resource does not exist"}],{}
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+	""" The request handler of the server, it keeps the connections alive like Salesforce"""
+
+	protocol_version="HTTP/1.1"
+
+	# Send each response in one write, separate small writes are delayed by the Nagle algorithm
+	wbufsize=-1
+	disable_nagle_algorithm=True
+	session_id="00D000000000001!FAKE.SESSION"
+	requests=[0]
+	requests_lock=threading.Lock()
+
+	def log_message(self,*args):
+		pass
+
+	def send(self,status,content,extra_headers={},content_type="application/json;charset=UTF-8"):
+		body="" if content is None else content if isinstance(content,str) else json.dumps(content)
+		content_type=extra_headers.get("Content-Type",content_type)
+		with self.requests_lock:
+			self.requests[0]+=1
+			count=self.requests[0]
+
+		self.send_response(status)
+		if body and SETTINGS["gzip"] and "gzip" in (self.headers.get("Accept-Encoding") or ""):
+			buffer=cStringIO.StringIO()
+			with gzip.GzipFile(fileobj=buffer,mode="wb",compresslevel=6) as output:
+				output.write(body)
+			body=buffer.getvalue()
+			self.send_header("Content-Encoding","gzip")
+		self.send_header("Content-Type",content_type)
+		self.send_header("Content-Length",str(len(body)))
+		self.send_header("Sforce-Limit-Info","api-usage=%d/15000000" % count)
+		for name,value in extra_headers.items():
+			if name!="Content-Type":
+				self.send_header(name,value)
+		self.end_headers()
+		self.wfile.write(body)
+
+	def read_body(self):
+		length=int(self.headers.get("Content-Length") or 0)
+		return self.rfile.read(length) if length else ""
+
+	def authorized(self):
+		if self.headers.get("Authorization")=="Bearer "+self.session_id:
+			return True
+		self.send(401,[{"errorCode":"INVALID_SESSION_ID","message":"Session expired or invalid"}])
+		return False
+
+	def fault(self,method):
+		LOG.append((method,self.path))
+		status=take_fault(method,self.path)
+		if status is None:
+			return False
+		self.send(status,[{"errorCode":"SERVER_UNAVAILABLE" if status==503 else "REQUEST_LIMIT_EXCEEDED" if status==429 else "UNKNOWN_EXCEPTION","message":"Injected fault"}])
+		return True
+
+	def do_GET(self):
+		time.sleep(SETTINGS["latency"])
+		if self.fault("GET") or not self.authorized():
+			return
+		status,content,extra_headers=route("GET",self.path,self.headers)
+		self.send(status,content,extra_headers)
+
+	def do_POST(self):
+		time.sleep(SETTINGS["latency"])
+		body=self.read_body()
+		if self.fault("POST"):
+			return
+
+		# SOAP login
+		if self.path.startswith("/services/Soap/"):
+			host="http://"+self.headers.get("Host","127.0.0.1")
+			self.send(200,LOGIN_RESPONSE % {"session_id":self.session_id,"server_url":host+"/services/Soap/u/35.0/00D000000000001"},content_type="text/xml;charset=UTF-8")
+			return
+
+		if not self.authorized():
+			return
+
+		if self.path=="/services/data/"+API_VERSION+"/composite/batch":
+			results=[]
+			for request in json.loads(body)["batchRequests"]:
+				if request.get("method","GET")!="GET":
+					results.append({"statusCode":400,"result":[{"errorCode":"INVALID_METHOD","message":"Only GET is supported"}]})
+					continue
+				status,content,extra_headers=route("GET","/services/data/"+request["url"],{})
+				results.append({"statusCode":status,"result":json.loads(content) if isinstance(content,str) else content})
+			self.send(200,{"hasErrors":any([ result["statusCode"]>=400 for result in results ]),"results":results})
+			return
+
+		if self.path=="/services/data/"+API_VERSION+"/jobs/query":
+			job=json.loads(body)
+			query=parse_query(job.get("query",""))
+			if query is None or object_fields(query["object"]) is None or query["subqueries"] or query["count"]:
+				self.send(400,[{"errorCode":"INVALIDJOB","message":"Invalid query: "+job.get("query","")}])
+				return
+			with JOBS_LOCK:
+				job_id="750%012dAAA" % next(JOB_IDS)
+				JOBS[job_id]={"operation":job.get("operation","query"),"query":query,"polls":0}
+			self.send(200,{"id":job_id,"operation":JOBS[job_id]["operation"],"object":query["object"],"state":"UploadComplete"})
+			return
+
+		if self.path.startswith("/services/data/"+API_VERSION+"/composite/sobjects"):
+			records=json.loads(body)["records"]
+			self.send(200,[ {"id":record_id(record["attributes"]["type"],10000000+len(LOG)*200+i),"success":True,"errors":[]} for i,record in enumerate(records) ])
+			return
+
+		self.send(404,[{"errorCode":"NOT_FOUND","message":"The requested resource does not exist"}])
+
+	def do_DELETE(self):
+		time.sleep(SETTINGS["latency"])
+		if self.fault("DELETE") or not self.authorized():
+			return
+
+		match=re.match(r"/services/data/"+API_VERSION+r"/jobs/query/(\w+)$",self.path)
+		with JOBS_LOCK:
+			job=JOBS.pop(match.group(1),None) if match else None
+		if job is None:
+			self.send(404,[{"errorCode":"NOT_FOUND","message":"The requested resource does not exist"}])
+			return
+		self.send(204,None)
+
+
+LOGIN_RESPONSE="""<?xml version="1.0" encoding="UTF-8"?><soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns="urn:partner.soap.sforce.com"><soapenv:Body><loginResponse><result><passwordExpired>false</passwordExpired><serverUrl>%(server_url)s</serverUrl><sessionId>%(session_id)s</sessionId><userId>005000000000001AAA</userId><userInfo><userFullName>Benchmark User</userFullName></userInfo></result></loginResponse></soapenv:Body></soapenv:Envelope>"""
+
+
+class Server(SocketServer.ThreadingMixIn,BaseHTTPServer.HTTPServer):
+	daemon_threads=True
+	request_queue_size=64
+
+
+def start_server(port=0,**settings):
+	""" This function starts the server in a background thread (e.g. to use it in the same process), the settings are the same as the command line arguments (e.g. latency=0.05, page_size=2000) ... returns the server, its port is server.server_address[1]"""
+
+	SETTINGS.update(settings)
+	server=Server(("127.0.0.1",port),Handler)
+	thread=threading.Thread(target=server.serve_forever)
+	thread.daemon=True
+	thread.start()
+	return server
+
+
+def main():
+	parser=argparse.ArgumentParser(description="Local stand-in server for the Salesforce APIs")
+	parser.add_argument("--port",type=int,default=8000)
+	parser.add_argument("--latency",type=float,default=SETTINGS["latency"])
+	parser.add_argument("--page-size",type=int,default=SETTINGS["page_size"])
+	parser.add_argument("--records",type=int,default=SETTINGS["records"])
+	parser.add_argument("--wide-fields",type=int,default=SETTINGS["wide_fields"])
+	parser.add_argument("--children",type=int,default=SETTINGS["children"])
+	parser.add_argument("--child-page-size",type=int,default=SETTINGS["child_page_size"])
+	parser.add_argument("--text-size",type=int,default=SETTINGS["text_size"])
+	parser.add_argument("--distinct-records",type=int,default=SETTINGS["distinct_records"])
+	parser.add_argument("--null-offset",type=int,default=SETTINGS["null_offset"])
+	parser.add_argument("--job-polls",type=int,default=SETTINGS["job_polls"])
+	parser.add_argument("--no-gzip",action="store_true")
+	args=parser.parse_args()
+
+	SETTINGS.update({
+		"latency":args.latency,
+		"page_size":args.page_size,
+		"records":args.records,
+		"wide_fields":args.wide_fields,
+		"children":args.children,
+		"child_page_size":args.child_page_size,
+		"text_size":args.text_size,
+		"distinct_records":args.distinct_records,
+		"null_offset":args.null_offset,
+		"job_polls":args.job_polls,
+		"gzip":not args.no_gzip,
+	})
+
+	server=Server(("127.0.0.1",args.port),Handler)
+	print "PORT %d" % server.server_address[1]
+	sys.stdout.flush()
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+
+
+if __name__=="__main__":
+	main()
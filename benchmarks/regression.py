@@ -0,0 +1,811 @@
+#! /usr/bin/env python
+
+""" Regression checks for py_salesforce, run against the local stand-in server (fake_salesforce.py). Each feature has its own test case, e.g. FlattenTest for the flatten of the records, ExportTest for the CSV exports and RetryTest for the retries of the requests.
+
+ USAGE:
+	python benchmarks/regression.py [-v] [TestCase[.test_name] ...]
+
+ EXAMPLE:
+	python benchmarks/regression.py -v ExportTest
+
+ The server runs in the same process and is shared by the test cases, the relations of the first record of each query are null (null_offset=0). Each test gets a new py_salesforce object and a new temporary directory (session, caches and local store)."""
+
+import os
+import re
+import csv
+import datetime
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+import fake_salesforce
+from run import connect
+
+# The columnar exports need numpy (npz) or pyarrow (parquet, arrow)
+try:
+	import numpy
+except ImportError:
+	numpy=None
+try:
+	import pyarrow
+except ImportError:
+	pyarrow=None
+
+# Settings of the server, shared by all the test cases
+SERVER_SETTINGS={"records":450,"page_size":100,"null_offset":0}
+SERVER=[]
+
+CASE_SOQL="SELECT Id,Subject,Account.Name,Account.Owner.Name,Owner.Name FROM Case"
+
+
+def server_port():
+	""" This function starts the server on first use ... returns its port"""
+
+	if not SERVER:
+		SERVER.append(fake_salesforce.start_server(0,**SERVER_SETTINGS))
+	return SERVER[0].server_address[1]
+
+
+def close_connections(sf):
+	""" This function closes the keep-alive connections of a py_salesforce object, so the threads of the server handling them end"""
+
+	while not sf.http_pool.empty():
+		for connection in sf.http_pool.get_nowait().connections.values():
+			connection.close()
+
+
+def tearDownModule():
+	for server in SERVER:
+		server.shutdown()
+		server.server_close()
+
+
+class ServerTestCase(unittest.TestCase):
+	""" The base of the test cases: a py_salesforce object connected to the server (self.sf), a temporary directory (self.tmp_dir), and an empty LOG of requests and no faults"""
+
+	def setUp(self):
+		self.tmp_dir=tempfile.mkdtemp()
+		self.sf=connect(server_port(),self.tmp_dir)
+		self.sf.latest_REST_url_ver=self.sf.REST_url_ver
+		self.sf.retry_delay=0.01
+		self.sf.session_id
+		del fake_salesforce.LOG[:]
+		del fake_salesforce.FAULTS[:]
+
+	def tearDown(self):
+		del fake_salesforce.FAULTS[:]
+		close_connections(self.sf)
+		shutil.rmtree(self.tmp_dir,ignore_errors=True)
+
+	def requests(self,method,text):
+		return [ path for request_method,path in fake_salesforce.LOG if request_method==method and text in path ]
+
+	def read_csv(self,path):
+		with open(path,"rb") as csv_file:
+			return list(csv.reader(csv_file))
+
+
+class PrefetchTest(ServerTestCase):
+
+	def test_pages_in_order(self):
+		pages=list(self.sf.query_pages(self.sf.query_url(CASE_SOQL),prefetch=2))
+		self.assertEqual([ len(page) for page in pages ],[100,100,100,100,50])
+		self.assertEqual(pages[1][0]["Id"],fake_salesforce.record_id("Case",100))
+
+	def test_source_closed_when_stopped_early(self):
+		closed=threading.Event()
+
+		def source():
+			try:
+				for i in range(100):
+					yield i
+			finally:
+				closed.set()
+
+		for lookahead in (0,2):
+			closed.clear()
+			# The test keeps a reference, so the source is not closed by the garbage collector
+			source_pages=source()
+			pages=self.sf.prefetch(source_pages,lookahead)
+			self.assertEqual(pages.next(),0)
+			pages.close()
+			self.assertTrue(closed.wait(5))
+
+
+class SessionTest(ServerTestCase):
+
+	def test_single_login(self):
+		# Many threads make their first request at the same time without a login file, only one of them logs in
+		tmp_dir=os.path.join(self.tmp_dir,"threads")
+		os.makedirs(tmp_dir)
+		start=threading.Event()
+		sessions=[]
+
+		def first_request():
+			sf=connect(server_port(),tmp_dir)
+			start.wait()
+			sessions.append(sf.session_id)
+
+		threads=[ threading.Thread(target=first_request) for i in range(8) ]
+		fake_salesforce.SETTINGS["latency"]=0.1
+		try:
+			for thread in threads:
+				thread.start()
+			start.set()
+			for thread in threads:
+				thread.join(10)
+		finally:
+			fake_salesforce.SETTINGS["latency"]=0.0
+
+		self.assertEqual(len(self.requests("POST","/services/Soap/")),1)
+		self.assertEqual(sessions,[fake_salesforce.Handler.session_id]*8)
+
+	def test_expired_session(self):
+		# The session shared by the instances expired, a new session is started and the request continues
+		sessions=self.sf.__class__.sessions
+		sessions[self.sf.login_file]["session_id"]=self.sf.session_id="00D000000000001!EXPIRED"
+		self.assertEqual(len(self.sf.query_SOQL("SELECT Id FROM User LIMIT 3")),3)
+		self.assertEqual(len(self.requests("POST","/services/Soap/")),1)
+
+		# Another instance uses the new session without logging in
+		other=connect(server_port(),self.tmp_dir)
+		other.server_url
+		other.session_id="00D000000000001!EXPIRED"
+		self.assertEqual(len(other.query_SOQL("SELECT Id FROM User LIMIT 3")),3)
+		self.assertEqual(len(self.requests("POST","/services/Soap/")),1)
+
+
+class AsyncTest(ServerTestCase):
+
+	def test_query_async(self):
+		cases=self.sf.query_async("Case",["Id","Subject"],["IsClosed=false"])
+		users=self.sf.query_SOQL_async("SELECT Id,Name FROM User LIMIT 5")
+		self.assertEqual(cases.get(10),self.sf.query("Case",["Id","Subject"],["IsClosed=false"]))
+		self.assertEqual([ user["Id"] for user in users.get(10) ],[ fake_salesforce.record_id("User",i) for i in range(5) ])
+
+	def test_query_SOQL_many_errors(self):
+		soqls=[ "SELECT Id FROM User LIMIT %d" % (i+1) for i in range(5) ]+["SELECT Id FROM Missing__c"]
+		fake_salesforce.add_fault("GET",r"LIMIT\+3$",500)
+		results=self.sf.query_SOQL_many(soqls)
+		self.assertEqual([ len(result) if result is not False else False for result in results ],[1,2,False,4,5,False])
+
+	def test_batch_request_in_async_job(self):
+		# batch_request() runs its Composite Batch requests in parallel, from a job of the only async worker
+		self.sf.max_concurrent_requests=1
+		result=self.sf.async_pool().apply_async(self.sf.batch_request,(["sobjects/Case/describe"]*60,))
+		describes=result.get(10)
+		self.assertEqual(len(describes),60)
+		self.assertEqual(len(self.requests("POST","composite/batch")),3)
+
+		describes=self.sf.describe_object_async("Account").get(10)
+		self.assertEqual(describes[1][0]["relationshipName"],"Cases")
+
+
+class SyncTest(ServerTestCase):
+
+	def local_count(self,table):
+		return len(self.sf.query_local(table,columns=["Id"]))
+
+	def test_incremental_sync(self):
+		result=self.sf.sync_object("Case",["Subject","Status"])
+		latest=max([ fake_salesforce.field_value("Case","SystemModstamp","datetime",None,i) for i in range(450) ])
+		self.assertEqual(result,{"updated":450,"deleted":0,"watermark":self.sf.soql_datetime(latest)})
+		self.assertEqual(sorted(self.sf.query_local("Case")[0].keys()),["Id","Status","Subject","SystemModstamp"])
+		self.assertEqual(self.sf.query_local("Case",filters=[("Id","==",fake_salesforce.record_id("Case",7))],columns=["Subject"]),[{"Subject":"Subject 7"}])
+
+		# The next run only downloads the records modified since the watermark (every 10th record), and removes the deleted records (every 50th record)
+		del fake_salesforce.LOG[:]
+		result=self.sf.sync_object("Case",["Subject","Status"],deletes=True)
+		self.assertEqual(result,{"updated":45,"deleted":9,"watermark":self.sf.soql_datetime(latest)})
+		self.assertEqual(len(self.requests("GET","/query/?q=SELECT+Subject,Status,Id,SystemModstamp+FROM+Case+WHERE+SystemModstamp>="+self.sf.soql_datetime(latest))),1)
+		self.assertEqual(len(self.requests("GET","/queryAll/?q=SELECT+Id+FROM+Case+WHERE+IsDeleted=true")),1)
+		self.assertEqual(self.local_count("Case"),441)
+
+		# reset_sync() removes the records and the watermark
+		self.sf.reset_sync("Case")
+		self.assertEqual(self.sf.sync_object("Case",["Subject"])["updated"],450)
+
+	def test_failed_sync(self):
+		self.sf.sync_object("Case",["Subject"])
+
+		# Nothing is saved, the next run starts from the same watermark
+		fake_salesforce.add_fault("GET","SystemModstamp>=",500)
+		self.assertEqual(self.sf.sync_object("Case",["Subject"]),False)
+		self.assertEqual(self.local_count("Case"),450)
+		self.assertEqual(self.sf.sync_object("Case",["Subject"])["updated"],45)
+
+		# A first run failing on a later page saves nothing
+		fake_salesforce.add_fault("GET",r"/query/\w+-200$",500)
+		self.assertEqual(self.sf.sync_object("Account",["Name"]),False)
+		self.assertEqual(self.sf.query_local("Account"),False)
+
+	def test_bulk_sync(self):
+		self.sf.bulk_chunk_size=200
+		rest=self.sf.sync_object("Case",["Subject"])
+		self.sf.reset_sync("Case")
+		self.assertEqual(self.sf.sync_object("Case",["Subject"],bulk=True),rest)
+		self.assertEqual(len(self.requests("POST","jobs/query")),1)
+		self.assertEqual(self.local_count("Case"),450)
+
+
+class LocalStoreTest(ServerTestCase):
+
+	def setUp(self):
+		ServerTestCase.setUp(self)
+		self.records=self.sf.query_SOQL(CASE_SOQL)
+
+	def by_id(self,records):
+		return sorted(records,key=lambda record: record["Id"])
+
+	def ids(self,records):
+		return sorted([ record["Id"] for record in records ])
+
+	def test_query_local_matches_query(self):
+		self.assertEqual(self.sf.load_local("cases",self.sf.iter_SOQL(CASE_SOQL),key="Id",indexes=["Account.Name",("Owner.Name","Subject")]),450)
+		self.assertEqual(self.sf.query_local("cases",order=["Id"]),self.by_id(self.records))
+
+		# The null values (every 7th Account) are matched like the python filters
+		for filters in (
+			[("Account.Name","<","Name 5")],
+			[("Account.Name",">=","Name 5")],
+			[("Account.Name","==",None)],
+			[("Account.Name","in",["Name 1",None])],
+			[("Account.Name","not in",["Name 1"])],
+			[("Account.Name","between",("Name 1","Name 3"))],
+			[("Subject","regex",r"^Subject 1\d$"),[("Owner.Name","!=",None),("Account.Name","<=","Name 2")]],
+			[("Account.Owner.Name","is not",None),("Subject","<","Subject 3")],
+		):
+			expected=self.sf.query_SOQL(CASE_SOQL,filters)
+			self.assertTrue(0<len(expected)<450,filters)
+			self.assertEqual(self.ids(self.sf.query_local("cases",filters,columns=["Id"])),self.ids(expected),filters)
+
+		record_id=fake_salesforce.record_id("Case",8)
+		self.assertEqual(self.sf.query_local("cases",[("Id","==",record_id)],columns=["Subject","Account.Name"]),[{"Subject":"Subject 8","Account.Name":"Name 8"}])
+		self.assertEqual(self.sf.query_local("cases",[("Id","==",record_id)],columns=["Subject"],rows=True)[0]["Subject"],"Subject 8")
+
+		# The invalid filters are reported before running the SQL
+		self.assertEqual(self.sf.query_local("cases",[("Subject","regex","(")]),False)
+		self.assertEqual(self.sf.query_local("cases",[("Subject","~","x")]),False)
+		self.assertEqual(self.sf.query_local("cases",[("Unknown","==","x")]),False)
+
+	def test_load_local_append(self):
+		self.assertEqual(self.sf.load_local("cases",self.records[:100],key="Id"),100)
+		self.assertEqual(self.sf.load_local("cases",self.records[50:150],key="Id",append=True),100)
+		self.assertEqual(self.sf.query_local("cases",order=["Id"]),self.by_id(self.records[:150]))
+
+		# The table is replaced unless append is True
+		self.assertEqual(self.sf.load_local("cases",self.records[:10],key="Id"),10)
+		self.assertEqual(len(self.sf.query_local("cases")),10)
+
+		# A query failing on a later page saves nothing
+		fake_salesforce.add_fault("GET",r"/query/\w+-200$",500)
+		self.assertEqual(self.sf.load_local("cases",self.sf.iter_SOQL(CASE_SOQL),key="Id"),False)
+		self.assertEqual(len(self.sf.query_local("cases")),10)
+
+	def test_index_local(self):
+		self.sf.load_local("cases",self.records)
+		self.assertEqual(self.sf.index_local("cases","Subject"),True)
+		self.assertEqual(self.sf.index_local("cases",("Account.Name","Owner.Name")),True)
+		self.assertEqual(self.sf.index_local("cases","Unknown"),False)
+
+		db=sqlite3.connect(self.sf.local_store_file)
+		try:
+			self.assertEqual(sorted([ row[1] for row in db.execute("PRAGMA index_list(cases)") ]),["index_cases_Account.Name_Owner.Name","index_cases_Subject"])
+			plan=db.execute("EXPLAIN QUERY PLAN SELECT * FROM cases WHERE (`Subject` IS ?)",("Subject 1",)).fetchall()
+			self.assertTrue("index_cases_Subject" in str(plan))
+		finally:
+			db.close()
+
+	def test_reset_sync(self):
+		self.sf.load_local("cases",self.records)
+		self.assertEqual(self.sf.reset_sync("cases"),True)
+		self.assertEqual(self.sf.query_local("cases"),False)
+
+		# The local store can't be opened
+		self.sf.local_store_file=self.sf.tmp_dir
+		self.assertEqual(self.sf.reset_sync("cases"),False)
+
+
+class FilterTest(ServerTestCase):
+
+	soql="SELECT Id,CaseNumber,Subject,Status,IsClosed FROM Case"
+
+	def check_filters(self,filters,expected):
+		records=self.sf.query_SOQL(self.soql)
+		expected_records=[ record for record in records if expected(record) ]
+		self.assertTrue(0<len(expected_records)<len(records))
+		self.assertEqual(self.sf.query_SOQL(self.soql,filters),expected_records)
+
+	def test_and_or_groups(self):
+		self.check_filters([("Status","==","New"),("IsClosed","==",True)],lambda record: record["Status"]=="New" and record["IsClosed"])
+		self.check_filters([[("Status","==","New"),("Status","==","Closed")]],lambda record: record["Status"] in ("New","Closed"))
+		self.check_filters([("IsClosed","is",False),[("Status","in",["New","Closed"]),("Subject","regex",r"^Subject 1\d$")]],lambda record: not record["IsClosed"] and (record["Status"] in ("New","Closed") or re.match(r"^Subject 1\d$",record["Subject"])))
+		self.check_filters([("CaseNumber","between",("00000010","00000020")),("Status","not in",["New"])],lambda record: "00000010"<=record["CaseNumber"]<="00000020" and record["Status"]!="New")
+
+	def test_legacy_filters(self):
+		# (column,"operator value") filters, the value is a python literal
+		self.check_filters([("Status","=='New'"),("CaseNumber","in ('00000010','00000020','00000021')")],lambda record: record["Status"]=="New" and record["CaseNumber"] in ("00000010","00000020","00000021"))
+		self.check_filters([("Subject","is not None"),("CaseNumber",">= '00000440'")],lambda record: record["CaseNumber"]>="00000440")
+		self.check_filters([[("Status","== 'Working'"),("IsClosed","is True")]],lambda record: record["Status"]=="Working" or record["IsClosed"])
+
+	def test_invalid_filters(self):
+		for filters in ([("Subject","regex","Subject (")],[("Subject","~","x")],[("Status","== New")],[("Status","like 'New'")],[("Status",)],[[("Status","==","New"),("Subject","regex","[")]]):
+			self.assertEqual(self.sf.query_SOQL(self.soql,filters),False)
+
+		# The filters are checked before the query runs
+		self.assertEqual(self.requests("GET","q="),[])
+
+
+class BulkTest(ServerTestCase):
+
+	def setUp(self):
+		ServerTestCase.setUp(self)
+		self.sf.bulk_chunk_size=100
+
+	def test_bulk_query(self):
+		for rows in (False,True):
+			records=self.sf.query_SOQL(CASE_SOQL,rows=rows)
+			del fake_salesforce.LOG[:]
+			self.assertEqual(self.sf.query_SOQL(CASE_SOQL,rows=rows,bulk=True),records)
+
+			# The job is created, checked, its 5 chunks are downloaded following the locators, then it is deleted
+			self.assertEqual([ (method,re.sub(r"750\w+","<job>",path)) for method,path in fake_salesforce.LOG ],[
+				("POST","/services/data/v35.0/jobs/query"),
+				("GET","/services/data/v35.0/jobs/query/<job>"),
+				("GET","/services/data/v35.0/jobs/query/<job>/results?maxRecords=100"),
+			]+[ ("GET","/services/data/v35.0/jobs/query/<job>/results?maxRecords=100&locator=%d" % i) for i in (100,200,300,400) ]+[
+				("DELETE","/services/data/v35.0/jobs/query/<job>"),
+			])
+			self.assertEqual(fake_salesforce.JOBS,{})
+
+	def test_job_state(self):
+		fake_salesforce.SETTINGS["job_polls"]=1
+		try:
+			self.assertEqual(len(self.sf.query_SOQL("SELECT Id FROM User LIMIT 5",bulk=True)),5)
+		finally:
+			fake_salesforce.SETTINGS["job_polls"]=0
+		self.assertEqual(len([ path for path in self.requests("GET","/jobs/query/") if "/results" not in path ]),2)
+
+		# A failed query job is reported
+		self.assertEqual(self.sf.query_SOQL("SELECT Id FROM Missing__c",bulk=True),False)
+
+	def test_bulk_threshold(self):
+		self.sf.bulk_threshold=400
+		self.sf.query_SOQL(CASE_SOQL)
+		self.assertEqual(len(self.requests("GET","SELECT+COUNT()+FROM+Case")),1)
+		self.assertEqual(len(self.requests("POST","jobs/query")),1)
+
+		# Not above the threshold, or not supported by the Bulk API
+		del fake_salesforce.LOG[:]
+		self.sf.query_SOQL(CASE_SOQL+" LIMIT 400")
+		self.sf.query_SOQL("SELECT Id,(SELECT Id FROM Cases) FROM Account")
+		self.assertEqual(self.requests("POST","jobs/query"),[])
+
+	def test_bulk_resume_csv(self):
+		expected=os.path.join(self.tmp_dir,"expected.csv")
+		out=os.path.join(self.tmp_dir,"resumed.csv")
+		self.sf.query_SOQL_to_CSV(CASE_SOQL,out=expected)
+
+		# The 4th chunk fails, the job is kept and the export continues from the saved locator
+		self.sf.bulk_threshold=100
+		fake_salesforce.add_fault("GET",r"/results\?maxRecords=100&locator=300$",500)
+		self.assertEqual(self.sf.query_SOQL_to_CSV(CASE_SOQL,out=out,resume=True),False)
+		self.assertEqual(len(fake_salesforce.JOBS),1)
+
+		del fake_salesforce.LOG[:]
+		self.assertEqual(self.sf.query_SOQL_to_CSV(CASE_SOQL,out=out,resume=True),450)
+		self.assertEqual(self.requests("POST","jobs/query"),[])
+		self.assertEqual(len(self.requests("GET","/results")),2)
+		self.assertEqual(fake_salesforce.JOBS,{})
+		self.assertEqual(self.read_csv(out),self.read_csv(expected))
+
+	def test_bulk_cache_key(self):
+		soql="SELECT Id,Name FROM Account LIMIT 10"
+		records=self.sf.query_SOQL(soql,bulk=True,cache=60)
+		self.assertEqual(self.sf.query_SOQL(soql,bulk=True,cache=60),records)
+		self.assertEqual(len(self.requests("POST","jobs/query")),1)
+
+		# The Bulk API result is not used for the REST API
+		self.assertEqual(self.sf.cached_query(self.sf.query_cache_key(soql,False),60),None)
+		self.sf.query_SOQL(soql,bulk=False,cache=60)
+		self.assertEqual(len(self.requests("GET","q=")),1)
+
+
+class BatchTest(ServerTestCase):
+
+	def test_query_SOQL_batch(self):
+		soqls=[ "SELECT Id,Name FROM User LIMIT %d" % (i+1) for i in range(28) ]+["SELECT Id FROM Missing__c",CASE_SOQL,"SELECT Id,Name,(SELECT Id,Subject FROM Cases) FROM Account LIMIT 20"]
+		results=self.sf.query_SOQL_batch(soqls)
+
+		# 31 queries in 2 Composite Batch requests, the next pages of the Cases are followed one by one
+		self.assertEqual(len(self.requests("POST","composite/batch")),2)
+		self.assertEqual(self.requests("GET","q="),[])
+		self.assertEqual(len(self.requests("GET","/query/")),4)
+
+		self.assertEqual(results[28],False)
+		for soql,records in zip(soqls,results):
+			if records is not False:
+				self.assertEqual(records,self.sf.query_SOQL(soql))
+
+	def test_batch_failed(self):
+		fake_salesforce.add_fault("POST","composite/batch",500,count=2)
+		self.assertEqual(self.sf.query_SOQL_batch(["SELECT Id FROM User","SELECT Id FROM Account"]),[False,False])
+		self.assertEqual(self.sf.batch_request(["sobjects"]),False)
+
+	def test_describe_objects(self):
+		describes=self.sf.describe_objects(["Case","Account","User","Missing__c"])
+		self.assertEqual(describes["Missing__c"],False)
+		self.assertEqual(describes["Case"],self.sf.describe_object("Case",print_fields=False,print_child_rel=False))
+		self.assertEqual([ relation["relationshipName"] for relation in describes["Account"][1] ],["Cases"])
+
+		# The describes are in the metadata cache
+		del fake_salesforce.LOG[:]
+		self.assertEqual(self.sf.describe_objects(["Case","Account"]),dict([ (name,describes[name]) for name in ("Case","Account") ]))
+		self.assertEqual(fake_salesforce.LOG,[])
+
+
+class FlattenTest(ServerTestCase):
+
+	def test_flatten_null_first_relation(self):
+		for rows in (False,True):
+			records=self.sf.query_SOQL(CASE_SOQL,rows=rows)
+			self.assertEqual(len(records),450)
+			keys=sorted(records[0].keys())
+			self.assertEqual(keys,["Account.Name","Account.Owner.Name","Id","Owner.Name","Subject"])
+			self.assertTrue(all([ sorted(record.keys())==keys for record in records ]))
+			self.assertEqual(records[0]["Account.Name"],None)
+			self.assertNotEqual(records[1]["Account.Name"],None)
+
+
+	def test_flatten_key_case(self):
+		# The keys have the case of the fields, whether the relations of the first record are null or not
+		expected=["Account.Name","Account.Owner.Name","Id","Owner.Name"]
+		for soql in ("SELECT id,account.name,ACCOUNT.OWNER.NAME,owner.name FROM Case","SELECT id,account.name,ACCOUNT.OWNER.NAME,owner.name FROM Case LIMIT 1"):
+			for rows in (False,True):
+				records=self.sf.query_SOQL(soql,rows=rows)
+				self.assertEqual(set([ tuple(sorted(record.keys())) for record in records ]),set([tuple(expected)]))
+
+		# From the records of the page, or from the describe of the Objects if the relation is null in all of them
+		self.assertEqual(sorted(self.requests("GET","/describe")),[ "/services/data/v35.0/sobjects/"+name+"/describe" for name in ("Account","Case","User") ])
+
+		out=os.path.join(self.tmp_dir,"cases.csv")
+		self.sf.query_SOQL_to_CSV("SELECT id,account.name,ACCOUNT.OWNER.NAME,owner.name FROM Case",out=out)
+		self.assertEqual(self.read_csv(out)[0],["Id","Account.Name","Account.Owner.Name","Owner.Name"])
+
+
+class SubqueryTest(ServerTestCase):
+
+	soql="SELECT Id,Name,(SELECT Id,CaseNumber FROM Cases) FROM Account"
+
+	# Each Account has 10 Cases (none for every 5th Account), returned 4 at a time so the next child pages are downloaded
+	def setUp(self):
+		ServerTestCase.setUp(self)
+		fake_salesforce.SETTINGS["child_page_size"]=4
+
+	def tearDown(self):
+		fake_salesforce.SETTINGS["child_page_size"]=20
+		ServerTestCase.tearDown(self)
+
+	def cases(self,parent):
+		return [ {"Id":fake_salesforce.record_id("Case",parent*10+j),"CaseNumber":"%08d" % (parent*10+j)} for j in range(10) ] if parent%5!=4 else []
+
+	# The distinct child pages requested (a failed query of a previous test might still have child requests running)
+	def child_requests(self):
+		return set([ path for method,path in fake_salesforce.LOG if method=="GET" and re.search(r"/query/\w+-[48]$",path) ])
+
+	def test_nested(self):
+		records=self.sf.query_SOQL(self.soql)
+		self.assertEqual(len(records),450)
+		self.assertEqual(records[2],{"Id":fake_salesforce.record_id("Account",2),"Name":"Name 2","Cases":self.cases(2)})
+		self.assertEqual([ record["Cases"] for record in records ],[ self.cases(i) for i in range(450) ])
+
+		# One query, and the next child pages of each Account having Cases (no query per Account)
+		self.assertEqual(len(self.requests("GET","q=")),1)
+		self.assertEqual(len(self.child_requests()),360*2)
+
+	def test_nested_typed(self):
+		records=self.sf.query_SOQL("SELECT Id,(SELECT Id,IsClosed,CreatedDate FROM Cases) FROM Account",typed=True)
+		self.assertEqual(records[1]["Cases"][3],{"Id":fake_salesforce.record_id("Case",13),"IsClosed":False,"CreatedDate":datetime.datetime(2016,2,14,13,13)})
+
+	def test_explode(self):
+		records=self.sf.query_SOQL(self.soql,children="explode")
+		self.assertEqual(len(records),360*10+90)
+		self.assertEqual(records[12],{"Id":fake_salesforce.record_id("Account",1),"Name":"Name 1","Cases.Id":fake_salesforce.record_id("Case",12),"Cases.CaseNumber":"00000012"})
+
+		# The Accounts without Cases are kept once with empty child columns
+		self.assertEqual(records[40],{"Id":fake_salesforce.record_id("Account",4),"Name":"Name 4","Cases.Id":None,"Cases.CaseNumber":None})
+
+		# The filters apply to the child columns
+		filtered=self.sf.query_SOQL(self.soql,[("Cases.CaseNumber","in",["00000025","00000026"])],children="explode",rows=True)
+		self.assertEqual([ (row["Id"],row["Cases.CaseNumber"]) for row in filtered ],[(fake_salesforce.record_id("Account",2),"00000025"),(fake_salesforce.record_id("Account",2),"00000026")])
+
+	def test_explode_csv(self):
+		out=os.path.join(self.tmp_dir,"accounts.csv")
+		self.assertEqual(self.sf.query_SOQL_to_CSV(self.soql,out=out),360*10+90)
+		rows=self.read_csv(out)
+		self.assertEqual(rows[0],["Id","Name","Cases.Id","Cases.CaseNumber"])
+		self.assertEqual(rows[13],[fake_salesforce.record_id("Account",1),"Name 1",fake_salesforce.record_id("Case",12),"00000012"])
+		self.assertEqual(rows[41],[fake_salesforce.record_id("Account",4),"Name 4","",""])
+
+	def test_failed_child_page(self):
+		fake_salesforce.add_fault("GET",r"/query/\w+-8$",500)
+		self.assertEqual(self.sf.query_SOQL(self.soql),False)
+		self.assertEqual(self.sf.query_SOQL(self.soql,children="flat"),False)
+
+
+class ExportTest(ServerTestCase):
+
+	def test_csv_columns_null_first_relation(self):
+		out=os.path.join(self.tmp_dir,"cases.csv")
+		self.assertEqual(self.sf.query_SOQL_to_CSV(CASE_SOQL,out=out),450)
+		rows=self.read_csv(out)
+		self.assertEqual(rows[0],["Id","Subject","Account.Name","Account.Owner.Name","Owner.Name"])
+		self.assertEqual(rows[1][2],"")
+		self.assertNotEqual(rows[2][2],"")
+
+	def test_resume_csv(self):
+		expected=os.path.join(self.tmp_dir,"expected.csv")
+		out=os.path.join(self.tmp_dir,"resumed.csv")
+		self.sf.query_SOQL_to_CSV(CASE_SOQL,out=expected)
+
+		# The 4th page fails (500 is not retried), then the export continues from the saved cursor
+		fake_salesforce.add_fault("GET",r"/query/\w+-300$",500)
+		self.assertEqual(self.sf.query_SOQL_to_CSV(CASE_SOQL,out=out,resume=True),False)
+		self.assertTrue(os.path.isfile(out+".state"))
+
+		del fake_salesforce.LOG[:]
+		self.sf.query_SOQL_to_CSV(CASE_SOQL,out=out,resume=True)
+		self.assertFalse(os.path.isfile(out+".state"))
+		self.assertEqual(self.requests("GET","q="),[])
+		self.assertEqual(self.read_csv(out),self.read_csv(expected))
+
+
+class TypedTest(ServerTestCase):
+
+	soql="SELECT Id,IsClosed,CreatedDate,Account.AnnualRevenue,Account.NumberOfEmployees FROM Case"
+
+	def test_typed_values(self):
+		records=self.sf.query_SOQL(self.soql,typed=True)
+		self.assertEqual(len(records),450)
+		self.assertEqual(records[30],{"Id":fake_salesforce.record_id("Case",30),"IsClosed":True,"CreatedDate":datetime.datetime(2016,7,3,6,30),"Account.AnnualRevenue":37.5,"Account.NumberOfEmployees":30})
+		self.assertTrue(type(records[31]["IsClosed"]) is bool)
+		self.assertTrue(type(records[31]["Account.NumberOfEmployees"]) is int)
+
+		# The null relations (every 7th Account) stay null
+		self.assertEqual(records[7]["Account.AnnualRevenue"],None)
+		self.assertEqual(records[7]["Account.NumberOfEmployees"],None)
+
+		# The dates and the percent fields
+		wide=self.sf.query_SOQL("SELECT Id,Field_003__c,Field_009__c FROM Wide__c",typed=True)
+		self.assertEqual(wide[30]["Field_003__c"],datetime.date(2016,7,3))
+		self.assertEqual(wide[30]["Field_009__c"],37.5)
+
+		# The records are not typed by default
+		self.assertEqual(self.sf.query_SOQL(self.soql)[30]["CreatedDate"],"2016-07-03T06:30:00.000+0000")
+
+	def test_bulk_typed(self):
+		rest=self.sf.query_SOQL(self.soql,typed=True)
+		self.sf.bulk_chunk_size=100
+		self.assertEqual(self.sf.query_SOQL(self.soql,typed=True,bulk=True),rest)
+
+	def test_typed_filters(self):
+		filters=[("CreatedDate",">=",datetime.datetime(2016,12,1)),("Account.NumberOfEmployees",">",100)]
+		expected=[ fake_salesforce.record_id("Case",i) for i in range(101,450) if i%12==11 and i%7!=0 ]
+		self.assertEqual([ record["Id"] for record in self.sf.query_SOQL(self.soql,filters,typed=True) ],expected)
+		self.assertEqual([ record["Id"] for record in self.sf.query_SOQL(self.soql,filters,typed=True,bulk=True) ],expected)
+
+	def test_typed_cache(self):
+		records=self.sf.query_SOQL(self.soql,typed=True)
+		self.assertEqual(self.sf.query_SOQL(self.soql,typed=True,cache=600),records)
+
+		# The cached result is converted again, and it is not changed by the conversion
+		del fake_salesforce.LOG[:]
+		self.assertEqual(self.sf.query_SOQL(self.soql,typed=True,cache=600),records)
+		self.assertEqual(self.sf.query_SOQL(self.soql,cache=600),self.sf.query_SOQL(self.soql))
+		self.assertEqual(len(self.requests("GET","q=")),1)
+
+	def test_typed_csv(self):
+		out=os.path.join(self.tmp_dir,"typed.csv")
+		self.assertEqual(self.sf.to_CSV(self.sf.iter_SOQL(self.soql,typed=True),out=out,order=["Id","CreatedDate","Account.AnnualRevenue"]),450)
+		self.assertEqual(self.read_csv(out)[31],[fake_salesforce.record_id("Case",30),"2016-07-03T06:30:00.000Z","37.5"])
+
+
+@unittest.skipIf(numpy is None,"numpy is not installed")
+class ColumnarTest(ServerTestCase):
+
+	soql="SELECT Id,IsClosed,CreatedDate,Account.Name,Account.AnnualRevenue,Account.NumberOfEmployees FROM Case"
+
+	def load(self,out):
+		with open(out,"rb") as npz_file:
+			return dict(numpy.load(npz_file).items())
+
+	def test_npz_types(self):
+		out=os.path.join(self.tmp_dir,"cases.npz")
+		self.assertEqual(self.sf.query_SOQL_to_columnar(self.soql,out=out),450)
+		arrays=self.load(out)
+
+		# Every 7th Account is null, saved as NaN (double) or in the "<column>.null" array
+		nulls=[ i%7==0 for i in range(450) ]
+		self.assertEqual(sorted(arrays.keys()),["Account.AnnualRevenue","Account.Name","Account.Name.null","Account.NumberOfEmployees","Account.NumberOfEmployees.null","CreatedDate","Id","IsClosed"])
+		self.assertEqual(arrays["IsClosed"].dtype,numpy.bool_)
+		self.assertEqual(arrays["IsClosed"].tolist(),[ i%2==0 for i in range(450) ])
+		self.assertEqual(arrays["CreatedDate"].dtype,numpy.dtype("datetime64[ms]"))
+		self.assertEqual(arrays["CreatedDate"][30],numpy.datetime64("2016-07-03T06:30:00.000"))
+		self.assertEqual(arrays["Account.NumberOfEmployees"].dtype,numpy.int64)
+		self.assertEqual(arrays["Account.NumberOfEmployees"].tolist(),[ 0 if null else i for i,null in enumerate(nulls) ])
+		self.assertEqual(arrays["Account.NumberOfEmployees.null"].tolist(),nulls)
+		self.assertEqual(numpy.isnan(arrays["Account.AnnualRevenue"]).tolist(),nulls)
+		self.assertEqual(arrays["Account.AnnualRevenue"][9],9*1.25)
+		self.assertEqual(arrays["Account.Name"][9],u"Name 9")
+		self.assertEqual(arrays["Account.Name.null"].tolist(),nulls)
+		self.assertEqual(arrays["Id"][9],fake_salesforce.record_id("Case",9))
+
+		# The Bulk API returns the values as text, they are converted to the same types
+		bulk_out=os.path.join(self.tmp_dir,"bulk.npz")
+		self.assertEqual(self.sf.query_SOQL_to_columnar(self.soql,out=bulk_out,bulk=True),450)
+		bulk_arrays=self.load(bulk_out)
+		self.assertEqual(sorted(bulk_arrays.keys()),sorted(arrays.keys()))
+		for column,array in arrays.items():
+			self.assertEqual(bulk_arrays[column].dtype,array.dtype,column)
+			numpy.testing.assert_array_equal(bulk_arrays[column],array)
+
+	def test_failed_query(self):
+		out=os.path.join(self.tmp_dir,"cases.npz")
+		fake_salesforce.add_fault("GET",r"/query/\w+-200$",500)
+		self.assertEqual(self.sf.query_SOQL_to_columnar(self.soql,out=out),False)
+		self.assertFalse(os.path.exists(out))
+
+	def test_invalid_format(self):
+		self.assertEqual(self.sf.query_SOQL_to_columnar(self.soql,out=os.path.join(self.tmp_dir,"cases.orc"),format="orc"),False)
+		if pyarrow is None:
+			self.assertEqual(self.sf.query_SOQL_to_columnar(self.soql,out=os.path.join(self.tmp_dir,"cases.parquet")),False)
+		self.assertEqual(self.requests("GET","q="),[])
+
+
+class RetryTest(ServerTestCase):
+
+	def test_get_retried(self):
+		fake_salesforce.add_fault("GET","q=",504)
+		records=self.sf.query_SOQL("SELECT Id,Name FROM User LIMIT 5")
+		self.assertEqual(len(records),5)
+		self.assertEqual(len(self.requests("GET","q=")),2)
+
+	def test_post_not_sent_again(self):
+		records=[ {"Subject":"Test "+str(i)} for i in range(3) ]
+
+		# The request might have been processed, the records are reported and not sent again
+		fake_salesforce.add_fault("POST","composite/sobjects",504)
+		results=self.sf.insert("Case",records)
+		self.assertEqual(len(self.requests("POST","composite/sobjects")),1)
+		self.assertEqual([ result["errors"][0]["statusCode"] for result in results ],["UNKNOWN_RESULT"]*3)
+
+		# The request was not processed, it is sent again
+		del fake_salesforce.LOG[:]
+		fake_salesforce.add_fault("POST","composite/sobjects",503)
+		results=self.sf.insert("Case",records)
+		self.assertEqual(len(self.requests("POST","composite/sobjects")),2)
+		self.assertTrue(all([ result["success"] for result in results ]))
+
+
+class QueryCacheTest(ServerTestCase):
+
+	def test_query_cache_key(self):
+		soql="SELECT Id,Name FROM Account LIMIT 10"
+		self.assertEqual(self.sf.query_cache_key(soql),self.sf.query_cache_key("select  Id, Name from Account limit 10"))
+		self.assertNotEqual(self.sf.query_cache_key(soql,False),self.sf.query_cache_key(soql,True))
+
+		first=self.sf.query_SOQL(soql,cache=60)
+		self.assertEqual(self.sf.query_SOQL(soql,cache=60),first)
+		self.assertEqual(len(self.requests("GET","q=")),1)
+
+		# The REST API result is not used for the Bulk API
+		self.assertEqual(self.sf.cached_query(self.sf.query_cache_key(soql,True),60),None)
+
+		self.sf.clear_query_cache(soql)
+		self.sf.query_SOQL(soql,cache=60)
+		self.assertEqual(len(self.requests("GET","q=")),2)
+
+	def test_memory_hit(self):
+		soqls=[ "SELECT Id FROM User LIMIT %d" % (i+1) for i in range(3) ]
+		self.sf.query_cache_size=2
+		first=self.sf.query_SOQL(soqls[0],cache=60)
+		self.sf.query_SOQL(soqls[1],cache=60)
+
+		# A result found in memory doesn't open the database
+		query_cache_db=self.sf.query_cache_db
+		self.sf.query_cache_db=None
+		self.assertEqual(self.sf.query_SOQL(soqls[0],cache=60),first)
+		self.sf.query_cache_db=query_cache_db
+
+		# Its last use is saved before the database is trimmed, so the least recently used result is removed
+		self.sf.query_SOQL(soqls[2],cache=60)
+		db=sqlite3.connect(self.sf.query_cache_file)
+		try:
+			self.assertEqual(sorted([ row[0] for row in db.execute("SELECT soql FROM query_cache") ]),[soqls[0],soqls[2]])
+		finally:
+			db.close()
+
+		# A new object finds the results in the database
+		other=connect(server_port(),self.tmp_dir)
+		del fake_salesforce.LOG[:]
+		self.assertEqual(other.query_SOQL(soqls[0],cache=60),first)
+		self.assertEqual(self.requests("GET","q="),[])
+
+
+
+class MetricsTest(ServerTestCase):
+
+	# connect() enables the metrics for the benchmarks
+	def setUp(self):
+		ServerTestCase.setUp(self)
+		self.sf.enable_metrics(False)
+
+	def test_metrics_report(self):
+		self.assertEqual(self.sf.metrics_report(),None)
+
+		self.sf.enable_metrics()
+		self.sf.query_SOQL(CASE_SOQL,[("Subject","regex",r"^Subject 1")])
+		report=self.sf.metrics_report()
+		self.assertEqual([ report[key] for key in ("requests","errors","retries","logins","queries","pages","records") ],[5,0,0,0,1,5,450])
+		self.assertTrue(report["bytes"]>0)
+		self.assertTrue(0<report["latency"]["p50"]<=report["latency"]["max"])
+		self.assertEqual(dict([ (name,stage["count"]) for name,stage in report["stages"].items() ]),{"decode":5,"flatten":5,"filter":5})
+
+		# The failed requests, the retries and the logins after the session expired: 504, retried with the expired session (401), login, then the query
+		self.sf.reset_metrics()
+		fake_salesforce.add_fault("GET","q=",504)
+		self.sf.__class__.sessions[self.sf.login_file]["session_id"]=self.sf.session_id="00D000000000001!EXPIRED"
+		self.assertEqual(len(self.sf.query_SOQL("SELECT Id FROM User LIMIT 3")),3)
+		report=self.sf.metrics_report(print_report=False)
+		self.assertEqual([ report[key] for key in ("requests","errors","retries","logins","queries","pages","records") ],[4,2,1,1,1,1,3])
+
+		# Disabled metrics are removed, and the stages are not timed anymore
+		self.sf.enable_metrics(False)
+		self.assertEqual(self.sf.metrics_report(),None)
+		stages=[]
+		self.sf.record_stage=lambda name,start: stages.append(name)
+		self.sf.query_SOQL(CASE_SOQL,[("Subject","regex",r"^Subject 1")])
+		self.assertEqual(stages,[])
+
+	def test_hooks(self):
+		events=[]
+		pages=[]
+		def all_events(event,info):
+			events.append(event)
+		def page_events(event,info):
+			pages.append((event,info))
+		def failing(event,info):
+			raise ValueError("failed")
+
+		self.sf.add_hook(all_events)
+		self.sf.add_hook(page_events,["page","query"])
+		self.sf.add_hook(failing,["query"])
+		self.assertEqual(len(self.sf.query_SOQL(CASE_SOQL,[("Subject","regex",r"^Subject 1")])),111)
+
+		self.assertEqual(sorted(set(events)),["page","query","request","stage"])
+		self.assertEqual(events.count("request"),5)
+		self.assertEqual([ event for event,info in pages ],["page"]*5+["query"])
+		self.assertEqual([ (info["records"],info["kept"]) for event,info in pages[:2] ],[(100,11),(100,100)])
+		self.assertEqual((pages[-1][1]["pages"],pages[-1][1]["records"]),(5,450))
+
+		# The removed hooks are not called anymore
+		self.sf.remove_hook(all_events)
+		self.sf.remove_hook(page_events)
+		self.sf.remove_hook(failing)
+		del events[:]
+		self.sf.query_SOQL(CASE_SOQL)
+		self.assertEqual(events,[])
+
+	def test_profile_query(self):
+		import pstats
+
+		out=os.path.join(self.tmp_dir,"query.prof")
+		self.assertEqual(self.sf.profile_query(CASE_SOQL,out=out,lines=0),self.sf.query_SOQL(CASE_SOQL))
+		functions=[ function[2] for function in pstats.Stats(out).stats.keys() ]
+		self.assertTrue("query_pages" in functions)
+		self.assertTrue("flatten_records" in functions)
+
+if __name__=="__main__":
+	unittest.main()
@@ -0,0 +1,268 @@
+#! /usr/bin/env python
+
+""" Benchmark suite for py_salesforce: runs scripted scenarios against the local stand-in server (fake_salesforce.py), so the results only depend on the code and can be compared between two versions. Each scenario runs with a new server and in a new python process, and reports its throughput, peak memory (RSS) and latency percentiles.
+
+ USAGE:
+	python benchmarks/run.py [--scenarios export,select_all,...] [--scale 1.0] [--latency 0.0] [--runs 1] [--json results.json] [--baseline results.json] [--threshold 10]
+
+	--scenarios: Comma separated scenarios to run, all by default (see SCENARIOS below).
+	--scale: Multiplies the number of records and queries of the scenarios, e.g. 0.05 for a quick run.
+	--latency: Seconds added to each request by the server, default 0 (measures the client only).
+	--runs: Number of runs of each scenario, the median of the runs is reported, default 1.
+	--json: Saves the results to a JSON file.
+	--baseline: Compares the results to a JSON file saved with --json (e.g. before a change), the scenarios whose throughput is lower, or whose peak memory is higher, by more than --threshold percent (default 10) are reported as regressions and the exit status is 1.
+
+ EXAMPLE:
+	git stash; python benchmarks/run.py --scale 0.1 --json before.json; git stash pop
+	python benchmarks/run.py --scale 0.1 --baseline before.json
+
+ The startup time (import, login and first query) is measured separately by startup.py."""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+
+BENCHMARKS_DIR=os.path.dirname(os.path.realpath(__file__))
+PACKAGE_DIR=os.path.dirname(BENCHMARKS_DIR)
+
+# Scenarios: description, settings of the server, and the number of records (or queries) before --scale
+SCENARIOS=[
+	("export","query_SOQL_to_CSV() of 1M Cases having Child-to-Parent relations",{"records":1000000},1000000),
+	("select_all","select_all() of an Object having 500 fields",{"records":20000,"wide_fields":500,"text_size":50},20000),
+	("small_queries","Many small query_SOQL() queries, one after the other",{"records":5,"page_size":2000},2000),
+	("batch_queries","The same small queries using query_SOQL_batch()",{"records":5,"page_size":2000},2000),
+	("describe","describe_object() of an Object having 500 fields, from salesforce then from the metadata cache",{"wide_fields":500},200),
+	("subqueries","query_SOQL() of Accounts having a Parent-to-Child subquery of 30 Cases",{"records":20000,"children":30,"child_page_size":20},20000),
+]
+
+
+def percentile(values,p):
+	values=sorted(values)
+	if not values:
+		return 0.0
+	return values[min(len(values)-1,int(round(p/100.0*(len(values)-1))))]
+
+
+def connect(port,tmp_dir):
+	""" This function creates a py_salesforce object connected to the local server, using a temporary directory for the session and the caches"""
+
+	sys.path.insert(0,PACKAGE_DIR)
+	from py_salesforce import py_salesforce
+
+	sf=py_salesforce(lazy=True)
+	sf.SOAP_url="http://127.0.0.1:%d/services/Soap/u/35.0" % port
+	sf.REST_url_ver="/services/data/v35.0/"
+	sf.username="benchmark"
+	sf.password="benchmark"
+	sf.tmp_dir=tmp_dir
+	sf.login_file=os.path.join(tmp_dir,"login.xml")
+	sf.metadata_dir=os.path.join(tmp_dir,"metadata")
+	sf.query_cache_file=os.path.join(tmp_dir,"query_cache.db")
+	sf.local_store_file=os.path.join(tmp_dir,"local_store.db")
+	sf.query_cache_ttl=0
+	sf.enable_metrics()
+	return sf
+
+
+def run_scenario(name,port,count):
+	""" This function runs a scenario in the current process (started by run_worker()) ... returns a dictionary having the results"""
+
+	tmp_dir=tempfile.mkdtemp()
+	try:
+		sf=connect(port,tmp_dir)
+		sf.session_id
+		sf.reset_metrics()
+
+		timings=[]
+		start=time.time()
+
+		if name=="export":
+			items=sf.query_SOQL_to_CSV("SELECT Id,CaseNumber,Subject,Status,Priority,IsClosed,Description,CreatedDate,ClosedDate,Account.Name,Account.Owner.Name,Owner.Name FROM Case",out=os.path.join(tmp_dir,"cases.csv"))
+			unit="records"
+
+		elif name=="select_all":
+			items=len(sf.select_all("Wide__c") or [])
+			unit="records"
+
+		elif name in ("small_queries","batch_queries"):
+			soqls=[ "SELECT Id,Subject,Status FROM Case WHERE CaseNumber='%08d' LIMIT 1" % i for i in range(count) ]
+			if name=="small_queries":
+				for soql in soqls:
+					query_start=time.time()
+					sf.query_SOQL(soql)
+					timings.append(time.time()-query_start)
+			else:
+				for i in range(0,count,200):
+					query_start=time.time()
+					sf.query_SOQL_batch(soqls[i:i+200])
+					timings.append(time.time()-query_start)
+			items=count
+			unit="queries"
+
+		elif name=="describe":
+			for i in range(count):
+				if i%10==0:
+					sf.clear_metadata_cache()
+				query_start=time.time()
+				sf.describe_object("Wide__c",print_fields=False,print_child_rel=False)
+				timings.append(time.time()-query_start)
+			items=count
+			unit="calls"
+
+		elif name=="subqueries":
+			items=0
+			for record in sf.iter_SOQL("SELECT Id,Name,Industry,(SELECT Id,CaseNumber,Subject,Status FROM Cases) FROM Account",rows=True):
+				if record is False:
+					break
+				items+=1+len(record["Cases"])
+			unit="records"
+
+		seconds=time.time()-start
+		report=sf.metrics_report(print_report=False)
+	finally:
+		shutil.rmtree(tmp_dir,ignore_errors=True)
+
+	import resource
+	peak=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	peak_mb=peak/1048576.0 if sys.platform=="darwin" else peak/1024.0
+
+	return {
+		"scenario":name,
+		"seconds":seconds,
+		"items":items if isinstance(items,(int,long)) else 0,
+		"unit":unit,
+		"throughput":(items/seconds if seconds and isinstance(items,(int,long)) else 0.0),
+		"peak_rss_mb":peak_mb,
+		"latency_ms":{
+			"p50":percentile(timings,50)*1000 if timings else report["latency"]["p50"],
+			"p90":percentile(timings,90)*1000 if timings else report["latency"]["p90"],
+			"p99":percentile(timings,99)*1000 if timings else report["latency"]["p99"],
+		},
+		"requests":report["requests"],
+		"stages":dict([ (stage,values["seconds"]) for stage,values in report["stages"].items() ]),
+	}
+
+
+def run_worker(name,port,count):
+	""" This function runs a scenario in a worker process and prints its results as JSON on the last line of stderr (the library prints on stdout)"""
+
+	result=run_scenario(name,port,count)
+	sys.stderr.write(json.dumps(result)+"\n")
+
+
+def start_server(settings,latency):
+	""" This function starts the local server in a new process ... returns the process and the port"""
+
+	arguments=[sys.executable,os.path.join(BENCHMARKS_DIR,"fake_salesforce.py"),"--port","0","--latency",str(latency)]
+	for key,value in settings.items():
+		arguments+=["--"+key.replace("_","-"),str(value)]
+
+	process=subprocess.Popen(arguments,stdout=subprocess.PIPE)
+	line=process.stdout.readline()
+	if not line.startswith("PORT "):
+		process.kill()
+		raise RuntimeError("The server didn't start")
+	return process,int(line.split()[1])
+
+
+def run(name,settings,count,latency):
+	""" This function runs a scenario with a new server and in a new process ... returns the results"""
+
+	server,port=start_server(settings,latency)
+	try:
+		process=subprocess.Popen([sys.executable,os.path.realpath(__file__),"--worker",name,"--port",str(port),"--count",str(count)],stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+		out,err=process.communicate()
+	finally:
+		server.kill()
+		server.wait()
+
+	if process.returncode!=0 or not err.strip():
+		print err
+		raise RuntimeError("The scenario "+name+" failed")
+	return json.loads(err.strip().splitlines()[-1])
+
+
+def median_result(results):
+	""" This function returns the result of the run having the median throughput"""
+
+	return sorted(results,key=lambda result: result["throughput"])[len(results)/2]
+
+
+def main():
+	parser=argparse.ArgumentParser(description="py_salesforce benchmark suite")
+	parser.add_argument("--scenarios",default=",".join([ scenario[0] for scenario in SCENARIOS ]))
+	parser.add_argument("--scale",type=float,default=1.0)
+	parser.add_argument("--latency",type=float,default=0.0)
+	parser.add_argument("--runs",type=int,default=1)
+	parser.add_argument("--json",default="")
+	parser.add_argument("--baseline",default="")
+	parser.add_argument("--threshold",type=float,default=10)
+	parser.add_argument("--worker",default="",help=argparse.SUPPRESS)
+	parser.add_argument("--port",type=int,default=0,help=argparse.SUPPRESS)
+	parser.add_argument("--count",type=int,default=0,help=argparse.SUPPRESS)
+	args=parser.parse_args()
+
+	if args.worker:
+		run_worker(args.worker,args.port,args.count)
+		return
+
+	names=args.scenarios.split(",")
+	unknown=[ name for name in names if name not in [ scenario[0] for scenario in SCENARIOS ] ]
+	if unknown:
+		print "ERROR: Unknown scenarios: "+", ".join(unknown)
+		sys.exit(2)
+
+	print "scale: "+str(args.scale)+", latency: "+str(args.latency)+" s, runs: "+str(args.runs)
+	print "%-14s %10s %14s %12s %10s %10s %10s %10s" % ("scenario","seconds","throughput","unit/sec","peak MB","p50 ms","p90 ms","p99 ms")
+
+	results={}
+	for name,description,settings,count in SCENARIOS:
+		if name not in names:
+			continue
+
+		# The records of the server follow the scale too
+		count=max(1,int(count*args.scale))
+		settings=dict(settings)
+		if name in ("export","select_all","subqueries"):
+			settings["records"]=count
+
+		result=median_result([ run(name,settings,count,args.latency) for i in range(args.runs) ])
+		result["description"]=description
+		results[name]=result
+		print "%-14s %10.2f %14.1f %12s %10.1f %10.1f %10.1f %10.1f" % (name,result["seconds"],result["throughput"],result["unit"],result["peak_rss_mb"],result["latency_ms"]["p50"],result["latency_ms"]["p90"],result["latency_ms"]["p99"])
+
+	if args.json:
+		with open(args.json,"w") as json_file:
+			json.dump({"scale":args.scale,"latency":args.latency,"results":results},json_file,indent=2,sort_keys=True)
+
+	if args.baseline:
+		with open(args.baseline) as json_file:
+			baseline=json.load(json_file)
+		if baseline.get("scale")!=args.scale or baseline.get("latency")!=args.latency:
+			print "WARNING: The baseline was run with scale "+str(baseline.get("scale"))+" and latency "+str(baseline.get("latency"))
+
+		print ""
+		print "%-14s %16s %16s" % ("scenario","throughput","peak MB")
+		regressions=[]
+		for name,result in sorted(results.items()):
+			before=baseline["results"].get(name)
+			if before is None:
+				continue
+			throughput=(result["throughput"]/before["throughput"]-1)*100 if before["throughput"] else 0.0
+			memory=(result["peak_rss_mb"]/before["peak_rss_mb"]-1)*100 if before["peak_rss_mb"] else 0.0
+			regression=throughput<-args.threshold or memory>args.threshold
+			if regression:
+				regressions.append(name)
+			print "%-14s %+15.1f%% %+15.1f%%%s" % (name,throughput,memory,"   REGRESSION" if regression else "")
+
+		if regressions:
+			sys.exit(1)
+
+
+if __name__=="__main__":
+	main()
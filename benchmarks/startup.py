@@ -0,0 +1,96 @@
+#! /usr/bin/env python
+
+""" Startup benchmark for py_salesforce: measures the time to import the package, to create the py_salesforce object, and to run the first query, each run in a new python process.
+
+ USAGE:
+	python benchmarks/startup.py [--runs N] [--lazy] [--soql "SELECT Id FROM Case LIMIT 1"] [--fake] [--latency 0.05]
+
+	--runs: Number of runs (processes), default 10.
+	--lazy: Create the object with lazy=True (the login is done on the first query).
+	--soql: Query to run after creating the object, the first query is not measured if not set.
+	--fake: Use the local stand-in server (fake_salesforce.py) instead of the org, each run logs in again. The query is "SELECT Id FROM Case LIMIT 1" if --soql is not set.
+	--latency: Seconds added to each request by the local server (with --fake), default 0.
+
+ Run it once with and once without --lazy (or before and after a change) to compare the startup latency.
+ Without --fake, the configured credentials (py_salesforce.conf or tmp/login.xml) are used, so the first query needs a working org."""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+import argparse
+
+from run import percentile,start_server
+
+# Script run in each process, it prints the timings as JSON
+RUN=r"""
+import os, sys, time, json
+start=time.time()
+sys.path.insert(0,%(path)r)
+from py_salesforce import py_salesforce
+imported=time.time()
+if %(port)r:
+	# Use the local server, the object is connected to it before logging in
+	sf=py_salesforce(lazy=True)
+	sf.SOAP_url="http://127.0.0.1:%%d/services/Soap/u/35.0" %% %(port)r
+	sf.REST_url_ver="/services/data/v35.0/"
+	sf.username=sf.password="benchmark"
+	sf.tmp_dir=%(tmp_dir)r
+	sf.login_file=os.path.join(sf.tmp_dir,"login.xml")
+	sf.metadata_dir=os.path.join(sf.tmp_dir,"metadata")
+	if not %(lazy)r:
+		sf.session_id
+else:
+	sf=py_salesforce(lazy=%(lazy)r)
+created=time.time()
+if %(soql)r:
+	sf.query_SOQL(%(soql)r,prefetch=0)
+queried=time.time()
+sys.stderr.write(json.dumps({"import":imported-start,"create":created-imported,"first_query":queried-created,"total":queried-start})+"\n")
+"""
+
+
+def main():
+	parser=argparse.ArgumentParser(description="py_salesforce startup benchmark")
+	parser.add_argument("--runs",type=int,default=10)
+	parser.add_argument("--lazy",action="store_true")
+	parser.add_argument("--soql",default="")
+	parser.add_argument("--fake",action="store_true")
+	parser.add_argument("--latency",type=float,default=0.0)
+	args=parser.parse_args()
+
+	path=os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+	server=None
+	port=0
+	if args.fake:
+		server,port=start_server({},args.latency)
+		args.soql=args.soql or "SELECT Id FROM Case LIMIT 1"
+
+	timings=[]
+	try:
+		for i in range(args.runs):
+			tmp_dir=tempfile.mkdtemp()
+			code=RUN % {"path":path,"lazy":args.lazy,"soql":args.soql,"port":port,"tmp_dir":tmp_dir}
+			process=subprocess.Popen([sys.executable,"-c",code],stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+			out,err=process.communicate()
+			shutil.rmtree(tmp_dir,ignore_errors=True)
+			if process.returncode!=0:
+				print err
+				sys.exit(1)
+			timings.append(json.loads(err.strip().splitlines()[-1]))
+	finally:
+		if server is not None:
+			server.kill()
+			server.wait()
+
+	print "mode: "+("lazy" if args.lazy else "eager")+(", local server" if args.fake else "")+", runs: "+str(args.runs)
+	for stage in ("import","create","first_query","total"):
+		values=[ t[stage]*1000 for t in timings ]
+		print "%-12s median %8.1f ms   p90 %8.1f ms   min %8.1f ms" % (stage,percentile(values,50),percentile(values,90),min(values))
+
+
+if __name__=="__main__":
+	main()
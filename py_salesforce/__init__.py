@@ -28,4 +28,4 @@
 
 
 
-from py_salesforce import py_salesforce
+from py_salesforce import py_salesforce, record_row
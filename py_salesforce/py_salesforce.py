@@ -10,14 +10,21 @@
 	7- Can be used to show all available SOQL Objects, and to search for specific Objects.
  	8- Can be used to describe an SOQL Object, and show all fields (columns), parent relations and child relations.	
  	9- Supports exporting the output of the Query to a CSV file.
+	10- Supports streaming the records of large queries page by page, without keeping all the records in memory.
+	11- Supports splitting large queries into chunks (ranges of Ids or dates) that run in parallel.
+	12- Supports running many queries at the same time in the background.
+	13- Supports running large queries using the Bulk API 2.0.
+	14- Supports caching the results of repeated queries (in memory and on disk).
+	15- Supports incremental synchronization of Objects to a local store, downloading only the modified records.
+	16- Supports saving records in an indexed local store and filtering them many times without running the query again.
+	17- Supports exporting the output of the Query to typed columnar files (Parquet, Arrow or NumPy).
+	18- Supports creating, updating, upserting and deleting records in batches of 200 records running in parallel.
+	19- Supports Parent-to-Child relations (subqueries) in queries, the child records are nested in their parent record or exploded to a record per child record.
+	20- Supports recording the metrics of the requests and of the stages of the queries, hooks called on each event, and profiling a query.
+	21- Supports decoding the responses using a faster JSON library (simplejson or ujson) when installed.
 
 	For more information about the Salesforce REST API refer to https://developer.salesforce.com/docs/atlas.en-us.api_rest.meta/api_rest/intro_what_is_rest_api.htm
 	For more information about SOQL refer to https://developer.salesforce.com/docs/atlas.en-us.soql_sosl.meta/soql_sosl/sforce_api_calls_soql.htm
- 
-
-	TODO:
-	1- Parent-to-Child relations support.
-	2- Create and Edit object.
 
  AUTHOR: 	Mohamed Osama (mohamed.osama.aboelkheir@gmail.com)
  CREATED: 	Fri 27-Nov-2015
@@ -31,21 +38,143 @@
 import os
 import sys
 import re
-from xml.dom import minidom
-import httplib2
 import json
-import ConfigParser
-import getpass
 import collections
+import operator
+import threading
+import Queue
+import datetime
+import time
+
+# The other modules (httplib2, ConfigParser, minidom, csv, multiprocessing ...) are imported when first used, to keep the import fast
+
+class record_row(object):
+	""" A record returned by the queries when rows=True. It works like a dictionary (record["Case.CaseNumber"], get(), keys(), items() ...), but the column names (header) are shared by all the records of the query, so it uses much less memory than a dictionary."""
+
+	__slots__=("header","values")
+
+	def __init__(self,header,values):
+		self.header=header
+		self.values=values
+
+	def __getitem__(self,key):
+		return self.values[self.header[key]]
+
+	def __setitem__(self,key,value):
+		self.values[self.header[key]]=value
+
+	def __contains__(self,key):
+		return key in self.header
+
+	def __iter__(self):
+		return iter(self.keys())
+
+	def __len__(self):
+		return len(self.values)
+
+	def __eq__(self,other):
+		return dict(self.items())==(dict(other.items()) if isinstance(other,record_row) else other)
+
+	def __ne__(self,other):
+		return not self==other
+
+	def __repr__(self):
+		return "record_row("+repr(dict(self.items()))+")"
+
+	def get(self,key,default=None):
+		index=self.header.get(key)
+		return default if index is None else self.values[index]
+
+	def has_key(self,key):
+		return key in self.header
+
+	def keys(self):
+		return sorted(self.header,key=self.header.get)
+
+	def items(self):
+		return zip(self.keys(),self.values)
+
+	def tuple(self):
+		""" This function returns the values of the record as a tuple, in the same order as keys()"""
+		return tuple(self.values)
+
 
-try:
-	import csv
-except ImportError:
-	pass
 
 class py_salesforce:
 
-	def __init__(self):
+	# Sessions shared by all the instances, and the locks taken to log in, by login file
+	sessions={}
+	sessions_lock=threading.Lock()
+	session_locks={}
+
+	# Semaphores limiting the concurrent requests to each org (shared by all the instances)
+	org_semaphores={}
+	org_semaphores_lock=threading.Lock()
+
+	# Request rate limit (token bucket) and last API usage (Sforce-Limit-Info header) of each org, shared by all the instances
+	org_rate_limits={}
+	org_api_usage={}
+	org_rate_limits_lock=threading.Lock()
+
+	# Errors that are retried (REQUEST_LIMIT_EXCEEDED is not retried when the daily limit is reached)
+	retry_statuses=("429","502","503","504")
+	retry_error_codes=("REQUEST_LIMIT_EXCEEDED","SERVER_UNAVAILABLE")
+
+	# Errors meaning that the request was not processed, the only ones retried for the requests that are not idempotent (POST, PATCH, DELETE), a 502 or 504 might come after the changes were saved
+	retry_unprocessed_statuses=("429","503")
+	retry_unprocessed_error_codes=("REQUEST_LIMIT_EXCEEDED",)
+
+	# Operators supported in the filters
+	filter_operators={
+		"==":operator.eq,
+		"!=":operator.ne,
+		"<":operator.lt,
+		"<=":operator.le,
+		">":operator.gt,
+		">=":operator.ge,
+		"is":operator.is_,
+		"is not":operator.is_not,
+		"in":lambda value,values: value in values,
+		"not in":lambda value,values: value not in values,
+		"between":lambda value,limits: limits[0] <= value <= limits[1],
+	}
+
+	# SQL operators of the filters used on the local store ("in", "not in" and "between" are converted separately)
+	sql_operators={
+		"==":"IS",
+		"!=":"IS NOT",
+		"<":"<",
+		"<=":"<=",
+		">":">",
+		">=":">=",
+		"is":"IS",
+		"is not":"IS NOT",
+		"regex":"REGEXP",
+	}
+
+	# Salesforce field types that are not saved as text by the typed exports (e.g. to_columnar())
+	typed_fields={
+		"boolean":"boolean",
+		"int":"int",
+		"long":"int",
+		"double":"double",
+		"currency":"double",
+		"percent":"double",
+		"date":"date",
+		"datetime":"datetime",
+	}
+
+	# Characters of the Salesforce Ids (base 62) in sort order
+	id_chars="0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+
+	def __init__(self,lazy=False):
+		""" This function creates the connection to salesforce, it logs in (or uses the saved session) immediately.
+ARGUMENTS:
+
+	lazy: If True, the login is done on the first request instead, this makes creating the object faster for short scripts.
+"""
+
+		import ConfigParser
 
 		#read config file to get urls
 		self.Login_retries=3
@@ -61,33 +190,157 @@ class py_salesforce:
 			self.REST_url_ver=config.get("py_salesforce","REST_URL_VER") if "REST_URL_VER".lower() in options else "/services/data/v35.0/"
 			self.username=config.get("py_salesforce","username") if "username" in options else ""
 			self.password=config.get("py_salesforce","password") if "password" in options else ""
+			self.prefetch_pages=config.getint("py_salesforce","PREFETCH_PAGES") if "PREFETCH_PAGES".lower() in options else 1
+			self.max_concurrent_requests=config.getint("py_salesforce","MAX_CONCURRENT_REQUESTS") if "MAX_CONCURRENT_REQUESTS".lower() in options else 10
+			self.chunk_workers=config.getint("py_salesforce","CHUNK_WORKERS") if "CHUNK_WORKERS".lower() in options else 4
+			self.http_pool_size=config.getint("py_salesforce","HTTP_POOL_SIZE") if "HTTP_POOL_SIZE".lower() in options else 10
+			self.metadata_cache_ttl=config.getint("py_salesforce","METADATA_CACHE_TTL") if "METADATA_CACHE_TTL".lower() in options else 86400
+			self.metadata_cache_size=config.getint("py_salesforce","METADATA_CACHE_SIZE") if "METADATA_CACHE_SIZE".lower() in options else 200
+			self.latest_REST_url_ver=config.get("py_salesforce","LATEST_URL_VER") if "LATEST_URL_VER".lower() in options else "/services/data/v47.0/"
+			self.bulk_threshold=config.getint("py_salesforce","BULK_THRESHOLD") if "BULK_THRESHOLD".lower() in options else 0
+			self.bulk_chunk_size=config.getint("py_salesforce","BULK_CHUNK_SIZE") if "BULK_CHUNK_SIZE".lower() in options else 50000
+			self.bulk_poll_max=config.getfloat("py_salesforce","BULK_POLL_MAX") if "BULK_POLL_MAX".lower() in options else 30
+			self.query_cache_ttl=config.getint("py_salesforce","QUERY_CACHE_TTL") if "QUERY_CACHE_TTL".lower() in options else 0
+			self.query_cache_size=config.getint("py_salesforce","QUERY_CACHE_SIZE") if "QUERY_CACHE_SIZE".lower() in options else 50
+			self.query_cache_max_records=config.getint("py_salesforce","QUERY_CACHE_MAX_RECORDS") if "QUERY_CACHE_MAX_RECORDS".lower() in options else 100000
+			self.max_retries=config.getint("py_salesforce","MAX_RETRIES") if "MAX_RETRIES".lower() in options else 5
+			self.retry_delay=config.getfloat("py_salesforce","RETRY_DELAY") if "RETRY_DELAY".lower() in options else 1
+			self.retry_max_delay=config.getfloat("py_salesforce","RETRY_MAX_DELAY") if "RETRY_MAX_DELAY".lower() in options else 60
+			self.requests_per_second=config.getfloat("py_salesforce","REQUESTS_PER_SECOND") if "REQUESTS_PER_SECOND".lower() in options else 0
+			self.api_usage_max=config.getfloat("py_salesforce","API_USAGE_MAX") if "API_USAGE_MAX".lower() in options else 0
+			metrics=config.getboolean("py_salesforce","METRICS") if "METRICS".lower() in options else False
+			json_decoder=config.get("py_salesforce","JSON_DECODER") if "JSON_DECODER".lower() in options else "auto"
 		except Exception as err:
 			print "WARNING: Couldn't read config file, using default values"
 			print err
 			self.SOAP_url="https://login.salesforce.com/services/Soap/u/35.0"
 			self.REST_url_ver="/services/data/v35.0/"
+			self.prefetch_pages=1
+			self.max_concurrent_requests=10
+			self.chunk_workers=4
+			self.http_pool_size=10
+			self.metadata_cache_ttl=86400
+			self.metadata_cache_size=200
+			self.latest_REST_url_ver="/services/data/v47.0/"
+			self.bulk_threshold=0
+			self.bulk_chunk_size=50000
+			self.bulk_poll_max=30
+			self.query_cache_ttl=0
+			self.query_cache_size=50
+			self.query_cache_max_records=100000
+			self.max_retries=5
+			self.retry_delay=1
+			self.retry_max_delay=60
+			self.requests_per_second=0
+			self.api_usage_max=0
+			metrics=False
+			json_decoder="auto"
 			#sys.exit(1)
 
-		self.login()
+		# Pool of persistent (keep-alive) connections shared by all the requests
+		self.http_pool=Queue.Queue()
+		self.http_pool_created=0
+		self.http_pool_lock=threading.Lock()
+
+		# Thread pool running the asynchronous requests (created on first use)
+		self.async_workers=None
+
+		# Cache of the describe and sobjects metadata (in memory and in tmp/metadata)
+		self.metadata_dir=os.path.join(self.tmp_dir,"metadata")
+		self.metadata_cache=collections.OrderedDict()
+		self.metadata_lock=threading.Lock()
+
+		# Cache of the query results (in memory and in tmp/query_cache.db)
+		self.query_cache_file=os.path.join(self.tmp_dir,"query_cache.db")
+		self.query_cache=collections.OrderedDict()
+		self.query_cache_lock=threading.Lock()
+
+		# Local copy of the synchronized Objects (see sync_object())
+		self.local_store_file=os.path.join(self.tmp_dir,"local_store.db")
+
+		# Metrics of the requests and of the query stages (see metrics_report()), and the functions called on each event (see add_hook())
+		self.metrics=None
+		self.metrics_lock=threading.Lock()
+		self.hooks=[]
+		if metrics:
+			self.reset_metrics()
+
+		# Function decoding the JSON responses, the fastest installed library is chosen on first use (see set_json_decoder())
+		self.json_loads=None
+		self.json_decoder="auto"
+		if not self.set_json_decoder(json_decoder):
+			print "WARNING: Using the default JSON decoder"
+			self.set_json_decoder("auto")
+
+		# State of the last request of each thread (see rest_request())
+		self.request_state=threading.local()
+
+		self.login_lock=threading.RLock()
+		self.logged_in=not lazy
+		if not lazy:
+			self.login()
+
+
+
+	# (Internal usage) This function logs in on first use when the object is created with lazy=True
+	def __getattr__(self,name):
+		"""(Internal usage) This function logs in when the session information is used for the first time (when the object is created with lazy=True)"""
+
+		if name in ("session_id","server_url","REST_url","latest_REST_url","user_id","user_name") and "login_lock" in self.__dict__:
+			with self.login_lock:
+				if not self.logged_in:
+					self.logged_in=True
+					try:
+						self.login()
+					except:
+						self.logged_in=False
+						raise
+			if name in self.__dict__:
+				return self.__dict__[name]
+
+		raise AttributeError(name)
 
 
 
 	# (Internal usage) This function checks for session status and start new session if needed
 	def login(self):
-		"""(Internal usage) This function checks for session status and start new session if needed"""
+		"""(Internal usage) This function checks for session status and start new session if needed, the threads and instances using the same login file log in only once"""
 
 		# Check for the tmp dir, if not present create it 
 		if not os.path.isdir(self.tmp_dir):
 			os.makedirs(self.tmp_dir)
-		
-		# Check if login_file exists
-		if not os.path.isfile(self.login_file):
-			if self.session_request():
-				self.session_info()
+
+		# Use the session already loaded by another instance
+		with py_salesforce.sessions_lock:
+			session=py_salesforce.sessions.get(self.login_file)
+		if session is not None:
+			self.apply_session(session)
+			return
+
+		# Only one thread logs in or reads the login file at a time, the others use its session
+		with self.session_lock():
+			with py_salesforce.sessions_lock:
+				session=py_salesforce.sessions.get(self.login_file)
+			if session is not None:
+				self.apply_session(session)
+
+			# Check if login_file exists
+			elif not os.path.isfile(self.login_file):
+				if self.session_request():
+					self.session_info()
+				else:
+					sys.exit(1)
 			else:
-				sys.exit(1)
-		else:
-			self.session_info()
+				self.session_info()
+
+
+
+	# (Internal usage) This function returns the lock of the login file
+	def session_lock(self):
+		"""(Internal usage) This function returns the lock taken to log in (see login() and refresh_session()), there is one lock for each login file shared by all the instances"""
+
+		with py_salesforce.sessions_lock:
+			return py_salesforce.session_locks.setdefault(self.login_file,threading.Lock())
 
 
 	
@@ -104,6 +357,8 @@ class py_salesforce:
 				username=self.username
 				password=self.password
 			else:
+				import getpass
+
 				#Prompt user for credentials 
 				username=raw_input("Username: ")
 				password=getpass.getpass("Password: ")
@@ -123,23 +378,23 @@ xmlns:env="http://schemas.xmlsoap.org/soap/envelope/"> \
 
 
 			# Run request
-			http = httplib2.Http()
-
 			url = self.SOAP_url   
 			headers = {'Content-Type': 'text/xml; charset=UTF-8' , 'SOAPAction' : 'login'}
 			try:
-				response, content = http.request(url, 'POST', headers=headers, body=body)
+				response, content = self.http_request(url, 'POST', headers=headers, body=body)
 			except Exception as err:
 				print "ERROR: could not connect to server"
 				print err
 				continue
 
 			if response["status"] == "200": 
-				open(self.login_file,"w").write(content)
+				self.write_file(self.login_file,content)
 				success=True
 				print "<< LOGIN SUCCESS >>"
 				break
 			else:
+				from xml.dom import minidom
+
 				response_xml= minidom.parseString(content) 
 				print ">> LOGIN FAILED!! <<"
 				fault_code=response_xml.getElementsByTagName("faultcode")
@@ -158,340 +413,3801 @@ xmlns:env="http://schemas.xmlsoap.org/soap/envelope/"> \
 	# (Internal usage) This function reads saved session information
 	def session_info(self):
 		"""(Internal usage) This function reads saved session information"""
+
+		from xml.sax import saxutils
 		
-		login_xml = minidom.parse(self.login_file)
+		# The values are found with regular expressions instead of parsing the whole XML document
+		with open(self.login_file) as login_file:
+			login_xml = login_file.read().decode('utf8')
+
+		def element(name):
+			match=re.search(r"<(?:\w+:)?"+name+r"(?:\s[^>]*)?>([^<]*)</",login_xml)
+			return saxutils.unescape(match.group(1),{"&quot;":'"',"&apos;":"'"}) if match else None
 
 		# Get session ID
-		session_id_element=login_xml.getElementsByTagName("sessionId")
-		if len(session_id_element) > 0:
-			self.session_id = session_id_element[0].childNodes[0].data	
-		else:
+		self.session_id = element("sessionId")
+		if self.session_id is None:
 			print "ERROR: Session ID not found"
 			sys.exit(1)
 
 		# Get Server URL
-		server_url_element=login_xml.getElementsByTagName("serverUrl")
-		if len(server_url_element) > 0:
+		server_url = element("serverUrl")
+		if server_url is not None:
 			pattern = re.compile('(.*://[^/]+)/.*')
-			self.server_url = server_url_element[0].childNodes[0].data	
-			self.server_url = pattern.search(self.server_url).group(1)
+			self.server_url = pattern.search(server_url).group(1)
 			self.REST_url = self.server_url+self.REST_url_ver 
+			self.latest_REST_url = self.server_url+self.latest_REST_url_ver 
 		else:
 			print "ERROR: Server URL not found"
 			sys.exit(1)
 
-		# Get User ID
-		user_id_element=login_xml.getElementsByTagName("userId")
-		if len(user_id_element) > 0:
-			self.user_id = user_id_element[0].childNodes[0].data	
+		# Get User ID
+		user_id = element("userId")
+		if user_id is not None:
+			self.user_id = user_id
+
+		# Get User Name
+		user_name = element("userFullName")
+		if user_name is not None:
+			self.user_name = user_name
+
+		# Share the session with the other instances
+		with py_salesforce.sessions_lock:
+			py_salesforce.sessions[self.login_file]={
+				"session_id":self.session_id,
+				"server_url":self.server_url,
+				"user_id":getattr(self,"user_id",None),
+				"user_name":getattr(self,"user_name",None),
+			}
+
+
+
+	# (Internal usage) This function uses a session shared by another instance
+	def apply_session(self,session):
+		"""(Internal usage) This function uses the session information shared by another instance, without reading the login file"""
+
+		self.session_id = session["session_id"]
+		self.server_url = session["server_url"]
+		self.REST_url = self.server_url+self.REST_url_ver 
+		self.latest_REST_url = self.server_url+self.latest_REST_url_ver 
+		if session["user_id"] is not None:
+			self.user_id = session["user_id"]
+		if session["user_name"] is not None:
+			self.user_name = session["user_name"]
+
+
+
+	# (Internal usage) This function starts a new session when the session expires
+	def refresh_session(self,expired_session_id):
+		"""(Internal usage) This function starts a new session when the session expires. Only one thread logs in at a time, if another thread or instance already started a new session (replacing expired_session_id) it is used instead of logging in again ... returns boolean"""
+
+		with self.session_lock():
+			with py_salesforce.sessions_lock:
+				session=py_salesforce.sessions.get(self.login_file)
+			if session is not None and session["session_id"]!=expired_session_id:
+				self.apply_session(session)
+				return True
+
+			if self.session_request():
+				self.session_info()
+				self.emit("login",{"expired_session":True})
+				return True
+
+			return False
+
+
+
+	# (Internal usage) This function writes a file atomically
+	def write_file(self,path,content):
+		"""(Internal usage) This function writes a file atomically, the content is written to a temporary file which is then renamed, so readers never see a partially written file. On Windows, where the rename fails if the file exists, the file is removed first"""
+
+		tmp_path=path+"."+str(os.getpid())+"."+str(threading.current_thread().ident)
+		with open(tmp_path,"w") as tmp_file:
+			tmp_file.write(content)
+		try:
+			os.rename(tmp_path,path)
+		except OSError:
+			if os.name!="nt" or not os.path.exists(path):
+				raise
+			os.remove(path)
+			os.rename(tmp_path,path)
+
+
+
+	# (Internal usage) This function runs an HTTP request using the connection pool
+	def http_request(self,url,method="GET",headers={},body=None):
+		"""(Internal usage) This function runs an HTTP request using a connection from the pool, so the TCP and TLS connections are reused between requests. The pool is thread safe and holds up to HTTP_POOL_SIZE connections (config file) ... returns the response and the content"""
+
+		import httplib2
+
+		headers=dict(headers)
+		headers.setdefault('Accept-Encoding','gzip, deflate')
+
+		instrumented=self.metrics is not None or self.hooks
+
+		# Get a connection from the pool, or create a new one if the pool is not full
+		try:
+			http=self.http_pool.get_nowait()
+		except Queue.Empty:
+			with self.http_pool_lock:
+				create=self.http_pool_created<self.http_pool_size
+				if create:
+					self.http_pool_created+=1
+			http=httplib2.Http() if create else self.http_pool.get()
+
+		start=time.time() if instrumented else 0
+		broken=True
+		try:
+			response, content = http.request(url, method, headers=headers, body=body)
+			broken=False
+		except Exception as err:
+			if instrumented:
+				self.emit("request",{"method":method,"url":url,"status":None,"seconds":time.time()-start,"bytes":0,"error":str(err)})
+			raise
+		finally:
+			# Don't reuse a connection that might be broken, a new one takes its place so the threads waiting for a connection are woken
+			self.http_pool.put(httplib2.Http() if broken else http)
+
+		if instrumented:
+			self.emit("request",{"method":method,"url":url,"status":response.status,"seconds":time.time()-start,"bytes":len(content)})
+		return response, content
+
+
+
+	# (Internal usage) This function returns the semaphore limiting the concurrent requests to the org
+	def org_semaphore(self):
+		"""(Internal usage) This function returns the semaphore limiting the concurrent requests to the org, the limit is set by the MAX_CONCURRENT_REQUESTS config value and is shared by all the instances connected to the same org"""
+
+		with py_salesforce.org_semaphores_lock:
+			if self.server_url not in py_salesforce.org_semaphores:
+				py_salesforce.org_semaphores[self.server_url]=threading.BoundedSemaphore(self.max_concurrent_requests)
+			return py_salesforce.org_semaphores[self.server_url]
+
+
+
+	# (Internal usage) This function runs a GET request and returns the parsed JSON content
+	def get_json(self,url):
+		"""(Internal usage) This function runs a GET request and handles the session expiry ... returns the parsed JSON content if successful and returns False if failed """
+
+		result=self.request_json(url)
+		if result is False:
+			return False
+
+		return result[1]
+
+
+
+	# (Internal usage) This function runs a GET request and returns the response and the parsed JSON content
+	def request_json(self,url,extra_headers={},method="GET",body=None):
+		"""(Internal usage) This function runs a request with optional extra headers (e.g. If-Modified-Since) and body, and handles the session expiry ... returns the response and the parsed JSON content (None if the status is 304 "Not Modified" or there is no content) if successful and returns False if failed """
+
+		if body is not None:
+			extra_headers=dict(extra_headers)
+			extra_headers.setdefault('Content-Type','application/json')
+			body=json.dumps(body)
+
+		result=self.rest_request(url,method,extra_headers,body)
+		if result is False:
+			return False
+
+		response,content=result
+		if response["status"] == "304" or not content:
+			return response, None
+
+		if self.metrics is None and not self.hooks:
+			return response, self.decode_json(content)
+
+		start=time.time()
+		content_json=self.decode_json(content)
+		self.record_stage("decode",start)
+		return response, content_json
+
+
+
+	# This function sets the library used to decode the JSON responses
+	def set_json_decoder(self,decoder="auto"):
+		""" This function sets the library used to decode the JSON responses (the query pages, describe ...), the decoding is a large part of the time of the queries of wide Objects. The JSON_DECODER value (config file) is used by default ... returns True if successful and returns False if the library is not installed
+ARGUMENTS:
+
+	decoder: "auto" (default) uses simplejson or ujson if installed (2 to 3 times faster) and the standard json module otherwise, "simplejson", "ujson" or "json" use this library, or a function taking the content (str) and returning the parsed JSON content.
+
+EXAMPLE:
+
+	sf.set_json_decoder("ujson")
+	sf.set_json_decoder(json.loads)
+"""
+
+		if callable(decoder):
+			self.json_decoder=getattr(decoder,"__name__","custom")
+			self.json_loads=decoder
+			return True
+
+		if decoder not in ("auto","simplejson","ujson","json"):
+			print "ERROR: Invalid JSON decoder \""+str(decoder)+"\" .. use \"auto\", \"simplejson\", \"ujson\" or \"json\""
+			return False
+
+		# The library of "auto" is imported on first use, to keep the creation of the object fast
+		if decoder=="auto":
+			self.json_decoder="auto"
+			self.json_loads=None
+			return True
+
+		loads=self.json_library(decoder)
+		if loads is None:
+			print "ERROR: "+decoder+" module not found .. install it or use another JSON decoder"
+			return False
+
+		self.json_decoder=decoder
+		self.json_loads=loads
+		return True
+
+
+
+	# (Internal usage) This function returns the decode function of a JSON library
+	def json_library(self,name):
+		"""(Internal usage) This function imports a JSON library ("simplejson", "ujson" or "json") and returns its decode function, the decoded strings are always unicode like the standard json module ... returns the function, or None if the library is not installed"""
+
+		if name=="simplejson":
+			try:
+				import simplejson
+			except ImportError:
+				return None
+			# simplejson returns the ASCII strings of a str as str, the content is decoded first so the values have the same type as the other libraries
+			return lambda content: simplejson.loads(content.decode('utf8') if isinstance(content,str) else content)
+
+		if name=="ujson":
+			try:
+				import ujson
+			except ImportError:
+				return None
+			# The older versions of ujson round the floats unless precise_float is set
+			try:
+				ujson.loads("0.1",precise_float=True)
+			except TypeError:
+				return ujson.loads
+			return lambda content: ujson.loads(content,precise_float=True)
+
+		return json.loads
+
+
+
+	# (Internal usage) This function decodes a JSON response
+	def decode_json(self,content):
+		"""(Internal usage) This function decodes a JSON response using the library set by set_json_decoder(), the library of "auto" is chosen on first use (simplejson, then ujson, then the standard json module) ... returns the parsed JSON content, and raises ValueError if the content is not valid JSON"""
+
+		loads=self.json_loads
+		if loads is None:
+			for name in ("simplejson","ujson","json"):
+				loads=self.json_library(name)
+				if loads is not None:
+					break
+			self.json_loads=loads
+
+		return loads(content)
+
+
+
+	# (Internal usage) This function runs a REST request
+	def rest_request(self,url,method="GET",extra_headers={},body=None):
+		"""(Internal usage) This function runs a REST request with optional extra headers and body, and handles the session expiry. The requests are limited by the REQUESTS_PER_SECOND and API_USAGE_MAX values (config file), and the transient failures (e.g. 503 or REQUEST_LIMIT_EXCEEDED) are retried up to MAX_RETRIES times with a jittered exponential backoff, so a query continues from the same page. If a request that is not a GET failed after it might have been processed (connection error, status 502 or 504), request_state.uncertain is set to True for the current thread ... returns the response and the content if successful and returns False if failed """
+
+		import httplib2
+
+		self.request_state.uncertain=False
+		session_id = self.session_id
+		headers = dict(extra_headers,Authorization='Bearer '+session_id)
+
+		attempt=0
+		while True:
+			if not self.check_api_usage():
+				return False
+			self.rate_limit()
+
+			try:
+				with self.org_semaphore():
+					response, content = self.http_request(url, method, headers=headers, body=body)
+			except httplib2.MalformedHeader as err:
+				if str(err)=="WWW-Authenticate":
+					print ">> SESSION EXPIRED! <<"
+					if self.refresh_session(session_id):
+						session_id = self.session_id
+						headers = dict(extra_headers,Authorization='Bearer '+session_id)
+						continue	
+					else:
+						return False
+			except Exception as err:
+				# Only the GET requests are retried, the others might have been done before the connection failed
+				if method=="GET" and attempt<self.max_retries:
+					attempt+=1
+					print "WARNING: could not connect to server ("+str(err)+") .. retry "+str(attempt)+" of "+str(self.max_retries)
+					self.emit("retry",{"method":method,"url":url,"status":None,"attempt":attempt,"error":str(err)})
+					self.retry_wait(attempt)
+					continue
+				print "ERROR: could not connect to server"
+				print err
+				self.request_state.uncertain=method!="GET"
+				return False
+
+			self.save_api_usage(response)
+	
+			if response["status"] in ("200","201","204","304"): 
+				return response, content
+			elif attempt<self.max_retries and self.is_transient(response,content,method):
+				attempt+=1
+				print "WARNING: Request failed with status "+response["status"]+" .. retry "+str(attempt)+" of "+str(self.max_retries)
+				self.emit("retry",{"method":method,"url":url,"status":response.status,"attempt":attempt})
+				self.retry_wait(attempt,response.get("retry-after"))
+				continue
+			else:
+				print "ERROR: Query Failed"
+				self.request_state.uncertain=method!="GET" and response["status"] in self.retry_statuses and response["status"] not in self.retry_unprocessed_statuses
+				try:
+					content_json=json.loads(content)
+				except ValueError as err:
+					print content
+					print err
+					return False
+					
+				error_code=self.print_errors(content_json)
+				if error_code=="INVALID_SESSION_ID":
+					if self.refresh_session(session_id):
+						session_id = self.session_id
+						headers = dict(extra_headers,Authorization='Bearer '+session_id)
+						continue	
+					else:
+						return False
+				return False
+
+
+
+	# (Internal usage) This function checks if a failed request can be retried
+	def is_transient(self,response,content,method="GET"):
+		"""(Internal usage) This function checks if a failed request can be retried, using the status (see retry_statuses) and the error code (see retry_error_codes). Like the connection errors, only the GET requests are retried for all these errors, the other requests (e.g. POST) are only retried if the error means that the request was not processed (see retry_unprocessed_statuses and retry_unprocessed_error_codes) ... returns boolean"""
+
+		idempotent=method=="GET"
+		statuses=self.retry_statuses if idempotent else self.retry_unprocessed_statuses
+		error_codes=self.retry_error_codes if idempotent else self.retry_unprocessed_error_codes
+
+		if response["status"] in statuses:
+			return True
+
+		try:
+			errors=json.loads(content)
+		except ValueError:
+			return False
+		if not isinstance(errors,list):
+			return False
+
+		# The daily limit is not reset by waiting a few seconds
+		return any([ isinstance(error,dict) and error.get("errorCode") in error_codes and "TotalRequests" not in (error.get("message") or "") for error in errors ])
+
+
+
+	# (Internal usage) This function waits before retrying a request
+	def retry_wait(self,attempt,retry_after=None):
+		"""(Internal usage) This function waits before retrying a request, RETRY_DELAY seconds doubled after each attempt up to RETRY_MAX_DELAY seconds (config file), with a random jitter so parallel requests don't retry at the same time, or the number of seconds of the Retry-After header if given"""
+
+		import random
+
+		delay=min(self.retry_max_delay,self.retry_delay*2**(attempt-1))
+		delay=random.uniform(delay/2.0,delay)
+		try:
+			delay=max(delay,float(retry_after)) if retry_after else delay
+		except ValueError:
+			pass
+
+		time.sleep(delay)
+
+
+
+	# (Internal usage) This function limits the rate of the requests to the org
+	def rate_limit(self):
+		"""(Internal usage) This function waits until a request can be sent to the org, the requests of all the instances connected to the same org are limited to REQUESTS_PER_SECOND (config file, 0 disables the limit) using a token bucket, so short bursts of up to REQUESTS_PER_SECOND requests are allowed"""
+
+		rate=self.requests_per_second
+		if rate<=0:
+			return
+
+		while True:
+			with py_salesforce.org_rate_limits_lock:
+				now=time.time()
+				bucket=py_salesforce.org_rate_limits.setdefault(self.server_url,{"tokens":max(rate,1.0),"updated":now})
+				bucket["tokens"]=min(max(rate,1.0),bucket["tokens"]+(now-bucket["updated"])*rate)
+				bucket["updated"]=now
+				if bucket["tokens"]>=1:
+					bucket["tokens"]-=1
+					return
+				wait=(1-bucket["tokens"])/rate
+
+			time.sleep(wait)
+
+
+
+	# (Internal usage) This function saves the API usage of the org
+	def save_api_usage(self,response):
+		"""(Internal usage) This function saves the API usage of the org returned in the Sforce-Limit-Info header (e.g. "api-usage=18/15000")"""
+
+		match=re.search(r"api-usage=(\d+)/(\d+)",response.get("sforce-limit-info") or "")
+		if match:
+			with py_salesforce.org_rate_limits_lock:
+				py_salesforce.org_api_usage[self.server_url]=(int(match.group(1)),int(match.group(2)))
+
+
+
+	# (Internal usage) This function checks the API usage of the org before a request
+	def check_api_usage(self):
+		"""(Internal usage) This function checks that the API usage of the org (see api_usage()) is below API_USAGE_MAX percent of the daily limit (config file, 0 disables the check) ... returns boolean"""
+
+		if self.api_usage_max<=0:
+			return True
+
+		usage=self.api_usage()
+		if usage is not None and usage["used"]*100.0>=usage["max"]*self.api_usage_max:
+			print "ERROR: The API usage of the org is "+str(usage["used"])+" of "+str(usage["max"])+" requests (API_USAGE_MAX is "+str(self.api_usage_max)+"%) .. request cancelled"
+			return False
+
+		return True
+
+
+
+	# This function returns the API usage of the org
+	def api_usage(self):
+		""" This function returns the number of API requests used in the last 24 hours and the daily limit of the org, as returned in the Sforce-Limit-Info header of the last response ... returns a dictionary having "used" and "max", or None if no request was done yet.
+
+EXAMPLE:
+
+	sf=py_salesforce()
+
+	records=sf.query_SOQL("SELECT Id FROM Case WHERE CreatedDate = TODAY")
+	print sf.api_usage()
+
+"""
+
+		with py_salesforce.org_rate_limits_lock:
+			usage=py_salesforce.org_api_usage.get(self.server_url)
+
+		if usage is None:
+			return None
+		return {"used":usage[0],"max":usage[1]}
+
+
+
+	# This function starts or stops recording the metrics
+	def enable_metrics(self,enabled=True):
+		""" This function starts (or stops) recording the metrics of the requests (latency, bytes, retries and logins) and of the queries (pages, records and the time spent in each stage: decode, flatten, convert, explode, filter and csv), see metrics_report(). The metrics can also be enabled for all the instances with the METRICS option of the config file. When the metrics and the hooks (see add_hook()) are disabled, the stages are not timed.
+ARGUMENTS:
+
+	enabled: If True the metrics are recorded (from now on if they were disabled), if False they are not recorded anymore and the recorded metrics are removed.
+
+EXAMPLE:
+
+	sf=py_salesforce()
+	sf.enable_metrics()
+
+	records=sf.query_SOQL("SELECT Id,Subject FROM Case WHERE CreatedDate = THIS_MONTH")
+	sf.metrics_report()
+
+"""
+
+		if not enabled:
+			self.metrics=None
+		elif self.metrics is None:
+			self.reset_metrics()
+
+
+
+	# This function removes the recorded metrics
+	def reset_metrics(self):
+		""" This function removes the recorded metrics (see metrics_report()) and starts recording them again from now on.
+
+EXAMPLE:
+
+	sf=py_salesforce()
+	sf.reset_metrics()
+
+"""
+
+		with self.metrics_lock:
+			self.metrics={
+				"started":time.time(),
+				"requests":0,
+				"errors":0,
+				"bytes":0,
+				"request_seconds":0.0,
+				"latencies":collections.deque(maxlen=10000),
+				"retries":0,
+				"logins":0,
+				"queries":0,
+				"query_seconds":0.0,
+				"pages":0,
+				"records":0,
+				"stages":{},
+			}
+
+
+
+	# This function prints and returns a summary of the recorded metrics
+	def metrics_report(self,print_report=True):
+		""" This function prints a summary of the metrics recorded since the metrics were enabled or reset (see enable_metrics()) ... returns a dictionary having:
+	"requests", "errors", "retries", "logins": The number of HTTP requests, of failed requests, of retried requests and of logins after the session expired.
+	"bytes": The size of the received content (after decompression).
+	"latency": A dictionary having the "avg", "p50", "p90", "p99" and "max" latency of the requests in milliseconds (of the last 10000 requests).
+	"queries", "pages", "records", "query_seconds", "records_per_second": The number of queries, pages (or Bulk API chunks) and received records, the time spent running the queries and the records received per second of query time.
+	"stages": A dictionary having the number of calls ("count") and the total time ("seconds") of each stage: decode (JSON or CSV of the Bulk API), flatten, convert (typed=True), explode (children="explode"), filter and csv (writing the CSV files).
+	It returns None if the metrics are not enabled.
+ARGUMENTS:
+
+	print_report: If False the report is only returned.
+
+EXAMPLE:
+
+	sf=py_salesforce()
+	sf.enable_metrics()
+
+	sf.query_SOQL_to_CSV("SELECT Id,CreatedDate,Field,OldValue,NewValue FROM CaseHistory WHERE CreatedDate = THIS_MONTH",out="casehist.csv")
+	report=sf.metrics_report()
+	print report["stages"]["csv"]["seconds"]
+
+"""
+
+		if self.metrics is None:
+			print "Metrics are not enabled .. use enable_metrics() or the METRICS option of the config file"
+			return None
+
+		with self.metrics_lock:
+			metrics=self.metrics
+			latencies=sorted(metrics["latencies"])
+			report=dict([ (key,metrics[key]) for key in ("requests","errors","bytes","request_seconds","retries","logins","queries","query_seconds","pages","records") ])
+			report["stages"]=dict([ (name,{"count":stage[0],"seconds":stage[1]}) for name,stage in metrics["stages"].items() ])
+			report["elapsed"]=time.time()-metrics["started"]
+
+		def percentile(p):
+			return latencies[min(len(latencies)-1,int(round(p/100.0*(len(latencies)-1))))]*1000 if latencies else 0.0
+
+		report["latency"]={"avg":sum(latencies)*1000/len(latencies) if latencies else 0.0,"p50":percentile(50),"p90":percentile(90),"p99":percentile(99),"max":latencies[-1]*1000 if latencies else 0.0}
+		report["records_per_second"]=report["records"]/report["query_seconds"] if report["query_seconds"] else 0.0
+
+		if print_report:
+			print "Metrics of the last "+("%.1f" % report["elapsed"])+" seconds:"
+			print "  Requests: "+str(report["requests"])+" ("+str(report["errors"])+" failed, "+str(report["retries"])+" retried, "+str(report["logins"])+" logins), "+("%.2f" % (report["bytes"]/1048576.0))+" MB received in "+("%.1f" % report["request_seconds"])+" seconds"
+			print "  Latency:  avg %.1f ms, p50 %.1f ms, p90 %.1f ms, p99 %.1f ms, max %.1f ms" % tuple([ report["latency"][key] for key in ("avg","p50","p90","p99","max") ])
+			print "  Queries:  "+str(report["queries"])+" queries, "+str(report["pages"])+" pages, "+str(report["records"])+" records in "+("%.1f" % report["query_seconds"])+" seconds ("+str(int(report["records_per_second"]))+" records/sec)"
+			print "  Stages:"
+			for name,stage in sorted(report["stages"].items(),key=lambda item: -item[1]["seconds"]):
+				print "    %-8s %8d calls %10.3f seconds" % (name,stage["count"],stage["seconds"])
+
+		return report
+
+
+
+	# This function adds a function called on each event
+	def add_hook(self,callback,events=None):
+		""" This function adds a function that is called on each event with the name of the event and a dictionary having its information, e.g. to send the metrics to a monitoring system. The function might be called from the background threads (e.g. prefetch), it should be fast and thread safe. The events are:
+	"request": Each HTTP request, having "method", "url", "status" (None if the connection failed), "seconds" and "bytes".
+	"retry": Each retried request, having "method", "url", "status" and "attempt".
+	"login": Each login after the session expired.
+	"page": Each page (or Bulk API chunk) of a query, having "records" (received) and "kept" (after the filters).
+	"query": Each completed (or stopped) query, having "pages", "records" and "seconds".
+	"stage": Each stage of a page, having "stage" (decode, flatten, convert, explode, filter or csv) and "seconds".
+ARGUMENTS:
+
+	callback: The function, called with the name of the event and its information.
+
+	events: A List of the events the function is called on, all the events if not set.
+
+EXAMPLE:
+
+	sf=py_salesforce()
+
+	def slow_requests(event,info):
+		if info["seconds"]>5:
+			print "Slow request: "+info["url"]
+
+	sf.add_hook(slow_requests,["request"])
+
+"""
+
+		self.hooks=self.hooks+[(callback,tuple(events) if events else None)]
+
+
+
+	# This function removes a function added with add_hook()
+	def remove_hook(self,callback):
+		""" This function removes a function added with add_hook().
+ARGUMENTS:
+
+	callback: The function.
+
+"""
+
+		self.hooks=[ hook for hook in self.hooks if hook[0]!=callback ]
+
+
+
+	# (Internal usage) This function records an event
+	def emit(self,event,info):
+		"""(Internal usage) This function updates the metrics (if enabled) and calls the hooks of an event (see add_hook()), a failing hook only prints a warning"""
+
+		metrics=self.metrics
+		if metrics is not None:
+			with self.metrics_lock:
+				if event=="request":
+					metrics["requests"]+=1
+					metrics["request_seconds"]+=info["seconds"]
+					metrics["bytes"]+=info["bytes"]
+					metrics["latencies"].append(info["seconds"])
+					if info["status"] is None or info["status"]>=400:
+						metrics["errors"]+=1
+				elif event=="retry":
+					metrics["retries"]+=1
+				elif event=="login":
+					metrics["logins"]+=1
+				elif event=="page":
+					metrics["pages"]+=1
+					metrics["records"]+=info["records"]
+				elif event=="query":
+					metrics["queries"]+=1
+					metrics["query_seconds"]+=info["seconds"]
+				elif event=="stage":
+					stage=metrics["stages"].setdefault(info["stage"],[0,0.0])
+					stage[0]+=1
+					stage[1]+=info["seconds"]
+
+		for callback,events in self.hooks:
+			if events is None or event in events:
+				try:
+					callback(event,info)
+				except Exception as err:
+					print "WARNING: The hook "+getattr(callback,"__name__",repr(callback))+" failed on the "+event+" event: "+str(err)
+
+
+
+	# (Internal usage) This function records the time of a stage
+	def record_stage(self,name,start):
+		"""(Internal usage) This function records the time of a stage (see add_hook()) that started at the start time ... returns the current time, so it can be used as the start of the next stage"""
+
+		now=time.time()
+		self.emit("stage",{"stage":name,"seconds":now-start})
+		return now
+
+
+
+	# This function profiles a query
+	def profile_query(self,soql,out=None,sort="cumulative",lines=25,**arguments):
+		""" This function runs a query using query_SOQL() with the python profiler (cProfile) and prints the functions where the time was spent. The pages are downloaded in the current thread (prefetch=0) so they are included in the profile ... returns the records (same as query_SOQL()).
+ARGUMENTS:
+
+	soql: The SOQL query.
+
+	out: The file where the profile is saved (it can be loaded with the pstats module or other profile viewers), it is not saved if not set.
+
+	sort: The order of the printed functions, e.g. "cumulative", "tottime" or "calls".
+
+	lines: The number of printed functions, 0 doesn't print the profile.
+
+	arguments: The other arguments of query_SOQL(), e.g. filters=[...], typed=True.
+
+EXAMPLE:
+
+	sf=py_salesforce()
+
+	records=sf.profile_query("SELECT Id,CreatedDate,Field,OldValue,NewValue FROM CaseHistory WHERE CreatedDate = THIS_MONTH",filters=[("NewValue","==","John.Smith")],sort="tottime")
+
+"""
+
+		import cProfile
+		import pstats
+
+		arguments.setdefault("prefetch",0)
+
+		profiler=cProfile.Profile()
+		profiler.enable()
+		try:
+			records=self.query_SOQL(soql,**arguments)
+		finally:
+			profiler.disable()
+
+		if out:
+			profiler.dump_stats(out)
+		if lines:
+			pstats.Stats(profiler,stream=sys.stdout).sort_stats(sort).print_stats(lines)
+
+		return records
+
+
+
+	# (Internal usage) This function prints the errors returned by the REST API
+	def print_errors(self,content_json):
+		"""(Internal usage) This function prints the error code and message returned by the REST API, e.g. [{"errorCode":"INVALID_FIELD","message":"..."}] ... returns the error code (None if not found)"""
+
+		error_code=None
+		if isinstance(content_json,list) and content_json and isinstance(content_json[0],dict):
+			if "errorCode" in content_json[0].keys():
+				error_code=content_json[0]["errorCode"]
+				print "ERROR_CODE: "+error_code
+			if "message" in content_json[0].keys():
+				error_string=content_json[0]["message"]
+				print "ERROR_STRING: "+error_string
+		return error_code
+
+
+
+	# (Internal usage) This function follows the pages of a query one by one
+	def iter_pages(self,url,first_page=None):
+		"""(Internal usage) This generator runs the query and follows the "nextRecordsUrl" of each page, if first_page is given (already downloaded) it starts from its "nextRecordsUrl" ... yields the parsed JSON content of each page, and yields False if failed """
+
+		if first_page is not None:
+			yield first_page
+			url=self.server_url+first_page["nextRecordsUrl"] if not first_page.get("done",True) else None
+
+		while url:
+			content_json=self.get_json(url)
+
+			# If the request failed don't continue
+			if content_json is False:
+				yield False
+				return
+
+			yield content_json
+
+			if not content_json.get("done",True):
+				url=self.server_url+content_json["nextRecordsUrl"]
+			else:
+				url=None
+
+
+
+	# (Internal usage) This function fetches the pages of a query in a background thread
+	def prefetch(self,pages,lookahead=1):
+		"""(Internal usage) This generator consumes a generator of pages (e.g. iter_pages) in a background thread, so the next pages are fetched and decoded while the current page is being processed. At most "lookahead" pages are kept waiting ... yields the same items as the pages generator, which is closed when it ends or when the consumer stops early"""
+
+		# No lookahead, run in the current thread
+		if lookahead<1:
+			try:
+				for page in pages:
+					yield page
+			finally:
+				pages.close()
+			return
+
+		queue=Queue.Queue(maxsize=lookahead)
+		stop=threading.Event()
+		end=object()
+		error=[]
+
+		def fetch():
+			try:
+				for page in pages:
+					while not stop.is_set():
+						try:
+							queue.put(page,timeout=0.1)
+							break
+						except Queue.Full:
+							continue
+					if stop.is_set():
+						return
+			except Exception:
+				error.append(sys.exc_info())
+			finally:
+				# Close the pages generator now (e.g. to stop its own threads) instead of when it is garbage collected
+				try:
+					pages.close()
+				except Exception:
+					pass
+				while not stop.is_set():
+					try:
+						queue.put(end,timeout=0.1)
+						break
+					except Queue.Full:
+						continue
+
+		fetcher=threading.Thread(target=fetch)
+		fetcher.daemon=True
+		fetcher.start()
+
+		try:
+			while True:
+				page=queue.get()
+				if page is end:
+					break
+				yield page
+			if error:
+				raise error[0][0], error[0][1], error[0][2]
+		finally:
+			# Stop the background thread if the consumer stopped early
+			stop.set()
+
+
+
+	# (Internal usage) This function runs the query
+	def run_query(self,url,key="records"):
+		"""(Internal usage) This function runs the query ... returns List of dictionaries (records) if successful and returns False if failed """
+
+		records=[]
+		for page in self.iter_pages(url):
+			if page is False:
+				return False
+			records+=page[key]
+
+		return records
+
+
+
+	# (Internal usage) This function runs the query and organises and filters the records of each page
+	def query_pages(self,url,filters=[],prefetch=None,rows=False,first_page=None,convert=None,cursors=False,children=None,columns=None):
+		"""(Internal usage) This generator runs the query and applies flatten, convert (see typed_converter()) and the filters to the records of each page, while the next pages are prefetched in the background. The flatten plan uses the columns of the SELECT list if given (see select_columns()), so the null relations of the first record get the same keys as in the other records. If first_page is given (already downloaded) the query continues from its "nextRecordsUrl". If children is given (see subqueries()), the child records of the Parent-to-Child subqueries of each page are completed (see child_pages()) and flattened, and exploded if needed. The time of each stage is recorded if the metrics or the hooks are enabled (see add_hook()) ... yields a List of dictionaries (records) per page, or a tuple of the List and the "nextRecordsUrl" of the page (None for the last page) if cursors is True, and yields False if failed """
+
+		lookahead=self.prefetch_pages if prefetch is None else prefetch
+
+		# Compile the filters once for all the pages
+		match=self.compile_filters(filters) if filters else None
+		if match is False:
+			yield False
+			return
+
+		# The flatten plan is created from the first record and the SELECT list
+		plan=None
+
+		# The child records are downloaded with the pages, in the background
+		pages=self.iter_pages(url,first_page)
+		if children is not None:
+			pages=self.child_pages(pages,children)
+			explode=children["explode"]
+
+		# The stages are only timed if the metrics or the hooks are enabled
+		instrumented=self.metrics is not None or self.hooks
+		query={"pages":0,"records":0,"start":time.time()}
+
+		try:
+			for page in self.prefetch(pages,lookahead):
+
+				# If query failed don't continue
+				if page is False:
+					yield False
+					return
+
+				start=time.time() if instrumented else 0
+				if plan is None and page["records"]:
+					plan=self.flatten_plan(page["records"][0],columns=columns,records=page["records"])
+
+				# Organise columns properly and apply Filters in one pass
+				if children is None:
+					records=self.flatten_records(page["records"],plan,rows)
+				else:
+					records=self.flatten_children(self.flatten_records(page["records"],plan,rows and not explode),children)
+				if instrumented:
+					start=self.record_stage("flatten",start)
+				if convert is not None:
+					convert(records)
+					if instrumented:
+						start=self.record_stage("convert",start)
+				if children is not None and explode:
+					records=self.explode_children(records,children,rows)
+					if instrumented:
+						start=self.record_stage("explode",start)
+				if match is not None:
+					records=[record for record in records if match(record)]
+					if instrumented:
+						start=self.record_stage("filter",start)
+
+				if instrumented:
+					query["pages"]+=1
+					query["records"]+=len(page["records"])
+					self.emit("page",{"records":len(page["records"]),"kept":len(records)})
+
+				yield (records,page.get("nextRecordsUrl") if not page.get("done",True) else None) if cursors else records
+		finally:
+			if instrumented:
+				self.emit("query",{"pages":query["pages"],"records":query["records"],"seconds":time.time()-query["start"]})
+
+
+
+	# (Internal usage) This function finds the Parent-to-Child subqueries of a query
+	def subqueries(self,soql,children="nested"):
+		"""(Internal usage) This function finds the Parent-to-Child subqueries of a query, e.g. "(SELECT Id,CaseNumber FROM Cases)", and creates the state used by query_pages() to complete, flatten and explode their child records ... returns a dictionary having the columns of each relation (by lower case name) and the output mode, None if the query has no subqueries, and False if children is not valid"""
+
+		if children not in ("nested","explode"):
+			print "ERROR: Invalid children value \""+str(children)+"\" .. use \"nested\" or \"explode\""
+			return False
+
+		parts=self.parse_SOQL(soql)
+		if parts is False:
+			return None
+
+		names={}
+		for column in parts[0]:
+			if not column.startswith("("):
+				continue
+			subquery=self.parse_SOQL(column[1:-1])
+			if subquery is not False:
+				names[subquery[1].lower()]=subquery[0]
+
+		if not names:
+			return None
+
+		return {"names":names,"explode":children=="explode","plans":{},"headers":{}}
+
+
+
+	# (Internal usage) This function downloads the next pages of the child records of the subqueries
+	def child_pages(self,pages,children):
+		"""(Internal usage) This generator replaces the result of each subquery of the records of each page (a dictionary having "records", "done" and "nextRecordsUrl") by the List of all its child records. Salesforce only returns the first child records of each parent record (about 200 in total per page), the next child pages of all the parent records of a page are downloaded at the same time (up to CHUNK_WORKERS requests), when the page is reached, and their pages are followed using their "nextRecordsUrl". The subqueries without child records (null) are replaced by an empty List ... yields the pages, and yields False if failed """
+
+		pool=None
+		try:
+			for page in pages:
+
+				# If query failed don't continue
+				if page is False:
+					yield False
+					return
+
+				records=page["records"]
+				keys=[ key for key in (records[0].keys() if records else []) if key.lower() in children["names"] ]
+
+				pending=[]
+				for record in records:
+					for key in keys:
+						value=record[key]
+						if value is None:
+							record[key]=[]
+						elif self.is_subquery_result(value):
+							record[key]=value["records"]
+							if not value.get("done",True):
+								if pool is None:
+									from multiprocessing.pool import ThreadPool
+									pool=ThreadPool(self.chunk_workers)
+								pending.append((record,key,pool.apply_async(self.run_query,(self.server_url+value["nextRecordsUrl"],))))
+
+				for record,key,result in pending:
+					child_records=result.get()
+					if child_records is False:
+						yield False
+						return
+					record[key]=record[key]+child_records
+
+				yield page
+		finally:
+			if pool is not None:
+				pool.terminate()
+
+
+
+	# (Internal usage) This function checks if a value is the result of a subquery
+	def is_subquery_result(self,value):
+		"""(Internal usage) This function checks if a value of a record returned by the REST API is the result of a Parent-to-Child subquery (a dictionary having "records", "totalSize" and "done") ... returns boolean"""
+
+		return isinstance(value,collections.MutableMapping) and "records" in value and "totalSize" in value
+
+
+
+	# (Internal usage) This function flattens the child records of the subqueries
+	def flatten_children(self,records,children):
+		"""(Internal usage) This function flattens the child records of the subqueries of a page of flattened records (completed by child_pages()), using a flatten plan for each relation that is kept for all the pages ... returns the records"""
+
+		if not records:
+			return records
+
+		for key in [ key for key in records[0].keys() if key.lower() in children["names"] ]:
+			plan=children["plans"].get(key.lower())
+			for record in records:
+				child_records=record.get(key)
+				if child_records:
+					if plan is None:
+						plan=children["plans"][key.lower()]=self.flatten_plan(child_records[0],columns=children["names"][key.lower()],records=child_records)
+					record[key]=self.flatten_records(child_records,plan)
+
+		return records
+
+
+
+	# (Internal usage) This function creates a record for each parent and child records
+	def explode_children(self,records,children,rows=False):
+		"""(Internal usage) This function replaces each record by one record for each of its child records, having the columns of the parent record and the columns of the child record prefixed by the relation name (e.g. "Cases.CaseNumber", the columns of the subquery are used so all the records have the same columns). A parent record without child records is kept once with empty (None) child columns, and a parent record having many subqueries gets a record for each combination of their child records ... returns a List of dictionaries (or record_row if rows is True)"""
+
+		import itertools
+
+		if not records:
+			return records
+
+		keys=[ key for key in records[0].keys() if key.lower() in children["names"] ]
+		columns=[ (key,[ (key+"."+column,column.lower()) for column in children["names"][key.lower()] ]) for key in keys ]
+
+		exploded=[]
+		for record in records:
+			parent=dict([ (k,v) for k,v in record.items() if k not in keys ])
+			for combination in itertools.product(*[ record.get(key) or [None] for key in keys ]):
+				row=dict(parent)
+				for (key,child_columns),child in zip(columns,combination):
+					values=dict([ (k.lower(),v) for k,v in child.items() ]) if child else {}
+					for name,column in child_columns:
+						row[name]=values.get(column)
+				exploded.append(row)
+
+		if rows:
+			# The records having the same columns share the same header
+			for i,row in enumerate(exploded):
+				row_keys=tuple(row.keys())
+				header=children["headers"].get(row_keys)
+				if header is None:
+					header=children["headers"][row_keys]=dict([ (k,j) for j,k in enumerate(row_keys) ])
+				exploded[i]=record_row(header,row.values())
+
+		return exploded
+
+
+
+	# (Internal usage) This function compiles the filters to a function
+	def compile_filters(self,filters,match_all=True):
+		"""(Internal usage) This function compiles a list of filters (see query()) to a single function that takes a record and returns True if the record matches. The filters are combined with AND (match_all=True) or OR (match_all=False), a list inside the list is combined the other way ... returns the function if successful and returns False if a filter is invalid"""
+
+		tests=[]
+		for f in filters:
+			if isinstance(f,list):
+				test=self.compile_filters(f,not match_all)
+			else:
+				test=self.compile_filter(f)
+
+			if test is False:
+				return False
+			tests.append(test)
+
+		if not tests:
+			return lambda record: match_all
+
+		# The tests are chained with and/or, so each record stops at the first test deciding it
+		def chain(first,second):
+			if match_all:
+				return lambda record: first(record) and second(record)
+			return lambda record: first(record) or second(record)
+
+		return reduce(chain,tests)
+
+
+
+	# (Internal usage) This function compiles one filter to a function
+	def compile_filter(self,f):
+		"""(Internal usage) This function compiles one filter, either (column,operator,value) or (column,"operator value"), to a function that takes a record and returns True if the record matches ... returns the function if successful and returns False if the filter is invalid"""
+
+		parsed=self.parse_filter(f)
+		if parsed is False:
+			return False
+		column,op,value=parsed
+
+		if op=="regex":
+			try:
+				pattern=re.compile(value)
+			except (re.error,TypeError):
+				print "ERROR: Invalid filter regular expression "+repr(f)
+				return False
+			def test(record):
+				v=record.get(column)
+				return isinstance(v,basestring) and pattern.search(v) is not None
+			return test
+
+		if op in ("in","not in"):
+			try:
+				value=frozenset(value)
+			except TypeError:
+				pass
+
+		compare=self.filter_operators[op]
+		return lambda record: compare(record.get(column),value)
+
+
+
+	# (Internal usage) This function splits one filter into its parts
+	def parse_filter(self,f):
+		"""(Internal usage) This function splits one filter, either (column,operator,value) or (column,"operator value"), into the column, the operator and the value ... returns a tuple of the 3 parts if successful and returns False if the filter is invalid"""
+
+		if isinstance(f,tuple) and len(f)==3:
+			column,op,value=f
+		elif isinstance(f,tuple) and len(f)==2:
+			# e.g. ("NewValue","==\'John.Smith\'"), the value must be a python literal
+			import ast
+
+			column=f[0]
+			match=re.match(r"\s*(==|!=|<=|>=|<|>|not\s+in\b|in\b|is\s+not\b|is\b)\s*(.*?)\s*$",f[1],re.DOTALL)
+			if not match:
+				print "ERROR: Invalid filter "+repr(f)
+				return False
+			op=" ".join(match.group(1).split())
+			try:
+				value=ast.literal_eval(match.group(2))
+			except (ValueError,SyntaxError):
+				print "ERROR: Invalid filter value "+repr(f)
+				return False
+		else:
+			print "ERROR: Invalid filter "+repr(f)
+			return False
+
+		if op!="regex" and op not in self.filter_operators:
+			print "ERROR: Invalid filter operator "+repr(f)
+			return False
+
+		return column,op,value
+
+
+
+	# (Internal usage) This function converts the filters to a SQL condition
+	def filters_to_SQL(self,filters,match_all=True):
+		"""(Internal usage) This function converts a list of filters (see query()) to a SQL condition for the local store, with the same AND/OR rules as compile_filters(). The null values are matched like the python filters: == and != compare them as values, < and <= match them (None is smaller than any value in python 2) while > and >= don't, and in and not in match them if None is (or is not) in the values ... returns the condition and the List of its parameters if successful and returns False if a filter is invalid"""
+
+		conditions=[]
+		params=[]
+		for f in filters:
+			if isinstance(f,list):
+				converted=self.filters_to_SQL(f,not match_all)
+				if converted is False:
+					return False
+				condition,values=converted
+			else:
+				parsed=self.parse_filter(f)
+				if parsed is False:
+					return False
+				column,op,value=parsed
+				column=self.quote_name(column)
+
+				if op in ("in","not in"):
+					values=[ v for v in value if v is not None ]
+					condition=column+" "+op.upper()+" ("+",".join(["?"]*len(values))+")"
+					if (None in value)==(op=="in"):
+						condition+=" OR "+column+" IS NULL"
+				elif op=="between":
+					values=[value[0],value[1]]
+					condition=column+" BETWEEN ? AND ?"
+				else:
+					# The regular expression is checked here, an invalid one would fail inside sqlite
+					if op=="regex":
+						try:
+							re.compile(value)
+						except (re.error,TypeError):
+							print "ERROR: Invalid filter regular expression "+repr(f)
+							return False
+					values=[value]
+					condition=column+" "+self.sql_operators[op]+" ?"
+					if op in ("<","<="):
+						condition+=" OR "+column+" IS NULL"
+
+			conditions.append("("+condition+")")
+			params+=values
+
+		if not conditions:
+			return "1",[]
+		return (" AND " if match_all else " OR ").join(conditions),params
+
+
+
+	# (Internal usage) This function splits a SOQL query into its parts
+	def parse_SOQL(self,soql):
+		"""(Internal usage) This function splits a SOQL query into the List of columns, the table (Object), and the rest of the query (WHERE, ORDER BY, LIMIT ...), subqueries between brackets are kept as one column ... returns the columns, the table and the rest if successful and returns False if the query can't be parsed"""
+
+		match=re.match(r"\s*SELECT\s",soql,re.IGNORECASE)
+		if not match:
+			return False
+
+		# Find the FROM and the commas that are not between brackets
+		columns=[]
+		depth=0
+		start=match.end()
+		for m in re.finditer(r"[(),]|\bFROM\b",soql[match.end():],re.IGNORECASE):
+			token=m.group(0)
+			if token=="(":
+				depth+=1
+			elif token==")":
+				depth-=1
+			elif depth==0 and token==",":
+				columns.append(soql[start:match.end()+m.start()].strip())
+				start=match.end()+m.end()
+			elif depth==0:
+				columns.append(soql[start:match.end()+m.start()].strip())
+				rest=soql[match.end()+m.end():].split(None,1)
+				if not rest:
+					return False
+				return columns, rest[0], rest[1] if len(rest)>1 else ""
+
+		return False
+
+
+
+	# (Internal usage) This function returns the columns of the SELECT list of a query
+	def select_columns(self,soql):
+		"""(Internal usage) This function returns the columns of the SELECT list of a SOQL query (see parse_SOQL()), e.g. ["Id","Account.Name","(SELECT Id FROM Cases)"] ... returns a List, or None if the query can't be parsed"""
+
+		parts=self.parse_SOQL(soql)
+		if parts is False:
+			return None
+		return parts[0]
+
+
+
+	# This function returns the number of records of a SOQL query
+	def count_SOQL(self,soql):
+		""" This function returns the number of records of a SOQL query, using a "SELECT COUNT()" query with the same conditions ... returns the number of records if successful and returns False if failed.
+ARGUMENTS:
+
+	soql: The SOQL query.
+
+"""
+
+		parts=self.parse_SOQL(soql)
+		if parts is False:
+			print "ERROR: Invalid SOQL query"
+			return False
+
+		# ORDER BY can't be used with COUNT()
+		rest=re.sub(r"\bORDER\s+BY\s.*?(?=\bLIMIT\b|\bOFFSET\b|$)","",parts[2],flags=re.IGNORECASE|re.DOTALL)
+
+		content_json=self.get_json(self.query_url("SELECT COUNT() FROM "+parts[1]+" "+rest))
+		if content_json is False:
+			return False
+
+		return content_json["totalSize"]
+
+
+
+	# (Internal usage) This function checks if the Bulk API should be used for a query
+	def use_bulk(self,soql):
+		"""(Internal usage) This function checks if a query returns more records than the BULK_THRESHOLD value of the config file (0 disables the Bulk API), using count_SOQL() ... returns boolean"""
+
+		if self.bulk_threshold<=0:
+			return False
+
+		# Aggregate functions and subqueries are not supported by the Bulk API
+		parts=self.parse_SOQL(soql)
+		if parts is False or [ column for column in parts[0] if "(" in column ]:
+			return False
+
+		count=self.count_SOQL(soql)
+		if count is False or count<=self.bulk_threshold:
+			return False
+
+		print "<< Using the Bulk API ("+str(count)+" records) >>"
+		return True
+
+
+
+	# (Internal usage) This function runs a query using the Bulk API 2.0
+	def iter_bulk_pages(self,soql,operation="query",cursor=None):
+		"""(Internal usage) This generator creates a Bulk API 2.0 query job, waits for it to complete, then downloads the results in CSV chunks of BULK_CHUNK_SIZE records (config file). If cursor is given (the "cursor" of a chunk) the download continues from the next chunk of the same job ... The job is deleted once its last chunk is read (or if it failed), the job of a download that stopped before is kept until salesforce removes it, so it can continue from its cursor ... yields a dictionary per chunk having the "header" (List of columns), the "rows" (List of Lists of values) and the "cursor" of the next chunk (None for the last chunk), and yields False if failed """
+
+		import cStringIO
+
+		# If the CSV module is not found print error and exit
+		try:
+			import csv
+		except ImportError:
+			print "ERROR: csv module not found .. unable to use the Bulk API" 
+			yield False
+			return
+
+		url=self.latest_REST_url+"jobs/query"
+
+		if cursor is not None:
+			job_id=cursor["job"]
+		else:
+			# Create the job
+			result=self.request_json(url,method="POST",body={"operation":operation,"query":soql})
+			if result is False:
+				yield False
+				return
+			job_id=result[1]["id"]
+
+		# The job is deleted when its last chunk is read or when it failed, otherwise it is kept so the download can continue from a cursor
+		finished=False
+		try:
+			# Wait for the job to complete, waiting longer each time
+			delay=0.5
+			while cursor is None:
+				result=self.request_json(url+"/"+job_id)
+				if result is False:
+					yield False
+					return
+
+				job=result[1]
+				if job["state"]=="JobComplete":
+					break
+				if job["state"] in ("Failed","Aborted"):
+					print "ERROR: Bulk query job "+job["state"]
+					if job.get("errorMessage"):
+						print "ERROR_STRING: "+job["errorMessage"]
+					finished=True
+					yield False
+					return
+
+				time.sleep(delay)
+				delay=min(delay*2,self.bulk_poll_max)
+
+			# Download the results
+			locator=cursor["locator"] if cursor is not None else None
+			while True:
+				results_url=url+"/"+job_id+"/results?maxRecords="+str(self.bulk_chunk_size)
+				if locator:
+					results_url+="&locator="+locator
+
+				result=self.rest_request(results_url,extra_headers={"Accept":"text/csv"})
+				if result is False:
+					yield False
+					return
+
+				response,content=result
+				start=time.time()
+				reader=csv.reader(cStringIO.StringIO(content))
+				header=[ column.decode('utf8') for column in next(reader,[]) ]
+
+				locator=response.get("sforce-locator")
+				if locator=="null":
+					locator=None
+				finished=not locator
+
+				# Empty values are null
+				rows=[ [ value.decode('utf8') if value else None for value in row ] for row in reader ]
+				if self.metrics is not None or self.hooks:
+					self.record_stage("decode",start)
+
+				yield {"header":header,"rows":rows,"cursor":{"job":job_id,"locator":locator} if locator else None}
+
+				if not locator:
+					break
+		finally:
+			if finished:
+				self.rest_request(url+"/"+job_id,method="DELETE")
+
+
+
+	# (Internal usage) This function runs a query using the Bulk API 2.0 and filters the records of each chunk
+	def bulk_pages(self,soql,filters=[],prefetch=None,rows=False,convert=None,cursor=None,cursors=False):
+		"""(Internal usage) This generator runs the query using the Bulk API 2.0 (or continues from a cursor, see iter_bulk_pages()) and applies convert (see typed_converter()) and the filters to the records of each chunk, while the next chunks are downloaded in the background. The time of each stage is recorded if the metrics or the hooks are enabled (see add_hook()) ... yields a List of dictionaries (or record_row if rows is True) per chunk, or a tuple of the List and the cursor of the next chunk if cursors is True, and yields False if failed """
+
+		lookahead=self.prefetch_pages if prefetch is None else prefetch
+
+		# Compile the filters once for all the chunks
+		match=self.compile_filters(filters) if filters else None
+		if match is False:
+			yield False
+			return
+
+		# The stages are only timed if the metrics or the hooks are enabled
+		instrumented=self.metrics is not None or self.hooks
+		query={"pages":0,"records":0,"start":time.time()}
+
+		header=None
+		try:
+			for page in self.prefetch(self.iter_bulk_pages(soql,cursor=cursor),lookahead):
+
+				# If query failed don't continue
+				if page is False:
+					yield False
+					return
+
+				# The columns are already flat, e.g. "Case.CaseNumber"
+				start=time.time() if instrumented else 0
+				if rows:
+					if header is None:
+						header=dict([ (key,i) for i,key in enumerate(page["header"]) ])
+					records=[ record_row(header,values) for values in page["rows"] ]
+				else:
+					records=[ dict(zip(page["header"],values)) for values in page["rows"] ]
+				if instrumented:
+					start=self.record_stage("flatten",start)
+
+				if convert is not None:
+					convert(records)
+					if instrumented:
+						start=self.record_stage("convert",start)
+
+				if match is not None:
+					records=[ record for record in records if match(record) ]
+					if instrumented:
+						start=self.record_stage("filter",start)
+
+				if instrumented:
+					query["pages"]+=1
+					query["records"]+=len(page["rows"])
+					self.emit("page",{"records":len(page["rows"]),"kept":len(records)})
+
+				yield (records,page["cursor"]) if cursors else records
+		finally:
+			if instrumented:
+				self.emit("query",{"pages":query["pages"],"records":query["records"],"seconds":time.time()-query["start"]})
+
+
+
+	# (Internal usage) This function generates the SOQL query used by the query() function
+	def generate_query(self,table,columns,conditions=[]):
+		"""(Internal usage) This function generates the SOQL query from the table, columns and conditions ... returns the SOQL query"""
+
+		query="SELECT "+",".join(columns)+" FROM "+table
+		if conditions:
+			conditions=['('+" OR ".join(condition)+')' if isinstance(condition,list) else condition for condition in conditions]
+			query=query+" WHERE "+" AND ".join(conditions)
+
+		return query
+
+
+
+	# (Internal usage) This function generates the REST url of a SOQL query
+	def query_url(self,soql,resource="query"):
+		"""(Internal usage) This function generates the REST url of a SOQL query, resource can be "queryAll" to include the deleted records ... returns the url"""
+
+		# convert spaces to +
+		return self.REST_url+resource+"/?q="+soql.replace(" ","+")
+
+
+
+	# This function initiates a query using REST API
+	def query(self,table,columns,conditions=[],filters=[],prefetch=None,rows=False,bulk=None,cache=None,typed=False,children="nested"):
+		""" This function creates a query and runs it using the REST API ... returns List of dictionaries (records) if successful and returns False if failed.
+ARGUMENTS:
+
+	table: The Table (Object) of the query.
+	
+	columns: the list of columns (fields). This can include Child-to-Parent relations,	e.g.: Owner.Name, and Parent-to-Child subqueries, e.g.: (SELECT Id,CaseNumber FROM Cases)
+	
+	conditions: A list of conditions to apply (with AND clause), if you wish to use OR use a list inside the list, 	e.g.: [condition1,condition2] => condition1 AND condition2, [condition3,[condition4,condition5]] => condition3 AND (condition4 OR condition5)
+	
+	filters: A list of conditions that will be applied AFTER the query is complete, this can be used with non filterable fields (e.g. NewValue in Casehistory). each item in the list needs to be a tuple of 3 items: the column name, the operator and the value,	e.g. filters=[("NewValue","==","John.Smith")]. The supported operators are ==, !=, <, <=, >, >=, is, is not, in, not in, between (the value is a tuple of the lowest and highest values) and regex (the value is a regular expression). The filters are applied with AND clause, if you wish to use OR use a list inside the list (same as conditions). A tuple of 2 items, the column name and the operator followed by a python value, is also supported,	e.g. filters=[("NewValue","==\'John.Smith\'")]
+
+	prefetch: The number of pages fetched in the background while the current page is being processed, 0 disables prefetching. If not set the PREFETCH_PAGES value of the config file is used (default 1).
+
+	rows: If True, the records are returned as record_row objects instead of dictionaries. They work like dictionaries but share the column names, so they use much less memory for large queries.
+
+	bulk: If True, the query runs using the Bulk API 2.0, which returns the records in large CSV chunks (all the values are returned as strings). If False, the REST API is used. If not set, the Bulk API is used when the query returns more records than the BULK_THRESHOLD value of the config file (0, the default, disables it).
+
+	cache: The number of seconds a cached result of the same query can be reused, if a result newer than that is found in the cache (in memory or in tmp/query_cache.db) it is returned without running the query. 0 disables the cache for this query. If not set the QUERY_CACHE_TTL value of the config file is used (0, the default, disables the cache).
+
+	typed: If True, the values are converted to the python type of their field type (found from the describe of the Object, which is cached): boolean to bool, int to int, double, currency and percent to float, date to datetime.date and datetime to datetime.datetime (in UTC). The filters are applied to the converted values, e.g. filters=[("CreatedDate",">=",datetime.datetime(2016,1,1))]. This also converts the string values returned by the Bulk API.
+
+	children: How the child records of the Parent-to-Child subqueries are returned, e.g. "SELECT Id,Name,(SELECT Id,CaseNumber FROM Cases) FROM Account". If "nested" (default), the value of the relation (e.g. record["Cases"]) is the List of all the child records (flattened dictionaries), an empty List if there are none. If "explode", a record is returned for each child record having the columns of the parent and the columns of the child prefixed by the relation name (e.g. "Cases.CaseNumber"), the parent records without child records are returned once with empty child columns, and the filters can be applied to the child columns. The child records beyond the first ones returned with each page are downloaded in parallel (up to CHUNK_WORKERS requests) as the pages are reached.
+
+EXAMPLE:
+
+	# The below example searches "CaseHistory" for items created This month and the changed field was "Owner" OR "OwnerAccepted", then applied a filter on the NewValue to only be "John.Smith"
+	sf=py_salesforce()
+
+	table="CaseHistory"
+	columns=["Id","CreatedDate","Field","OldValue","NewValue","Case.CaseNumber"]
+	conditions=['CreatedDate=THIS_MONTH',["Field=\'Owner\'","Field=\'ownerAccepted\'"]]
+	filters=[("NewValue","==\'John.Smith\'")]
+
+	records=sf.query(table=table,columns=columns,conditions=conditions,filters=filters)
+
+"""
+
+		return self.query_SOQL(self.generate_query(table,columns,conditions),filters,prefetch,rows,bulk,cache,typed,children)
+
+
+	
+	def query_SOQL(self,soql,filters=[],prefetch=None,rows=False,bulk=None,cache=None,typed=False,children="nested"):
+		""" This function runs a query using the REST API ... returns List of dictionaries (records) if successful and returns False if failed.
+ARGUMENTS:
+
+	soql: The SOQL query.
+
+	filters: A list of conditions that will be applied AFTER the query is complete, this can be used with non filterable fields (e.g. NewValue in Casehistory). each item in the list needs to be a tuple of 3 items: the column name, the operator and the value,	e.g. filters=[("NewValue","==","John.Smith")]. The supported operators are ==, !=, <, <=, >, >=, is, is not, in, not in, between (the value is a tuple of the lowest and highest values) and regex (the value is a regular expression). The filters are applied with AND clause, if you wish to use OR use a list inside the list (same as conditions). A tuple of 2 items, the column name and the operator followed by a python value, is also supported,	e.g. filters=[("NewValue","==\'John.Smith\'")]
+
+	prefetch: The number of pages fetched in the background while the current page is being processed, 0 disables prefetching. If not set the PREFETCH_PAGES value of the config file is used (default 1).
+
+	rows: If True, the records are returned as record_row objects instead of dictionaries. They work like dictionaries but share the column names, so they use much less memory for large queries.
+
+	bulk: If True, the query runs using the Bulk API 2.0, which returns the records in large CSV chunks (all the values are returned as strings). If False, the REST API is used. If not set, the Bulk API is used when the query returns more records than the BULK_THRESHOLD value of the config file (0, the default, disables it).
+
+	cache: The number of seconds a cached result of the same query can be reused, if a result newer than that is found in the cache (in memory or in tmp/query_cache.db) it is returned without running the query. 0 disables the cache for this query. If not set the QUERY_CACHE_TTL value of the config file is used (0, the default, disables the cache).
+
+	typed: If True, the values are converted to the python type of their field type (found from the describe of the Object, which is cached): boolean to bool, int to int, double, currency and percent to float, date to datetime.date and datetime to datetime.datetime (in UTC). The filters are applied to the converted values, e.g. filters=[("CreatedDate",">=",datetime.datetime(2016,1,1))]. This also converts the string values returned by the Bulk API.
+
+	children: How the child records of the Parent-to-Child subqueries are returned, e.g. "SELECT Id,Name,(SELECT Id,CaseNumber FROM Cases) FROM Account". If "nested" (default), the value of the relation (e.g. record["Cases"]) is the List of all the child records (flattened dictionaries), an empty List if there are none. If "explode", a record is returned for each child record having the columns of the parent and the columns of the child prefixed by the relation name (e.g. "Cases.CaseNumber"), the parent records without child records are returned once with empty child columns, and the filters can be applied to the child columns. The child records beyond the first ones returned with each page are downloaded in parallel (up to CHUNK_WORKERS requests) as the pages are reached.
+
+EXAMPLE:
+
+	# The below example searches "CaseHistory" for items created This month and the changed field was "Owner" OR "OwnerAccepted", then applied a filter on the NewValue to only be "John.Smith"
+	sf=py_salesforce()
+
+	soql="SELECT Id,CreatedDate,Field,OldValue,NewValue,Case.CaseNumber FROM CaseHistory WHERE CreatedDate = THIS_MONTH and (Field=\'Owner\' OR Field=\'ownerAccepted\')"	
+	filters=[("NewValue","==\'John.Smith\'")]
+
+	records2=sf.query_SOQL(soql=soql,filters=filters)
+
+	# The below example reuses the result of the same query for 10 minutes
+	records3=sf.query_SOQL(soql=soql,filters=filters,cache=600)
+
+"""
+
+		ttl=self.query_cache_ttl if cache is None or cache is True else cache
+		if ttl>0:
+			return self.cached_query_SOQL(soql,filters,prefetch,rows,bulk,ttl,typed,children)
+
+		records=[]
+		for record in self.iter_SOQL(soql,filters,prefetch,rows,bulk,typed,children):
+
+			# If query failed don't continue
+			if record is False:
+				return False
+
+			records.append(record)
+
+		# return values
+		return records
+
+
+
+	# This function initiates a query using REST API and yields the records one by one
+	def iter_query(self,table,columns,conditions=[],filters=[],prefetch=None,rows=False,bulk=None,typed=False,children="nested"):
+		""" This function creates a query and runs it using the REST API, the records are yielded one by one as each page arrives, so only one page is kept in memory at a time ... yields dictionaries (records), and yields False as the last item if the query failed.
+ARGUMENTS:
+
+	table,columns,conditions,filters,prefetch,rows,bulk,typed,children: Same as the query() function.
+
+EXAMPLE:
+
+	# The below example goes through all the "CaseHistory" items created This month without keeping them all in memory
+	sf=py_salesforce()
+
+	table="CaseHistory"
+	columns=["Id","CreatedDate","Field","OldValue","NewValue","Case.CaseNumber"]
+	conditions=['CreatedDate=THIS_MONTH']
+
+	for record in sf.iter_query(table=table,columns=columns,conditions=conditions):
+		if record is False:
+			break
+		print record["Case.CaseNumber"]
+
+"""
+
+		return self.iter_SOQL(self.generate_query(table,columns,conditions),filters,prefetch,rows,bulk,typed,children)
+
+
+
+	# This function runs a SOQL query using REST API and yields the records one by one
+	def iter_SOQL(self,soql,filters=[],prefetch=None,rows=False,bulk=None,typed=False,children="nested"):
+		""" This function runs a query using the REST API, the records are yielded one by one as each page arrives, so only one page is kept in memory at a time ... yields dictionaries (records), and yields False as the last item if the query failed.
+ARGUMENTS:
+
+	soql,filters,prefetch,rows,bulk,typed,children: Same as the query_SOQL() function.
+
+EXAMPLE:
+
+	sf=py_salesforce()
+
+	soql="SELECT Id,CreatedDate,Field,OldValue,NewValue,Case.CaseNumber FROM CaseHistory WHERE CreatedDate = THIS_MONTH"
+
+	for record in sf.iter_SOQL(soql=soql):
+		if record is False:
+			break
+		print record["Case.CaseNumber"]
+
+"""
+
+		for records in self.soql_pages(soql,filters,prefetch,rows,bulk,typed,children):
+
+			# If query failed don't continue
+			if records is False:
+				yield False
+				return
+
+			for record in records:
+				yield record
+
+
+
+	# (Internal usage) This function runs a SOQL query page by page
+	def soql_pages(self,soql,filters=[],prefetch=None,rows=False,bulk=None,typed=False,children="nested"):
+		"""(Internal usage) This function runs a SOQL query using the REST API or the Bulk API 2.0 (see the bulk, typed and children arguments of query_SOQL()) ... returns a generator yielding a List of records per page, and yielding False if failed """
+
+		subqueries=self.subqueries(soql,children)
+		if subqueries is False:
+			return iter([False])
+
+		convert=self.typed_converter(soql) if typed else None
+		if convert is False:
+			return iter([False])
+
+		if bulk is None:
+			bulk=self.use_bulk(soql)
+
+		if bulk:
+			return self.bulk_pages(soql,filters,prefetch,rows,convert)
+		return self.query_pages(self.query_url(soql),filters,prefetch,rows,None,convert,False,subqueries,self.select_columns(soql))
+
+
+
+	# (Internal usage) This function creates the function converting the values of a query to their types
+	def typed_converter(self,soql):
+		"""(Internal usage) This function creates a function that converts the values of the records of a query to the python types of their salesforce types (see value_converter()), the converters of the columns are created once from the describe of the Object (metadata cache), then each page is converted in place one column at a time. The child records of the subqueries are converted using the describe of the child Object ... returns the function, None if no column needs to be converted, and False if failed"""
+
+		parts=self.parse_SOQL(soql)
+		if parts is False:
+			return None
+
+		types=self.column_types(parts[1],parts[0])
+		if types is False:
+			return False
+
+		converters=[ (column,self.value_converter(sf_type)) for column,sf_type in types.items() ]
+		converters=[ (column,converter) for column,converter in converters if converter is not None ]
+
+		# Parent-to-Child subqueries, find the child Object from the child relations
+		child_converters=[]
+		for column in parts[0]:
+			subquery=self.parse_SOQL(column[1:-1]) if column.startswith("(") else False
+			if subquery is False:
+				continue
+			describe=self.describe_object(parts[1],print_fields=False,print_child_rel=False)
+			if describe is False:
+				return False
+			found=[ relation["childSObject"] for relation in describe[1] if (relation.get("relationshipName") or "").lower()==subquery[1].lower() ]
+			if not found:
+				continue
+			child_converter=self.typed_converter("SELECT "+",".join(subquery[0])+" FROM "+found[0]+" "+subquery[2])
+			if child_converter is False:
+				return False
+			if child_converter is not None:
+				child_converters.append((subquery[1],child_converter))
+
+		if not converters and not child_converters:
+			return None
+
+		def convert(records):
+			if not records:
+				return records
+
+			# Use the case of the column names returned by salesforce
+			keys=dict([ (key.lower(),key) for key in records[0].keys() ])
+			for column,converter in converters:
+				key=keys.get(column.lower(),column)
+				for record in records:
+					value=record.get(key)
+					if value is not None:
+						record[key]=converter(value)
+
+			# Convert the child records of all the records at once
+			for relation,child_converter in child_converters:
+				key=keys.get(relation.lower(),relation)
+				child_converter([ child for record in records for child in (record.get(key) or []) ])
+
+			return records
+
+		return convert
+
+
+
+	# (Internal usage) This function converts a Salesforce Id to a number
+	def id_to_number(self,sf_id):
+		"""(Internal usage) This function converts the first 15 characters of a Salesforce Id (base 62) to a number"""
+
+		number=0
+		for c in sf_id[:15]:
+			number=number*62+self.id_chars.index(c)
+		return number
+
+
+
+	# (Internal usage) This function converts a number to a Salesforce Id
+	def number_to_id(self,number):
+		"""(Internal usage) This function converts a number to a 15 characters Salesforce Id (base 62)"""
+
+		chars=[]
+		for i in range(15):
+			number,c=divmod(number,62)
+			chars.append(self.id_chars[c])
+		return "".join(reversed(chars))
+
+
+
+	# (Internal usage) This function splits a query into ranges of Ids or dates
+	def generate_chunks(self,table,conditions=[],chunk_by="Id",chunks=4):
+		"""(Internal usage) This function splits the records of a query into ranges of Ids or dates (e.g. CreatedDate), using the lowest and highest values of the "chunk_by" column ... returns a List of conditions (one for each chunk) if successful and returns False if failed"""
+
+		if chunk_by.lower()=="id":
+			# Get the lowest and highest Ids
+			first=self.run_query(self.query_url(self.generate_query(table,["Id"],conditions)+" ORDER BY Id ASC LIMIT 1"))
+			last=self.run_query(self.query_url(self.generate_query(table,["Id"],conditions)+" ORDER BY Id DESC LIMIT 1"))
+			if first is False or last is False:
+				return False
+			if not first:
+				return []
+
+			low=self.id_to_number(first[0]["Id"])
+			high=self.id_to_number(last[0]["Id"])
+			bounds=[ "'"+self.number_to_id(low+(high-low)*i//chunks)+"'" for i in range(1,chunks) ]
+
+		else:
+			# Get the lowest and highest dates
+			limits=self.run_query(self.query_url(self.generate_query(table,["MIN("+chunk_by+")","MAX("+chunk_by+")"],conditions)))
+			if limits is False:
+				return False
+			if not limits or limits[0]["expr0"] is None:
+				return []
+
+			if len(limits[0]["expr0"])==10:
+				# date column
+				low=datetime.datetime.strptime(limits[0]["expr0"],"%Y-%m-%d")
+				high=datetime.datetime.strptime(limits[0]["expr1"],"%Y-%m-%d")
+				date_format="%Y-%m-%d"
+			else:
+				# datetime column (always returned in UTC)
+				low=datetime.datetime.strptime(limits[0]["expr0"][:19],"%Y-%m-%dT%H:%M:%S")
+				high=datetime.datetime.strptime(limits[0]["expr1"][:19],"%Y-%m-%dT%H:%M:%S")
+				date_format="%Y-%m-%dT%H:%M:%SZ"
+
+			bounds=[ (low+(high-low)*i//chunks).strftime(date_format) for i in range(1,chunks) ]
+
+		# Remove duplicate bounds (when there are less values than chunks)
+		bounds=sorted(set(bounds),key=bounds.index)
+
+		# The first and last chunks are open, so no records are missed
+		ranges=[]
+		for i in range(len(bounds)+1):
+			condition=[]
+			if i>0:
+				condition.append(chunk_by+" >= "+bounds[i-1])
+			if i<len(bounds):
+				condition.append(chunk_by+" < "+bounds[i])
+			ranges.append(" AND ".join(condition))
+
+		return ranges
+
+
+
+	# This function splits a query into chunks that run in parallel
+	def query_chunked(self,table,columns,conditions=[],filters=[],chunk_by="Id",chunks=None,workers=None):
+		""" This function splits a query into ranges of Ids or dates (chunks) that run in parallel using the REST API, this is much faster than query() for large Objects ... returns List of dictionaries (records) if successful and returns False if failed.
+ARGUMENTS:
+
+	table,columns,conditions,filters: Same as the query() function.
+
+	chunk_by: The column used to split the query, either "Id" or a date column (e.g. "CreatedDate").
+
+	chunks: The number of chunks, default is 4 times the number of workers.
+
+	workers: The number of chunks running at the same time. If not set the CHUNK_WORKERS value of the config file is used (default 4). Note that the number of concurrent requests to the org is also limited by the MAX_CONCURRENT_REQUESTS value of the config file (default 10).
+
+EXAMPLE:
+
+	sf=py_salesforce()
+
+	table="CaseHistory"
+	columns=["Id","CreatedDate","Field","OldValue","NewValue","Case.CaseNumber"]
+	conditions=['CreatedDate=THIS_YEAR']
+
+	records=sf.query_chunked(table=table,columns=columns,conditions=conditions,chunk_by="CreatedDate",workers=8)
+
+"""
+
+		records=[]
+		for record in self.iter_query_chunked(table,columns,conditions,filters,chunk_by,chunks,workers):
+
+			# If query failed don't continue
+			if record is False:
+				return False
+
+			records.append(record)
+
+		return records
+
+
+
+	# This function splits a query into chunks that run in parallel, and yields the records one by one
+	def iter_query_chunked(self,table,columns,conditions=[],filters=[],chunk_by="Id",chunks=None,workers=None):
+		""" This function splits a query into ranges of Ids or dates (chunks) that run in parallel using the REST API, the records are yielded one by one in the order of the chunks, and at most "workers" chunks are downloaded ahead of the consumer ... yields dictionaries (records), and yields False as the last item if the query failed.
+ARGUMENTS:
+
+	table,columns,conditions,filters,chunk_by,chunks,workers: Same as the query_chunked() function.
+
+"""
+
+		workers=workers if workers else self.chunk_workers
+		chunks=chunks if chunks else workers*4
+
+		ranges=self.generate_chunks(table,conditions,chunk_by,chunks)
+		if ranges is False:
+			yield False
+			return
+		if not ranges:
+			return
+
+		soqls=[ self.generate_query(table,columns,list(conditions)+[r] if r else conditions) for r in ranges ]
+
+		from multiprocessing.pool import ThreadPool
+
+		pool=ThreadPool(min(workers,len(soqls)))
+		run_chunk=lambda soql: self.query_SOQL(soql,filters,prefetch=0)
+		try:
+			# At most "workers" chunks are running or waiting to be consumed, so the memory doesn't grow with the whole result when the consumer is slower than the workers
+			pending=collections.deque([ pool.apply_async(run_chunk,(soql,)) for soql in soqls[:workers] ])
+			next_chunk=workers
+			while pending:
+				records=pending.popleft().get()
+
+				# If query failed don't continue
+				if records is False:
+					yield False
+					return
+
+				if next_chunk<len(soqls):
+					pending.append(pool.apply_async(run_chunk,(soqls[next_chunk],)))
+					next_chunk+=1
+
+				for record in records:
+					yield record
+		finally:
+			pool.terminate()
+
+
+
+	# Put records in CSV
+	def to_CSV(self,records,out="out.csv",order=[],compress=False):
+		"""This function exports records returned from query or query_SOQL into a CSV File 
+ARGUMENTS:
+
+	records: List of dictionaries, returned from query or query_SOQL. This can also be the generator returned from iter_query or iter_SOQL, then the records are written as they arrive.
+	
+	out: the name and path of the output file
+	
+	order: a list having the order in which the columns should be displayed (can only contain columns included in the used records)
+
+	compress: If True, the output file is compressed with gzip (e.g. out="out.csv.gz")
+"""
+
+		import gzip
+
+		# If the CSV module is not found print error and exit
+		try:
+			import csv
+		except ImportError:
+			print "ERROR: csv module not found .. unable to create CSV file" 
+			return None
+
+		records=iter(records)
+
+		# Check if any records were returned
+		first=next(records,None)
+		if first is None:
+			print "No records were found .. ignoring CSV file creation"
+			return None
+		if first is False:
+			print "ERROR: Query failed .. ignoring CSV file creation"
+			return False
+
+		keys=self.csv_keys(first,order)
+		instrumented=self.metrics is not None or self.hooks
+
+		start=time.time()
+		count=0
+		with (gzip.open(out,'wb') if compress else open(out,'wb',1<<20)) as output_file:
+			writer = csv.writer(output_file,quoting=csv.QUOTE_ALL)
+			writer.writerow([k.encode('utf8') for k in keys])
+
+			for records in self.csv_batches(first,records):
+
+				# If query failed stop, the file only has the records received before the failure
+				if records is False:
+					print "ERROR: Query failed .. the CSV file is incomplete ("+str(count)+" records written)"
+					return False
+
+				stage_start=time.time() if instrumented else 0
+				writer.writerows(self.csv_rows(records,keys))
+				if instrumented:
+					self.record_stage("csv",stage_start)
+				count+=len(records)
+
+		elapsed=time.time()-start
+		print str(count)+" records written to "+out+" in "+("%.1f" % elapsed)+" seconds ("+str(int(count/elapsed) if elapsed else count)+" records/sec)"
+
+		return count
+
+
+
+	# (Internal usage) This function returns the columns of the CSV file
+	def csv_keys(self,first,order=[]):
+		"""(Internal usage) This function returns the columns of the CSV file, the columns in order (with the case corrected if needed) or the columns of the first record. A subquery in order is replaced by its columns prefixed by the relation name (the child records are exploded in the CSV file, see subqueries()) ... returns a List of columns"""
+
+		# Replace the subqueries by the columns of the child records
+		columns=[]
+		for column in order:
+			subquery=self.parse_SOQL(column[1:-1]) if column.startswith("(") else False
+			if subquery is False:
+				columns.append(column)
+			else:
+				columns+=[ subquery[1]+"."+child_column for child_column in subquery[0] ]
+
+		# check if columns in order are valid and correct case if needed
+		order=columns
+		if order:
+			keys=dict([ (k.lower(),k) for k in first.keys() ])
+			for i in range(len(order)):
+				order[i]=keys.get(order[i].lower(),order[i])
+
+		return order if order else first.keys()
+
+
+
+	# (Internal usage) This function returns the columns of the CSV file of a query
+	def csv_columns(self,soql):
+		"""(Internal usage) This function returns the columns of the CSV file of a query when no order is given: the columns of the SELECT list (the subqueries are expanded by csv_keys()), so a column is not lost when the relation is null in the first record. The columns of the first record are used if the SELECT list has other columns (e.g. functions, aliases or TYPEOF) ... returns a List of columns, or an empty List to use the columns of the first record"""
+
+		columns=self.select_columns(soql) or []
+		if all(column.startswith("(") or re.match(r"^\w+(\.\w+)*$",column) for column in columns):
+			return columns
+		return []
+
+
+
+	# (Internal usage) This function converts records to CSV rows
+	def csv_rows(self,records,keys):
+		"""(Internal usage) This function converts a List of records to rows of the CSV file having the values of the columns in keys ... returns a List of Lists of values"""
+
+		# encode Unicode (and the dates of the typed records)
+		return [ [ value.encode('utf8') if isinstance(value,unicode) else self.format_date(value) if isinstance(value,datetime.date) else value for value in [ record.get(key) for key in keys ] ] for record in records ]
+
+
+
+	# (Internal usage) This function exports a query to a CSV file, saving the progress after each page
+	def resumable_CSV(self,soql,filters=[],order=[],out="out.csv",compress=False,bulk=None):
+		"""(Internal usage) This function runs a query and exports the output to a CSV file (same as query_SOQL_to_CSV()), the cursor of the next page ("nextRecordsUrl", or the job and locator of the Bulk API) and the size of the file are saved in a state file (out+".state") after each page. If the state file of the same export is found, the file is cut to the saved size and the export continues from the saved cursor. The state file is removed when the export is complete ... returns the number of records written if successful and returns False if failed """
+
+		import gzip
+		import csv
+
+		state_file=out+".state"
+		try:
+			with open(state_file) as f:
+				state=json.load(f)
+		except (IOError,ValueError):
+			state=None
+
+		if state is not None and (state.get("soql")!=soql or state.get("filters")!=repr(filters) or state.get("compress")!=compress or not os.path.isfile(out)):
+			print "WARNING: "+state_file+" was saved by another export .. starting again"
+			state=None
+
+		if state is None:
+			cursor=None
+			if bulk is None:
+				bulk=self.use_bulk(soql)
+			if bulk:
+				pages=self.bulk_pages(soql,filters,rows=True,cursors=True)
+			else:
+				pages=self.query_pages(self.query_url(soql),filters,rows=True,cursors=True,children=self.subqueries(soql,"explode"),columns=self.select_columns(soql))
+			keys=None
+			count=0
+			offset=0
+		else:
+			cursor=state["cursor"]
+			if isinstance(cursor,dict):
+				pages=self.bulk_pages(soql,filters,rows=True,cursor=cursor,cursors=True)
+			else:
+				pages=self.query_pages(self.server_url+cursor,filters,rows=True,cursors=True,children=self.subqueries(soql,"explode"),columns=self.select_columns(soql))
+			keys=state["keys"]
+			count=state["count"]
+			offset=state["offset"]
+			print "<< Continuing the export of "+out+" after "+str(count)+" records >>"
+
+		start=time.time()
+		written=0
+		with open(out,"r+b" if state is not None else "wb") as output_file:
+
+			# Remove what was written after the last saved page
+			output_file.truncate(offset)
+			output_file.seek(offset)
+
+			for result in pages:
+
+				# If query failed stop, the next run continues from the last saved page
+				if result is False:
+					print "ERROR: Query failed .. the CSV file is incomplete ("+str(count)+" records written), run the export again with resume=True to continue"
+					return False
+				records,cursor=result
+
+				# A compressed page is written as a separate gzip member, so the file can be cut after any page
+				output=gzip.GzipFile(fileobj=output_file,mode="wb") if compress else output_file
+				writer=csv.writer(output,quoting=csv.QUOTE_ALL)
+				if keys is None and records:
+					keys=self.csv_keys(records[0],order or self.csv_columns(soql))
+					writer.writerow([k.encode('utf8') for k in keys])
+				if records:
+					stage_start=time.time()
+					writer.writerows(self.csv_rows(records,keys))
+					if self.metrics is not None or self.hooks:
+						self.record_stage("csv",stage_start)
+				if compress:
+					output.close()
+				output_file.flush()
+
+				count+=len(records)
+				written+=len(records)
+
+				# The pages are read to the end (e.g. the Bulk API job is deleted after its last chunk)
+				if cursor is not None:
+					self.write_file(state_file,json.dumps({"soql":soql,"filters":repr(filters),"compress":compress,"keys":keys,"count":count,"offset":output_file.tell(),"cursor":cursor}))
+
+		if os.path.isfile(state_file):
+			os.remove(state_file)
+
+		elapsed=time.time()-start
+		print str(count)+" records written to "+out+" in "+("%.1f" % elapsed)+" seconds ("+str(int(written/elapsed) if elapsed else written)+" records/sec)"
+
+		return count
+
+
+
+	# (Internal usage) This function formats a date for the CSV file
+	def format_date(self,value):
+		"""(Internal usage) This function formats a date or a datetime (in UTC) of the typed records the same way as salesforce (e.g. "2016-09-17" or "2016-09-17T10:00:00.000Z") ... returns the formatted date"""
+
+		if isinstance(value,datetime.datetime):
+			return value.strftime("%Y-%m-%dT%H:%M:%S.")+("%03dZ" % (value.microsecond//1000))
+		return value.isoformat()
+
+
+
+	# (Internal usage) This function groups the records in batches for the CSV file
+	def csv_batches(self,first,records,size=1000):
+		"""(Internal usage) This generator groups the records (starting with first) in Lists of up to "size" records, so they can be written together ... yields Lists of records, and yields False if the records end with False (query failed)"""
+
+		batch=[first]
+		for record in records:
+			if record is False:
+				if batch:
+					yield batch
+				yield False
+				return
+			batch.append(record)
+			if len(batch)>=size:
+				yield batch
+				batch=[]
+		if batch:
+			yield batch
+
+
+
+	# This function runs the query and puts the output in a CSV file
+	def query_to_CSV(self,table,columns,conditions=[],filters=[],out="out.csv",compress=False,resume=False):
+		""" This function creates a query and runs it using the REST API, then exports the output to a CSV file. The records are written as the pages arrive, so the memory used doesn't depend on the number of records.
+ARGUMENTS:
+
+	table,columns,conditions,filters: Same as the query() function.
+
+	out:  the name and path of the output file.
+
+	compress: If True, the output file is compressed with gzip (e.g. out="casehist.csv.gz")
+
+	resume: Same as the query_SOQL_to_CSV() function.
+
+EXAMPLE:
+
+    # The below example searches "CaseHistory" for items created This month and the changed field was "Owner" OR "OwnerAccepted", then applied a filter on the NewValue to only be "John.Smith"
+    sf=py_salesforce()
+
+    table="CaseHistory"
+    columns=["Id","CreatedDate","Field","OldValue","NewValue","Case.CaseNumber"]
+    conditions=['CreatedDate=THIS_MONTH',["Field=\'Owner\'","Field=\'ownerAccepted\'"]]
+    filters=[("NewValue","==\'John.Smith\'")]
+	out="casehist.csv"
+
+	sf.query_to_CSV(table=table,columns=columns,conditions=conditions,filters=filters,out=out)
+
+"""
+
+
+		if resume:
+			return self.resumable_CSV(self.generate_query(table,columns,conditions),filters,columns,out,compress)
+
+		records=self.iter_query(table,columns,conditions,filters,rows=True,children="explode")
+
+		return self.to_CSV(records,out,columns,compress)	
+
+
+
+	# This function runs the query with SOQL and puts the output in a CSV file
+	def query_SOQL_to_CSV(self,soql,filters=[],order=[],out="out.csv",compress=False,resume=False):
+		""" This function runs a query using the REST API, and exports the output to a CSV file. The records are written as the pages arrive, so the memory used doesn't depend on the number of records.
+ARGUMENTS:
+
+    soql: The SOQL query.
+
+    filters: same as the query and query_SOQL functions.
+
+	order: a list having the order in which the columns should be displayed (can only contain columns included in the used records), by default the columns of the SELECT list of the query
+ 
+	out: the name and path of the output file.
+
+	compress: If True, the output file is compressed with gzip (e.g. out="casehist.csv.gz")
+
+	resume: If True, the progress is saved in a state file (out+".state") after each page, and if the export stops (e.g. the query failed or the script was stopped) running it again with resume=True continues from the last saved page instead of downloading all the records again. The REST API query cursor expires after about 15 minutes without use (the Bulk API results are kept for 7 days), then remove the state file to start again.
+ 
+EXAMPLE:
+
+    # The below example searches "CaseHistory" for items created This month and the changed field was "Owner" OR "OwnerAccepted", then applied a filter on the NewValue to only be "John.Smith"
+    sf=py_salesforce()
+
+    soql="SELECT Id,CreatedDate,Field,OldValue,NewValue,Case.CaseNumber FROM CaseHistory WHERE CreatedDate = THIS_MONTH and (Field=\'Owner\' OR Field=\'ownerAccepted\')"
+    filters=[("NewValue","==\'John.Smith\'")]
+	order=["Id","CreatedDate","Field","OldValue","NewValue","Case.CaseNumber"]
+	out="casehist.csv"
+
+	sf.query_SOQL_to_CSV(soql=soql,filters=filters,order=order,out=out)
+
+"""
+
+		if resume:
+			return self.resumable_CSV(soql,filters,order,out,compress)
+
+		records=self.iter_SOQL(soql,filters,rows=True,children="explode")
+				
+		return self.to_CSV(records,out,order or self.csv_columns(soql),compress)	
+
+
+
+	# This function exports records to a columnar file (Parquet, Arrow or NumPy)
+	def to_columnar(self,records,out="out.parquet",order=[],types={},format=None,row_group=50000):
+		"""This function exports records returned from query or query_SOQL into a columnar file, each column is saved with its own type (e.g. numbers, booleans and dates are not saved as text), so the file is smaller and faster to load than a CSV file. The records are written in groups of "row_group" records, so the memory used doesn't depend on the number of records (except for the npz format) ... returns the number of records written if successful and returns False if failed.
+ARGUMENTS:
+
+	records: List of dictionaries, returned from query or query_SOQL. This can also be the generator returned from iter_query or iter_SOQL, then the records are written as they arrive.
+
+	out: the name and path of the output file
+
+	order: a list having the columns to write and their order, the columns of the first record are used if not set.
+
+	types: a dictionary having the salesforce type (as returned by describe_object(), e.g. "boolean", "int", "double", "currency", "date", "datetime") of the columns, the other columns are saved as text. The query_to_columnar() and query_SOQL_to_columnar() functions find the types automatically.
+
+	format: "parquet" (needs the pyarrow module), "arrow" (Arrow IPC file, needs the pyarrow module) or "npz" (NumPy arrays, needs the numpy module, the null values of the columns that are not numbers or dates are saved in a "<column>.null" array). If not set, the format is found from the extension of the file (.parquet, .arrow, .feather or .npz), otherwise parquet is used if pyarrow is installed and npz if not.
+
+	row_group: the number of records in each row group (Parquet) or record batch (Arrow).
+
+EXAMPLE:
+
+	sf=py_salesforce()
+
+	records=sf.iter_SOQL("SELECT Id,IsClosed,CreatedDate FROM Case")
+	sf.to_columnar(records,out="case.parquet",types={"IsClosed":"boolean","CreatedDate":"datetime"})
+
+"""
+
+		format=self.columnar_format(out,format)
+		if format is False:
+			return False
+
+		records=iter(records)
+
+		# Check if any records were returned
+		first=next(records,None)
+		if first is None:
+			print "No records were found .. ignoring file creation"
+			return None
+		if first is False:
+			print "ERROR: Query failed .. ignoring file creation"
+			return False
+
+		# check if columns in order are valid and correct case if needed
+		keys=dict([ (key.lower(),key) for key in first.keys() ])
+		columns=[ keys.get(column.lower(),column) for column in order ] if order else first.keys()
+
+		types=dict([ (column.lower(),sf_type) for column,sf_type in types.items() ])
+		groups=[ self.typed_fields.get(types.get(column.lower())) for column in columns ]
+		converters=[ self.value_converter(types.get(column.lower())) for column in columns ]
+
+		if format=="npz":
+			import numpy
+			arrays=[ [] for column in columns ]
+			nulls=[ [] for column in columns ]
+		else:
+			import pyarrow
+			schema=pyarrow.schema([ pyarrow.field(column,self.arrow_type(group)) for column,group in zip(columns,groups) ])
+			if format=="parquet":
+				import pyarrow.parquet
+				writer=pyarrow.parquet.ParquetWriter(out,schema)
+			else:
+				writer=pyarrow.RecordBatchFileWriter(out,schema)
+
+		start=time.time()
+		count=0
+		try:
+			for records in self.csv_batches(first,records,row_group):
+
+				# If query failed stop, the file only has the records received before the failure
+				if records is False:
+					print "ERROR: Query failed .. the file is incomplete ("+str(count)+" records written)"
+					return False
+
+				values=[ [ record.get(column) for record in records ] for column in columns ]
+				values=[ map(converter,column_values) if converter else column_values for converter,column_values in zip(converters,values) ]
+
+				if format=="npz":
+					for i,column_values in enumerate(values):
+						array,null=self.numpy_array(column_values,groups[i])
+						arrays[i].append(array)
+						nulls[i].append(null)
+				else:
+					batch=pyarrow.RecordBatch.from_arrays([ pyarrow.array(column_values,type=field.type) for column_values,field in zip(values,schema) ],schema=schema)
+					if format=="parquet":
+						writer.write_table(pyarrow.Table.from_batches([batch]))
+					else:
+						writer.write_batch(batch)
+
+				count+=len(records)
+		finally:
+			if format!="npz":
+				writer.close()
+
+		if format=="npz":
+			output={}
+			for column,column_arrays,column_nulls in zip(columns,arrays,nulls):
+				output[column]=numpy.concatenate(column_arrays)
+				if any([ null is not None for null in column_nulls ]):
+					output[column+".null"]=numpy.concatenate([ null if null is not None else numpy.zeros(len(array),dtype=bool) for array,null in zip(column_arrays,column_nulls) ])
+			with open(out,"wb") as output_file:
+				numpy.savez_compressed(output_file,**output)
+
+		elapsed=time.time()-start
+		print str(count)+" records written to "+out+" in "+("%.1f" % elapsed)+" seconds ("+str(int(count/elapsed) if elapsed else count)+" records/sec)"
+
+		return count
+
+
+
+	# (Internal usage) This function finds the format of a columnar file
+	def columnar_format(self,out,format=None):
+		"""(Internal usage) This function finds the format of a columnar file from the format argument or the extension of the file, and checks that the module it needs (pyarrow or numpy) is installed ... returns the format if successful and returns False if failed"""
+
+		if format is None:
+			extension=os.path.splitext(out)[1].lower()
+			format={".parquet":"parquet",".arrow":"arrow",".feather":"arrow",".npz":"npz"}.get(extension)
+
+		if format is None:
+			try:
+				import pyarrow.parquet
+				return "parquet"
+			except ImportError:
+				format="npz"
+
+		if format not in ("parquet","arrow","npz"):
+			print "ERROR: Invalid format "+repr(format)+" .. use parquet, arrow or npz"
+			return False
+
+		try:
+			if format=="npz":
+				import numpy
+			else:
+				import pyarrow.parquet
+		except ImportError:
+			print "ERROR: "+("numpy" if format=="npz" else "pyarrow")+" module not found .. unable to create the "+format+" file"
+			return False
+
+		return format
+
+
+
+	# (Internal usage) This function returns the pyarrow type of a column
+	def arrow_type(self,group):
+		"""(Internal usage) This function returns the pyarrow type of a column from its type group (see typed_fields) ... returns the pyarrow type"""
+
+		import pyarrow
+
+		if group=="boolean":
+			return pyarrow.bool_()
+		if group=="int":
+			return pyarrow.int64()
+		if group=="double":
+			return pyarrow.float64()
+		if group=="date":
+			return pyarrow.date32()
+		if group=="datetime":
+			return pyarrow.timestamp("ms",tz="UTC")
+		return pyarrow.string()
+
+
+
+	# (Internal usage) This function converts the values of a column to a NumPy array
+	def numpy_array(self,values,group):
+		"""(Internal usage) This function converts the values of a column to a NumPy array of its type group (see typed_fields), the null values are saved as NaN (double), NaT (dates) or in a separate boolean array for the other types ... returns the array and the null array (None if there are no null values or if they are saved as NaN/NaT)"""
+
+		import numpy
+
+		if group=="double":
+			return numpy.array([ numpy.nan if value is None else value for value in values ],dtype=numpy.float64),None
+		if group=="date":
+			return numpy.array(values,dtype="datetime64[D]"),None
+		if group=="datetime":
+			return numpy.array(values,dtype="datetime64[ms]"),None
+
+		null=[ value is None for value in values ]
+		if group=="boolean":
+			array=numpy.array([ bool(value) for value in values ],dtype=bool)
+		elif group=="int":
+			array=numpy.array([ value or 0 for value in values ],dtype=numpy.int64)
+		else:
+			array=numpy.array([ u"" if value is None else value if isinstance(value,basestring) else unicode(value) for value in values ],dtype=unicode)
+
+		return array,numpy.array(null,dtype=bool) if any(null) else None
+
+
+
+	# (Internal usage) This function returns a function converting the values of a column to its type
+	def value_converter(self,sf_type):
+		"""(Internal usage) This function returns a function that converts a value returned by salesforce (by the REST API, or as a string by the Bulk API) to the python type of a salesforce type (bool, int, float, datetime.date or datetime.datetime in UTC), the values that are already converted are returned as they are ... returns the function, or None if the values don't need to be converted (e.g. text)"""
+
+		group=self.typed_fields.get(sf_type)
+
+		if group=="boolean":
+			return lambda value: (value.lower()=="true" if value else None) if isinstance(value,basestring) else value
+		if group=="int":
+			return lambda value: (int(float(value)) if value else None) if isinstance(value,basestring) else value
+		if group=="double":
+			return lambda value: (float(value) if value else None) if isinstance(value,basestring) else value
+		if group=="date":
+			return lambda value: (datetime.datetime.strptime(value[:10],"%Y-%m-%d").date() if value else None) if isinstance(value,basestring) else value
+		if group=="datetime":
+			return lambda value: (self.parse_datetime(value) if value else None) if isinstance(value,basestring) else value
+		return None
+
+
+
+	# (Internal usage) This function finds the salesforce types of the columns of a query
+	def column_types(self,table,columns):
+		"""(Internal usage) This function finds the salesforce type of each column of a query from the describe of the Object (and of the parent Objects for the Child-to-Parent relations, e.g. Owner.Name), the aggregate functions and the subqueries are not included ... returns a dictionary having the type of each column if successful and returns False if failed"""
+
+		describe=self.describe_object(table,print_fields=False,print_child_rel=False)
+		if describe is False:
+			return False
+
+		types={}
+		for column in columns:
+			if "(" in column:
+				continue
+
+			fields=describe[0]
+			path=column.split(".")
+			for i,name in enumerate(path):
+				if i==len(path)-1:
+					found=[ field["type"] for field in fields if field["name"].lower()==name.lower() ]
+					if found:
+						types[column]=found[0]
+					break
+
+				# Child-to-Parent relation, use the fields of the parent Object
+				parents=[ field["referenceTo"] for field in fields if (field.get("relationshipName") or "").lower()==name.lower() and field.get("referenceTo") ]
+				if not parents:
+					break
+				parent=self.describe_object(parents[0][0],print_fields=False,print_child_rel=False)
+				if parent is False:
+					break
+				fields=parent[0]
+
+		return types
+
+
+
+	# This function runs the query and puts the output in a columnar file
+	def query_to_columnar(self,table,columns,conditions=[],filters=[],out="out.parquet",format=None,bulk=None):
+		""" This function creates a query and runs it, then exports the output to a columnar file (see to_columnar()), the type of each column is found from the describe of the Object. The records are written as the pages arrive.
+ARGUMENTS:
+
+	table,columns,conditions,filters,bulk: Same as the query() function.
+
+	out, format: Same as the to_columnar() function.
+
+EXAMPLE:
+
+	sf=py_salesforce()
+
+	sf.query_to_columnar(table="Case",columns=["Id","CaseNumber","IsClosed","CreatedDate","Owner.Name"],conditions=["CreatedDate=THIS_YEAR"],out="case.parquet")
+
+"""
+
+		return self.query_SOQL_to_columnar(self.generate_query(table,columns,conditions),filters,[],out,format,bulk)
+
+
+
+	# This function runs the query with SOQL and puts the output in a columnar file
+	def query_SOQL_to_columnar(self,soql,filters=[],order=[],out="out.parquet",format=None,bulk=None):
+		""" This function runs a query, and exports the output to a columnar file (see to_columnar()), the type of each column is found from the describe of the Object. The records are written as the pages arrive.
+ARGUMENTS:
+
+	soql,filters,bulk: Same as the query_SOQL() function.
+
+	order: a list having the columns to write and their order, the columns of the query are used if not set.
+
+	out, format: Same as the to_columnar() function.
+
+"""
+
+		if self.columnar_format(out,format) is False:
+			return False
+
+		parts=self.parse_SOQL(soql)
+		if parts is False:
+			print "ERROR: Invalid SOQL query"
+			return False
+
+		types=self.column_types(parts[1],parts[0])
+		if types is False:
+			return False
+
+		order=order or [ column for column in parts[0] if "(" not in column ]
+		records=self.iter_SOQL(soql,filters,rows=True,bulk=bulk,typed=True)
+
+		return self.to_columnar(records,out,order,types,format)
+
+
+
+	# This is a function used to flatten nested dicts to create a list
+	def flatten(self, d, parent_key='', sep='.'):
+		""" (Internal Usage) This is a function used to flatten nested dicts to create a list """
+		items = []
+		for k, v in d.items():
+			if k=='attributes' and type(v) is dict:
+				continue
+			new_key = parent_key + sep + k if parent_key else k
+			if self.is_subquery_result(v):
+				items.append((new_key, [self.flatten(r, sep=sep) for r in v['records']]))
+			elif isinstance(v, collections.MutableMapping):
+				items.extend(self.flatten(v, new_key, sep=sep).items())
+			else:
+				items.append((new_key, v))
+		return dict(items)
+
+
+
+	# (Internal usage) This function creates the plan used to flatten all the records of a query
+	def flatten_plan(self,record,paths=None,unknown=None,columns=None,records=()):
+		"""(Internal usage) This function creates the plan used by flatten_records() from a sample record, so the nested dicts are only walked once per query instead of once per record. If columns is given (the SELECT list of the query, see select_columns()), the relations that are null in the sample record get the columns of the SELECT list (e.g. "Account.Name" and "Account.Owner.Name" instead of "Account"), with the case of the field names found in the other records of the page (see select_paths()), so all the records of the query have the same keys. If paths is given, it is updated using the relations that were null (unknown) in the previous sample ... returns the plan"""
+
+		if paths is None:
+			paths=self.record_paths(record)
+		else:
+			# Expand the relations that are not null in this record
+			new_paths=[]
+			for i,path in enumerate(paths):
+				value=self.path_value(record,path)
+				if i in unknown and isinstance(value,collections.MutableMapping):
+					new_paths.extend(self.record_paths(value,path))
+				else:
+					new_paths.append(path)
+			paths=new_paths
+
+		if columns:
+			paths=self.select_paths(record,paths,columns,records)
+
+		plan={}
+		plan["paths"]=paths
+		plan["columns"]=columns
+		plan["keys"]=[ ".".join(path) for path in paths ]
+		plan["header"]=dict([ (key,i) for i,key in enumerate(plan["keys"]) ])
+
+		# Null values might be null relations, they are checked in the next records
+		plan["unknown"]=frozenset([ i for i,path in enumerate(paths) if self.path_value(record,path) is None ])
+		plan["unknown_keys"]=[ plan["keys"][i] for i in plan["unknown"] ]
+
+		# The records without relations are already flat, flatten_records() keeps them without copying
+		plan["flat"]=frozenset(plan["keys"]) if all(len(path)==1 for path in paths) else None
+
+		# Get the values of the first level columns in one call
+		plan["first_level"]=[ i for i,path in enumerate(paths) if len(path)==1 ]
+		plan["nested"]=[ (i,path) for i,path in enumerate(paths) if len(path)>1 ]
+		first_level=[ paths[i][0] for i in plan["first_level"] ]
+		if len(first_level)>1:
+			plan["get_first_level"]=operator.itemgetter(*first_level)
+		elif first_level:
+			plan["get_first_level"]=lambda record,key=first_level[0]: (record[key],)
+		else:
+			plan["get_first_level"]=lambda record: ()
+
+		return plan
+
+
+
+	# (Internal usage) This function returns the key paths of the columns of a record
+	def record_paths(self,record,parent_path=()):
+		"""(Internal usage) This function returns the key paths of the columns of a (nested) record, e.g. [("Id",),("Case","CaseNumber")]"""
+
+		paths=[]
+		for k, v in record.items():
+			if k=='attributes' and type(v) is dict:
+				continue
+			if isinstance(v, collections.MutableMapping) and not self.is_subquery_result(v):
+				paths.extend(self.record_paths(v,parent_path+(k,)))
+			else:
+				paths.append(parent_path+(k,))
+		return paths
+
+
+
+	# (Internal usage) This function completes the key paths of the null relations using the SELECT list
+	def select_paths(self,record,paths,columns,records=()):
+		"""(Internal usage) This function replaces the key path of each null relation of a record (e.g. ("Account",)) by the key paths of its columns in the SELECT list of the query (e.g. ("Account","Name") and ("Account","Owner","Name")). The field names get the case used by salesforce (see field_names()), not the case of the SELECT list, so the keys don't depend on which records have the relation ... returns the key paths"""
+
+		fields=[ tuple(column.split(".")) for column in columns if re.match(r"^\w+(\.\w+)+$",column) ]
+		if not fields:
+			return paths
+
+		expanded=[]
+		for path in paths:
+			suffixes=[]
+			if self.path_value(record,path) is None:
+				prefix=[ k.lower() for k in path ]
+				for field in fields:
+					suffix=self.field_names(record,records,path,field[len(path):]) if len(field)>len(path) and [ k.lower() for k in field[:len(path)] ]==prefix else None
+					if suffix is not None and suffix not in suffixes:
+						suffixes.append(suffix)
+			expanded.extend([ path+suffix for suffix in suffixes ] or [path])
+		return expanded
+
+
+
+	# (Internal usage) This function finds the case of the field names of a column of a null relation
+	def field_names(self,record,records,path,names):
+		"""(Internal usage) This function finds the names of the fields of a column of the SELECT list (e.g. ("owner","name")) under a relation that is null in a record (e.g. ("Account",)) with the case used by salesforce: from the first record of the page (records) having these fields, or else from the describe of the Objects (metadata cache). The names of the SELECT list are kept if they are not found ... returns a tuple of the names"""
+
+		lower=[ name.lower() for name in names ]
+
+		# From the records of the page having the relation
+		for other in records:
+			value=self.path_value(other,path)
+			found=[]
+			for name in lower:
+				if not isinstance(value,collections.MutableMapping):
+					break
+				key=next((key for key in value if key.lower()==name),None)
+				if key is None:
+					break
+				found.append(key)
+				value=value[key]
+			if len(found)==len(names):
+				return tuple(found)
+
+		# From the describe of the Object of the record and of the parent Objects
+		attributes=record.get("attributes")
+		object_name=attributes.get("type") if isinstance(attributes,collections.MutableMapping) else None
+		found=[]
+		for i,name in enumerate([ k.lower() for k in path ]+lower):
+			describe=self.describe_object(object_name,print_fields=False,print_child_rel=False) if object_name else False
+			if describe is False:
+				break
+			if i==len(path)+len(names)-1:
+				found+=[ field["name"] for field in describe[0] if field["name"].lower()==name ][:1]
+				break
+			parents=[ field for field in describe[0] if (field.get("relationshipName") or "").lower()==name and field.get("referenceTo") ]
+			if not parents:
+				break
+			if i>=len(path):
+				found.append(parents[0]["relationshipName"])
+			object_name=parents[0]["referenceTo"][0]
+
+		return tuple(found) if len(found)==len(names) else tuple(names)
+
+
+
+	# (Internal usage) This function returns the value of a key path
+	def path_value(self,record,path):
+		"""(Internal usage) This function returns the value of a key path in a nested record, or None if a relation in the path is null. The fields are matched ignoring the case if needed (the paths taken from the SELECT list might have another case)"""
+
+		value=record
+		for k in path:
+			if value is None:
+				return None
+			try:
+				value=value[k]
+			except KeyError:
+				lower=k.lower()
+				value=next((v for key,v in value.iteritems() if key.lower()==lower),None)
+		return value
+
+
+
+	# (Internal usage) This function flattens the records of a page using the flatten plan
+	def flatten_records(self,records,plan,rows=False):
+		"""(Internal usage) This function flattens a list of records using the plan created by flatten_plan(), the plan is updated if a relation that was null in the first record is found. The records of the queries without relations are already flat, so the decoded dictionaries are kept (only their "attributes" are removed) instead of being copied ... returns a List of dictionaries (or record_row if rows is True)"""
+
+		flat=[]
+		if plan["flat"] is not None and not rows:
+			for record in records:
+				if type(record.get('attributes')) is dict:
+					del record['attributes']
+				# Different columns or a relation that was null in the previous records, the next records are flattened using the plan
+				if record.viewkeys()!=plan["flat"] or any(isinstance(record[key],collections.MutableMapping) for key in plan["unknown_keys"]):
+					break
+				flat.append(record)
+			if len(flat)==len(records):
+				return flat
+			records=records[len(flat):]
+
+		for record in records:
+			try:
+				values=self.plan_values(record,plan)
+			except (KeyError,TypeError):
+				# Different columns than the first record
+				flat.append(self.flatten(record))
+				continue
+
+			# Check if a relation that was null in the previous records is found (only for the relations that are not in the SELECT list)
+			if plan["unknown"] and any(isinstance(values[i],collections.MutableMapping) for i in plan["unknown"]):
+				keys=plan["keys"]
+				plan.update(self.flatten_plan(record,plan["paths"],plan["unknown"],plan["columns"],records))
+				flat=self.extend_records(flat,keys,plan,rows)
+				values=self.plan_values(record,plan)
+
+			flat.append(record_row(plan["header"],values) if rows else dict(zip(plan["keys"],values)))
+
+		if rows:
+			flat=[ record if isinstance(record,record_row) else record_row(dict([ (key,i) for i,key in enumerate(record) ]),record.values()) for record in flat ]
+
+		return flat
+
+
+
+	# (Internal usage) This function returns the values of a record using the flatten plan
+	def plan_values(self,record,plan):
+		"""(Internal usage) This function returns the values of the columns of the flatten plan in a record, and raises KeyError or TypeError if the record has different columns ... returns a List"""
+
+		first_level=plan["get_first_level"](record)
+		values=[None]*len(plan["paths"])
+		for i,value in zip(plan["first_level"],first_level):
+			values[i]=value
+		for i,path in plan["nested"]:
+			values[i]=self.path_value(record,path)
+		return values
+
+
+
+	# (Internal usage) This function adds the new columns of the flatten plan to the records flattened before
+	def extend_records(self,records,keys,plan,rows=False):
+		"""(Internal usage) This function updates the records flattened before the flatten plan was extended (keys are the columns of the previous plan): the null relations replaced by their columns are removed and the new columns are set to None, so the records of the page have the same keys ... returns the records"""
+
+		removed=set(keys)-set(plan["keys"])
+		extended=[]
+		for record in records:
+			values=dict(record.items())
+			for key in removed:
+				if values.get(key) is None:
+					values.pop(key,None)
+			for key in plan["keys"]:
+				values.setdefault(key,None)
+			extended.append(record_row(plan["header"],[ values[key] for key in plan["keys"] ]) if rows and len(values)==len(plan["keys"]) else values)
+		return extended
+
+		
+
+	# (Internal usage) This function returns metadata (describe and sobjects) from the cache or from salesforce
+	def get_metadata(self,path):
+		"""(Internal usage) This function returns the parsed JSON content of a metadata url (e.g. "sobjects" or "sobjects/Case/describe"). The content is cached in memory and in the tmp/metadata directory, it is reused for METADATA_CACHE_TTL seconds (config file), then revalidated with an If-Modified-Since/If-None-Match request so it is only downloaded again if it changed ... returns the parsed JSON content if successful and returns False if failed """
+
+		url=self.REST_url+path
+
+		# Caching disabled
+		if self.metadata_cache_ttl<=0:
+			return self.get_json(url)
+
+		key,entry=self.metadata_entry(url)
+		now=time.time()
+
+		# Fresh entry, no request needed
+		if entry is not None and now-entry["fetched"]<self.metadata_cache_ttl:
+			self.cache_metadata(key,entry,write=False)
+			return entry["content"]
+
+		headers={}
+		if entry is not None:
+			if entry["etag"]:
+				headers["If-None-Match"]=entry["etag"]
+			import email.utils
+			headers["If-Modified-Since"]=entry["last_modified"] or email.utils.formatdate(entry["fetched"],usegmt=True)
+
+		result=self.request_json(url,headers)
+
+		# If request failed don't continue
+		if result is False:
+			return False
+
+		response,content_json=result
+		if content_json is None:
+			# Not modified
+			entry["fetched"]=now
+		else:
+			entry={"url":url,"fetched":now,"etag":response.get("etag"),"last_modified":response.get("last-modified"),"content":content_json}
+
+		self.cache_metadata(key,entry)
+		return entry["content"]
+
+
+
+	# (Internal usage) This function returns the cache key of a metadata url
+	def metadata_key(self,url):
+		"""(Internal usage) This function returns the cache key (and file name) of a metadata url"""
+
+		import hashlib
+
+		return hashlib.sha1(url).hexdigest()
+
+
+
+	# (Internal usage) This function finds a metadata entry in the cache
+	def metadata_entry(self,url):
+		"""(Internal usage) This function finds the cached metadata entry of a url in memory or in the tmp/metadata directory ... returns the cache key and the entry (None if not found)"""
+
+		key=self.metadata_key(url)
+
+		with self.metadata_lock:
+			entry=self.metadata_cache.get(key)
+		if entry is None:
+			entry=self.read_metadata_file(key)
+
+		return key,entry
+
+
+
+	# (Internal usage) This function reads a metadata cache file
+	def read_metadata_file(self,key):
+		"""(Internal usage) This function reads a cached metadata entry from the tmp/metadata directory ... returns the entry if found and returns None if not found"""
+
+		try:
+			with open(os.path.join(self.metadata_dir,key+".json")) as metadata_file:
+				return json.load(metadata_file)
+		except (IOError,ValueError):
+			return None
+
+
+
+	# (Internal usage) This function saves a metadata entry in the cache
+	def cache_metadata(self,key,entry,write=True):
+		"""(Internal usage) This function saves a metadata entry in the memory cache and (if write is True) in the tmp/metadata directory, the least recently used entries are removed when there are more than METADATA_CACHE_SIZE entries (config file)"""
+
+		with self.metadata_lock:
+			self.metadata_cache.pop(key,None)
+			self.metadata_cache[key]=entry
+			while len(self.metadata_cache)>self.metadata_cache_size:
+				self.metadata_cache.popitem(last=False)
+
+		if not os.path.isdir(self.metadata_dir):
+			os.makedirs(self.metadata_dir)
+
+		path=os.path.join(self.metadata_dir,key+".json")
+		if write:
+			self.write_file(path,json.dumps(entry))
+
+			# Remove the least recently used files
+			files=[ os.path.join(self.metadata_dir,f) for f in os.listdir(self.metadata_dir) if f.endswith(".json") ]
+			if len(files)>self.metadata_cache_size:
+				files.sort(key=os.path.getmtime)
+				for f in files[:len(files)-self.metadata_cache_size]:
+					try:
+						os.remove(f)
+					except OSError:
+						pass
+		elif os.path.isfile(path):
+			# Mark the file as recently used
+			os.utime(path,None)
+
+
+
+	# This function clears the metadata cache
+	def clear_metadata_cache(self):
+		""" This function clears the cached describe and sobjects metadata (in memory and in the tmp/metadata directory), so it is downloaded again on the next call. This can be used after changing the fields of an Object."""
+
+		with self.metadata_lock:
+			self.metadata_cache.clear()
+
+		if os.path.isdir(self.metadata_dir):
+			for f in os.listdir(self.metadata_dir):
+				try:
+					os.remove(os.path.join(self.metadata_dir,f))
+				except OSError:
+					pass
+
+
+
+	# (Internal usage) This function runs a query using the query result cache
+	def cached_query_SOQL(self,soql,filters=[],prefetch=None,rows=False,bulk=None,ttl=0,typed=False,children="nested"):
+		"""(Internal usage) This function returns the records of a query from the cache if a result newer than ttl seconds is found, otherwise it runs the query and caches the result (before the values are converted, the child records are exploded and the filters are applied, so the same query with other filters uses the same result) ... returns List of dictionaries (records) if successful and returns False if failed """
+
+		# Compile the filters before running the query
+		match=self.compile_filters(filters) if filters else None
+		if match is False:
+			return False
+
+		subqueries=self.subqueries(soql,children)
+		if subqueries is False:
+			return False
+
+		convert=self.typed_converter(soql) if typed else None
+		if convert is False:
+			return False
+
+		# The Bulk API returns all the values as strings, so its results are cached separately from the REST API results, and both can be used when bulk is not set
+		for mode in ([bulk] if bulk is not None else [False,True]):
+			packed=self.cached_query(self.query_cache_key(soql,mode),ttl)
+			if packed is not None:
+				break
+
+		if packed is None:
+			if bulk is None:
+				bulk=self.use_bulk(soql)
+			key=self.query_cache_key(soql,bulk)
+			records=self.query_SOQL(soql,[],prefetch,False,bulk,0)
+			if records is False:
+				return False
+
+			if len(records)<=self.query_cache_max_records:
+				packed=self.pack_records(records)
+				self.cache_query(key,soql,packed)
+			# The child records are copied so the cached result isn't changed
+			if rows or (packed is not None and subqueries is not None):
+				records=self.unpack_records(packed if packed is not None else self.pack_records(records),rows,subqueries is not None)
+		else:
+			print "<< Using the cached result ("+str(len(packed["rows"]))+" records) >>"
+			records=self.unpack_records(packed,rows,subqueries is not None)
+
+		if convert is not None:
+			convert(records)
+
+		if subqueries is not None and subqueries["explode"]:
+			records=self.explode_children(records,subqueries,rows)
+
+		if match is not None:
+			records=[record for record in records if match(record)]
+
+		return records
+
+
+
+	# (Internal usage) This function returns the cache key of a query
+	def query_cache_key(self,soql,bulk=False):
+		"""(Internal usage) This function returns the cache key of a query, created from the normalized query, the REST url (instance and API version) and the API used (the Bulk API results have string values)"""
+
+		import hashlib
+
+		text=self.REST_url+"\n"+("bulk" if bulk else "rest")+"\n"+self.normalize_SOQL(soql)
+		if isinstance(text,unicode):
+			text=text.encode("utf8")
+
+		return hashlib.sha1(text).hexdigest()
+
+
+
+	# (Internal usage) This function normalizes a SOQL query
+	def normalize_SOQL(self,soql):
+		"""(Internal usage) This function normalizes a SOQL query, so the same query written differently has the same cache key. The case and the spaces are normalized everywhere except inside the quoted strings ... returns the normalized query"""
+
+		parts=re.split(r"('(?:\\.|[^'\\])*')",soql)
+		for i in range(0,len(parts),2):
+			part=re.sub(r"\s+"," ",parts[i].lower())
+			parts[i]=re.sub(r" ?([,()=<>!]) ?",r"\1",part)
+
+		return "".join(parts).strip()
+
+
+
+	# (Internal usage) This function packs records for the query cache
+	def pack_records(self,records):
+		"""(Internal usage) This function packs a List of records in a compact form, the column names are saved once for all the records having the same columns ... returns a dictionary with "headers" (Lists of column names) and "rows" (Lists of the header index followed by the values)"""
+
+		headers=[]
+		header_index={}
+		packed_rows=[]
+		for record in records:
+			keys=tuple(record.keys())
+			i=header_index.get(keys)
+			if i is None:
+				i=header_index[keys]=len(headers)
+				headers.append(list(keys))
+			packed_rows.append([i]+[record[key] for key in keys])
+
+		return {"headers":headers,"rows":packed_rows}
+
+
+
+	# (Internal usage) This function unpacks records of the query cache
+	def unpack_records(self,packed,rows=False,children=False):
+		"""(Internal usage) This function unpacks records packed by pack_records(), new records are created each time so the cached result isn't changed by the caller (and new child records of the subqueries if children is True) ... returns a List of dictionaries (or record_row if rows is True)"""
+
+		if children:
+			packed={"headers":packed["headers"],"rows":[ [ [ dict(child) for child in value ] if isinstance(value,list) else value for value in row ] for row in packed["rows"] ]}
+
+		if rows:
+			headers=[ dict([ (key,i) for i,key in enumerate(keys) ]) for keys in packed["headers"] ]
+			return [ record_row(headers[row[0]],row[1:]) for row in packed["rows"] ]
+
+		headers=packed["headers"]
+		return [ dict(zip(headers[row[0]],row[1:])) for row in packed["rows"] ]
+
+
+
+	# (Internal usage) This function opens the query cache database
+	def query_cache_db(self):
+		"""(Internal usage) This function opens the tmp/query_cache.db sqlite database (a new connection is used by each call, so it can be used by many threads) ... returns the connection"""
+
+		import sqlite3
+
+		if not os.path.isdir(self.tmp_dir):
+			os.makedirs(self.tmp_dir)
+
+		db=sqlite3.connect(self.query_cache_file,timeout=30)
+		db.execute("CREATE TABLE IF NOT EXISTS query_cache (key TEXT PRIMARY KEY, soql TEXT, object TEXT, fetched REAL, used REAL, records BLOB)")
+		return db
+
+
+
+	# (Internal usage) This function finds a query result in the cache
+	def cached_query(self,key,ttl):
+		"""(Internal usage) This function finds the cached result of a query in memory or in tmp/query_cache.db, if it is newer than ttl seconds. The database is only opened if the result is not in memory, the last use of the results found in memory is saved later (see save_query_cache_used()) ... returns the packed records (see pack_records()) and returns None if not found"""
+
+		import zlib
+
+		now=time.time()
+
+		with self.query_cache_lock:
+			entry=self.query_cache.pop(key,None)
+			if entry is not None:
+				self.query_cache[key]=entry
+				if now-entry["fetched"]>=ttl:
+					return None
+				entry["used"]=now
+				return entry["packed"]
+
+		if not os.path.isfile(self.query_cache_file):
+			return None
+
+		try:
+			db=self.query_cache_db()
+			try:
+				with db:
+					row=db.execute("SELECT object, fetched, used, records FROM query_cache WHERE key=?",(key,)).fetchone()
+					if row is None or now-row[1]>=ttl:
+						return None
+					entry={"object":row[0],"fetched":row[1],"used":now,"saved_used":row[2],"packed":json.loads(zlib.decompress(str(row[3])))}
+					self.save_query_cache_used(db,self.cache_query_entry(key,entry))
+			finally:
+				db.close()
+		except Exception as err:
+			print "WARNING: Couldn't read the query cache"
+			print err
+			return None
+
+		return entry["packed"]
+
+
+
+	# (Internal usage) This function saves a query result in the memory cache
+	def cache_query_entry(self,key,entry):
+		"""(Internal usage) This function saves a query result in the memory cache, the least recently used results are removed when there are more than QUERY_CACHE_SIZE results (config file) ... returns the removed results (List of key and entry tuples)"""
+
+		removed=[]
+		with self.query_cache_lock:
+			self.query_cache.pop(key,None)
+			self.query_cache[key]=entry
+			while len(self.query_cache)>self.query_cache_size:
+				removed.append(self.query_cache.popitem(last=False))
+		return removed
+
+
+
+	# (Internal usage) This function saves the last use of the cached results
+	def save_query_cache_used(self,db,entries):
+		"""(Internal usage) This function saves in tmp/query_cache.db the last use of the results used from the memory cache since it was last saved (entries is a List of key and entry tuples), so the least recently used results are the ones removed from the database without writing to it on each use. This runs when the results are removed from memory and before the database is trimmed (see cache_query())"""
+
+		used=[ (entry["used"],key) for key,entry in entries if entry["used"]>entry["saved_used"] ]
+		if used:
+			db.executemany("UPDATE query_cache SET used=? WHERE key=?",used)
+			for key,entry in entries:
+				entry["saved_used"]=entry["used"]
+
+
+
+	# (Internal usage) This function saves a query result in the cache
+	def cache_query(self,key,soql,packed):
+		"""(Internal usage) This function saves a query result in the memory cache and in tmp/query_cache.db, the least recently used results are removed when there are more than QUERY_CACHE_SIZE results (config file)"""
+
+		import zlib
+
+		now=time.time()
+		parts=self.parse_SOQL(soql)
+		object_name=parts[1].lower() if parts else None
+
+		removed=self.cache_query_entry(key,{"object":object_name,"fetched":now,"used":now,"saved_used":now,"packed":packed})
+		with self.query_cache_lock:
+			entries=self.query_cache.items()
+
+		try:
+			db=self.query_cache_db()
+			try:
+				with db:
+					db.execute("INSERT OR REPLACE INTO query_cache VALUES (?,?,?,?,?,?)",(key,soql,object_name,now,now,buffer(zlib.compress(json.dumps(packed),1))))
+					self.save_query_cache_used(db,removed+entries)
+					db.execute("DELETE FROM query_cache WHERE key NOT IN (SELECT key FROM query_cache ORDER BY used DESC LIMIT ?)",(self.query_cache_size,))
+			finally:
+				db.close()
+		except Exception as err:
+			print "WARNING: Couldn't save the query result in the cache"
+			print err
+
+
+
+	# This function clears the query result cache
+	def clear_query_cache(self,soql=None,table=None):
+		""" This function removes cached query results (in memory and in tmp/query_cache.db), so the queries are run again on the next call. This can be used after changing records that are used by cached queries.
+ARGUMENTS:
+
+	soql: If set, only the result of this query is removed.
+
+	table: If set, only the results of the queries on this table (Object) are removed.
+
+EXAMPLE:
+
+	sf=py_salesforce()
+
+	# Remove the cached results of all the queries on Case
+	sf.clear_query_cache(table="Case")
+
+"""
+
+		if soql is not None:
+			keys=(self.query_cache_key(soql,False),self.query_cache_key(soql,True))
+			with self.query_cache_lock:
+				for key in keys:
+					self.query_cache.pop(key,None)
+			where,values=" WHERE key IN (?,?)",keys
+		elif table is not None:
+			with self.query_cache_lock:
+				for key in [ key for key,entry in self.query_cache.items() if entry["object"]==table.lower() ]:
+					del self.query_cache[key]
+			where,values=" WHERE object=?",(table.lower(),)
+		else:
+			with self.query_cache_lock:
+				self.query_cache.clear()
+			where,values="",()
+
+		if not os.path.isfile(self.query_cache_file):
+			return
+
+		try:
+			db=self.query_cache_db()
+			try:
+				with db:
+					db.execute("DELETE FROM query_cache"+where,values)
+			finally:
+				db.close()
+		except Exception as err:
+			print "WARNING: Couldn't clear the query cache"
+			print err
+
+
+
+	# This function synchronizes an Object to the local store
+	def sync_object(self,table,columns=[],conditions=[],deletes=False,bulk=None):
+		""" This function copies the records of an Object to the local store (the tmp/local_store.db sqlite database), the first run downloads all the records, then the next runs only download the records modified since the previous run (using the SystemModstamp or LastModifiedDate field) and update them in the store by Id ... returns a dictionary having the number of "updated" and "deleted" records and the new "watermark" (the latest modification date, in UTC) if successful and returns False if failed.
+ARGUMENTS:
+
+	table: The Table (Object) to synchronize.
+
+	columns: The list of columns (fields), all the fields of the Object are used if not set. The Id and the modification date are always added.
+
+	conditions: Same as the query() function, only the records matching the conditions are synchronized.
+
+	deletes: If True, the records deleted since the previous run are also removed from the store (using the queryAll resource, records removed from the Recycle Bin can't be found).
+
+	bulk: Same as the query() function, e.g. bulk=True for the first run of a large Object.
+
+EXAMPLE:
+
+	# The below example keeps a local copy of the Cases, then exports it to a CSV file
+	sf=py_salesforce()
+
+	sf.sync_object("Case",deletes=True)
+	sf.to_CSV(sf.iter_local("Case"),out="case.csv")
+
+"""
+
+		import sqlite3
+
+		if not re.match(r"^\w+$",table):
+			print "ERROR: Invalid Object name "+table
+			return False
+
+		describe=self.describe_object(table,print_fields=False,print_child_rel=False)
+		if describe is False:
+			return False
+
+		# The modification date used as high-water mark
+		names=[ field["name"] for field in describe[0] ]
+		fields=[ name for name in ("SystemModstamp","LastModifiedDate") if name in names ]
+		if not fields:
+			print "ERROR: "+table+" has no SystemModstamp or LastModifiedDate field"
+			return False
+		field=fields[0]
+
+		columns=list(columns) if columns else names
+		for column in ("Id",field):
+			if column not in columns:
+				columns.append(column)
+
+		try:
+			db=self.local_store()
+		except sqlite3.Error as err:
+			print "ERROR: Couldn't open the local store"
+			print err
+			return False
+
+		try:
+			db.execute("BEGIN")
+			row=db.execute("SELECT field, watermark FROM sync_state WHERE object=?",(table,)).fetchone()
+			watermark=row[1] if row is not None and row[0]==field else None
+
+			self.store_columns(db,table,columns,"Id")
+
+			# Only the records modified since the previous run (the same second is included, the records are replaced by Id)
+			sync_conditions=list(conditions)
+			if watermark:
+				sync_conditions.append(field+">="+watermark)
+
+			updated=0
+			latest=watermark
+			for records in self.soql_pages(self.generate_query(table,columns,sync_conditions),bulk=bulk):
+
+				# If query failed don't save anything, the next run starts from the same watermark
+				if records is False:
+					db.execute("ROLLBACK")
+					return False
+
+				self.store_records(db,table,records,"Id")
+				updated+=len(records)
+				modified=[ record.get(field) for record in records if record.get(field) ]
+				if modified:
+					latest=max(latest,self.soql_datetime(max(modified)))
+
+			deleted=0
+			if deletes and watermark:
+				ids=[]
+				for records in self.query_pages(self.query_url("SELECT Id FROM "+table+" WHERE IsDeleted=true AND "+field+">="+watermark,"queryAll")):
+					if records is False:
+						db.execute("ROLLBACK")
+						return False
+					ids+=[ (record["Id"],) for record in records ]
+				deleted=db.executemany("DELETE FROM "+self.quote_name(table)+" WHERE Id=?",ids).rowcount if ids else 0
+
+			db.execute("INSERT OR REPLACE INTO sync_state VALUES (?,?,?,?)",(table,field,latest,time.time()))
+			db.execute("COMMIT")
+		except sqlite3.Error as err:
+			print "ERROR: Couldn't update the local store"
+			print err
+			return False
+		finally:
+			db.close()
+
+		print "<< "+table+" synchronized: "+str(updated)+" records updated, "+str(deleted)+" records deleted >>"
+		return {"updated":updated,"deleted":deleted,"watermark":latest}
+
+
+
+	# This function yields the records of a table of the local store
+	def iter_local(self,table,filters=[],columns=[],order=[],rows=False):
+		""" This function reads the records of a table of the local store (an Object synchronized with sync_object() or records loaded with load_local()), without any request to salesforce. The filters run in the sqlite database, so they use the indexes created with load_local() or index_local() ... yields dictionaries (records), and yields False as the last item if failed.
+ARGUMENTS:
+
+	table: The Table (Object, or the name used with load_local()).
+
+	filters: Same as the query() function.
+
+	columns: The list of columns, all the columns are returned if not set.
+
+	order: A list of columns to sort the records by.
+
+	rows: Same as the query() function.
+
+EXAMPLE:
+
+	sf=py_salesforce()
+
+	for record in sf.iter_local("Case",filters=[("Status","==","New")],columns=["Id","CaseNumber"]):
+		if record is False:
+			break
+		print record["CaseNumber"]
+
+"""
+
+		import sqlite3
+
+		converted=self.filters_to_SQL(filters)
+		if converted is False:
+			yield False
+			return
+		where,params=converted
+
+		sql="SELECT "+(",".join([ self.quote_name(column) for column in columns ]) if columns else "*")+" FROM "+self.quote_name(table)+" WHERE "+where
+		if order:
+			sql+=" ORDER BY "+",".join([ self.quote_name(column) for column in order ])
+
+		try:
+			db=self.local_store()
+			try:
+				cursor=db.execute(sql,params)
+				keys=[ column[0] for column in cursor.description ]
+				header=dict([ (key,i) for i,key in enumerate(keys) ])
+				while True:
+					batch=cursor.fetchmany(1000)
+					if not batch:
+						break
+					for row in batch:
+						yield record_row(header,list(row)) if rows else dict(zip(keys,row))
+			finally:
+				db.close()
+		except sqlite3.Error as err:
+			print "ERROR: Couldn't read "+table+" from the local store"
+			print err
+			yield False
+
+
+
+	# This function returns the records of a table of the local store
+	def query_local(self,table,filters=[],columns=[],order=[],rows=False):
+		""" This function reads the records of a table of the local store, same as iter_local() ... returns List of dictionaries (records) if successful and returns False if failed.
+ARGUMENTS:
+
+	table,filters,columns,order,rows: Same as the iter_local() function.
+
+EXAMPLE:
+
+	# The below example loads the CaseHistory of this month once, then runs many filters on the non filterable NewValue column without running the query again
+	sf=py_salesforce()
+
+	sf.load_local("history",sf.iter_SOQL("SELECT Id,CreatedDate,Field,OldValue,NewValue,CaseId FROM CaseHistory WHERE CreatedDate = THIS_MONTH"),key="Id",indexes=["NewValue","CaseId"])
+
+	john=sf.query_local("history",filters=[("NewValue","==","John.Smith")])
+	jane=sf.query_local("history",filters=[("NewValue","==","Jane.Doe"),("Field","==","Owner")])
+
+"""
+
+		records=[]
+		for record in self.iter_local(table,filters,columns,order,rows):
+			if record is False:
+				return False
+			records.append(record)
+
+		return records
+
+
+
+	# This function saves records in a table of the local store
+	def load_local(self,table,records,key=None,indexes=[],append=False):
+		""" This function saves records in a table of the local store (the tmp/local_store.db sqlite database), so they can be filtered many times with query_local() or iter_local() without running the query again, and without going through all the records for each filter when the filtered columns are indexed ... returns the number of records if successful and returns False if failed.
+ARGUMENTS:
+
+	table: The name of the table, a table having the same name (e.g. an Object synchronized with sync_object()) is replaced unless append is True.
+
+	records: List of records returned by the query functions. This can also be the generator returned from iter_query or iter_SOQL, then the records are saved as they arrive.
+
+	key: A column having a unique value per record (e.g. "Id"), the records having the same key are replaced.
+
+	indexes: A List of columns to index, a tuple of columns creates an index on many columns. Indexes can also be added later with index_local().
+
+	append: If True, the records are added to the existing table.
+
+"""
+
+		import sqlite3
+		import itertools
+
+		records=iter(records)
+
+		try:
+			db=self.local_store()
+		except sqlite3.Error as err:
+			print "ERROR: Couldn't open the local store"
+			print err
+			return False
+
+		count=0
+		try:
+			db.execute("BEGIN")
+			if not append:
+				db.execute("DROP TABLE IF EXISTS "+self.quote_name(table))
+				db.execute("DELETE FROM sync_state WHERE object=?",(table,))
+
+			while True:
+				batch=list(itertools.islice(records,1000))
+				if not batch:
+					break
+
+				# If query failed don't save anything
+				if batch[-1] is False:
+					print "ERROR: Query failed .. the records are not saved"
+					db.execute("ROLLBACK")
+					return False
+
+				count+=self.store_records(db,table,batch,key)
+
+			for columns in indexes:
+				self.create_index(db,table,columns)
+
+			db.execute("COMMIT")
+		except sqlite3.Error as err:
+			print "ERROR: Couldn't save the records in the local store"
+			print err
+			return False
+		finally:
+			db.close()
+
+		print str(count)+" records saved in the local store ("+table+")"
+		return count
+
+
+
+	# This function indexes columns of a table of the local store
+	def index_local(self,table,columns):
+		""" This function creates an index on a column (or a tuple of columns) of a table of the local store, so the filters on this column don't go through all the records ... returns True if successful and returns False if failed.
+ARGUMENTS:
+
+	table: The Table (Object, or the name used with load_local()).
+
+	columns: The name of the column, or a tuple of columns.
+
+"""
+
+		import sqlite3
+
+		try:
+			db=self.local_store()
+			try:
+				self.create_index(db,table,columns)
+			finally:
+				db.close()
+		except sqlite3.Error as err:
+			print "ERROR: Couldn't create the index"
+			print err
+			return False
+
+		return True
+
+
+
+	# (Internal usage) This function creates an index of the local store
+	def create_index(self,db,table,columns):
+		"""(Internal usage) This function creates an index on a column (or a tuple of columns) of a table of the local store, if it doesn't exist"""
+
+		if isinstance(columns,basestring):
+			columns=(columns,)
+
+		name="index_"+table+"_"+"_".join(columns)
+		db.execute("CREATE INDEX IF NOT EXISTS "+self.quote_name(name)+" ON "+self.quote_name(table)+" ("+",".join([ self.quote_name(column) for column in columns ])+")")
+
+
+
+	# This function removes an Object from the local store
+	def reset_sync(self,table):
+		""" This function removes the records and the watermark of an Object from the local store, so the next sync_object() downloads all the records again ... returns True if successful and returns False if failed.
+ARGUMENTS:
+
+	table: The Table (Object).
+
+"""
+
+		import sqlite3
+
+		try:
+			db=self.local_store()
+			try:
+				db.execute("BEGIN")
+				db.execute("DROP TABLE IF EXISTS "+self.quote_name(table))
+				db.execute("DELETE FROM sync_state WHERE object=?",(table,))
+				db.execute("COMMIT")
+			finally:
+				db.close()
+		except sqlite3.Error as err:
+			print "WARNING: Couldn't remove "+table+" from the local store"
+			print err
+			return False
+
+		return True
+
+
+
+	# (Internal usage) This function opens the local store database
+	def local_store(self):
+		"""(Internal usage) This function opens the tmp/local_store.db sqlite database, having a table per synchronized Object (or loaded with load_local()) and the "sync_state" table with the watermark of each Object ... returns the connection"""
+
+		import sqlite3
+
+		if not os.path.isdir(self.tmp_dir):
+			os.makedirs(self.tmp_dir)
+
+		# The transactions are started explicitly, so the tables created or changed are part of them
+		db=sqlite3.connect(self.local_store_file,timeout=30,isolation_level=None)
+		db.create_function("regexp",2,lambda pattern,value: isinstance(value,basestring) and re.search(pattern,value) is not None)
+		db.execute("CREATE TABLE IF NOT EXISTS sync_state (object TEXT PRIMARY KEY, field TEXT, watermark TEXT, synced REAL)")
+		return db
+
+
+
+	# (Internal usage) This function quotes a table or column name of the local store
+	def quote_name(self,name):
+		"""(Internal usage) This function quotes a table or column name for sqlite (e.g. `Owner.Name`), an unknown column is an error (a double quoted unknown column is used as a string by sqlite) ... returns the quoted name"""
+
+		return "`"+name.replace("`","``")+"`"
+
+
+
+	# (Internal usage) This function creates a table of the local store or adds its missing columns
+	def store_columns(self,db,name,columns,key=None):
+		"""(Internal usage) This function creates a table of the local store having the given columns (key is the primary key), or adds the missing columns if it already exists ... returns the List of columns of the table"""
+
+		existing=[ row[1] for row in db.execute("PRAGMA table_info("+self.quote_name(name)+")") ]
+		if not existing:
+			db.execute("CREATE TABLE "+self.quote_name(name)+" ("+",".join([ self.quote_name(column)+(" PRIMARY KEY" if column==key else "") for column in columns ])+")")
+			return list(columns)
+
+		lower=set([ column.lower() for column in existing ])
+		for column in columns:
+			if column.lower() not in lower:
+				db.execute("ALTER TABLE "+self.quote_name(name)+" ADD COLUMN "+self.quote_name(column))
+				existing.append(column)
+				lower.add(column.lower())
+
+		return existing
+
+
+
+	# (Internal usage) This function saves records in a table of the local store
+	def store_records(self,db,name,records,key=None):
+		"""(Internal usage) This function saves a List of records in a table of the local store, the records having the same key (primary key) are replaced and the missing columns are added ... returns the number of records"""
+
+		if not records:
+			return 0
+
+		# Columns of all the records (a null relation has less columns)
+		keys=list(records[0].keys())
+		found=set(keys)
+		for record in records:
+			if len(record)!=len(keys) or not found.issuperset(record.keys()):
+				for k in record.keys():
+					if k not in found:
+						found.add(k)
+						keys.append(k)
+
+		columns=self.store_columns(db,name,keys,key)
+		sql="INSERT OR REPLACE INTO "+self.quote_name(name)+" ("+",".join([ self.quote_name(column) for column in columns ])+") VALUES ("+",".join(["?"]*len(columns))+")"
+		db.executemany(sql,[ [ self.store_value(record.get(column)) for column in columns ] for record in records ])
+
+		return len(records)
+
+
+
+	# (Internal usage) This function converts a value to be saved in the local store
+	def store_value(self,value):
+		"""(Internal usage) This function converts a value to be saved in the local store, the dictionaries and Lists (e.g. subqueries) are saved as JSON ... returns the value"""
+
+		if isinstance(value,(dict,list)):
+			return json.dumps(value)
+		return value
+
+
+
+	# (Internal usage) This function converts a salesforce date to a SOQL date literal
+	def soql_datetime(self,value):
+		"""(Internal usage) This function converts a date returned by salesforce (e.g. "2016-09-17T10:00:00.000+0000") to a SOQL date literal in UTC (e.g. 2016-09-17T10:00:00Z), the milliseconds are removed ... returns the date literal"""
+
+		return self.parse_datetime(value).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+
+	# (Internal usage) This function converts a salesforce date to a datetime
+	def parse_datetime(self,value):
+		"""(Internal usage) This function converts a date returned by salesforce (e.g. "2016-09-17T10:00:00.000+0000", or "2016-09-17T10:00:00.000Z" by the Bulk API) to a datetime in UTC ... returns the datetime"""
+
+		date=datetime.datetime.strptime(value[:19],"%Y-%m-%dT%H:%M:%S")
+		milliseconds=re.match(r"\.(\d+)",value[19:])
+		if milliseconds:
+			date+=datetime.timedelta(milliseconds=int(milliseconds.group(1)[:3].ljust(3,"0")))
+		offset=re.search(r"([+-])(\d\d):?(\d\d)$",value)
+		if offset:
+			minutes=int(offset.group(2))*60+int(offset.group(3))
+			date-=datetime.timedelta(minutes=minutes if offset.group(1)=="+" else -minutes)
+
+		return date
+
+
+
+	# This function runs many REST requests in Composite Batch requests
+	def batch_request(self,paths):
+		""" This function runs many GET requests of the REST API using Composite Batch requests, each Composite Batch request groups up to 25 requests so this needs much less round trips than running them one by one. The Composite Batch requests run at the same time (limited by MAX_CONCURRENT_REQUESTS of the config file) ... returns a List having the parsed JSON content of each request (or False if the request failed) in the same order as the paths, and returns False if all failed.
+ARGUMENTS:
+
+	paths: List of urls relative to the REST API url, e.g. "sobjects", "sobjects/Case/describe" or "query/?q=SELECT+Id+FROM+Case"
+
+EXAMPLE:
+
+	sf=py_salesforce()
+
+	objects, case, cases = sf.batch_request(["sobjects","sobjects/Case/describe","query/?q=SELECT+Id,CaseNumber+FROM+Case+WHERE+CreatedDate=TODAY"])
+
+"""
+
+		# The urls of the subrequests start with the version, e.g. "v35.0/sobjects"
+		version=self.REST_url_ver.split("/services/data/",1)[-1]
+		groups=[ paths[i:i+25] for i in range(0,len(paths),25) ]
+
+		def run_batch(group):
+			body={"batchRequests":[ {"method":"GET","url":version+path} for path in group ]}
+			result=self.request_json(self.REST_url+"composite/batch",method="POST",body=body)
+			if result is False:
+				return [False]*len(group)
+
+			results=[]
+			for path,subresult in zip(group,result[1]["results"]):
+				if 200 <= subresult["statusCode"] < 300:
+					results.append(subresult["result"])
+				else:
+					print "ERROR: Request Failed ("+path+")"
+					self.print_errors(subresult["result"])
+					results.append(False)
+			return results
+
+		if len(groups)==1:
+			results=run_batch(groups[0])
+		else:
+			# A pool of its own, the async_pool() can't be used because this may run in one of its jobs (e.g. describe_objects() in query_async()), and waiting there for jobs queued behind it would never end
+			from multiprocessing.pool import ThreadPool
+
+			pool=ThreadPool(min(self.max_concurrent_requests,len(groups)))
+			try:
+				results=sum(pool.map(run_batch,groups),[])
+			finally:
+				pool.terminate()
+
+		if results and not [ result for result in results if result is not False ]:
+			return False
+
+		return results
+
+
+
+	# This function runs many SOQL queries in Composite Batch requests
+	def query_SOQL_batch(self,soqls,filters=[],rows=False):
+		""" This function runs many SOQL queries using Composite Batch requests, the first page of up to 25 queries is downloaded in one round trip (the next pages of large queries are downloaded one by one). This is much faster than running many small queries using query_SOQL ... returns a List having the records of each query (same as the return value of query_SOQL()) in the same order as the queries.
+ARGUMENTS:
+
+	soqls: List of SOQL queries.
+
+	filters, rows: Same as the query_SOQL() function, applied to all the queries.
+
+EXAMPLE:
+
+	sf=py_salesforce()
 
-		# Get User Name
-		user_name_element=login_xml.getElementsByTagName("userFullName")
-		if len(user_name_element) > 0:
-			self.user_name = user_name_element[0].childNodes[0].data	
+	soqls=["SELECT Id,Status FROM Case WHERE CaseNumber=\'"+number+"\'" for number in ["00001001","00001002","00001003"]]
 
+	results=sf.query_SOQL_batch(soqls)
 
+"""
 
-	# (Internal usage) This function runs the query
-	def run_query(self,url,key="records"):
-		"""(Internal usage) This function runs the query ... returns List of dictionaries (records) if successful and returns False if failed """
-		
-		http = httplib2.Http()
-		headers = {'Authorization': 'Bearer '+self.session_id}
-	
-		done=False
-		records=[]
-		while not done:
-			try:
-				response, content = http.request(url, 'GET', headers=headers)
-			except httplib2.MalformedHeader as err:
-				if str(err)=="WWW-Authenticate":
-					print ">> SESSION EXPIRED! <<"
-					if self.session_request():
-						self.session_info()
-						headers = {'Authorization': 'Bearer '+self.session_id}
-						continue	
-					else:
-						return False
-			except Exception as err:
-				print "ERROR: could not connect to server"
-				print err
-				return False
-	
-			if response["status"] == "200": 
-				content_json=json.loads(content)
-				records+=content_json[key]
-				if "done" in content_json:
-					done=content_json["done"]
-				else:
-					done=True
+		pages=self.batch_request([ "query/?q="+soql.replace(" ","+") for soql in soqls ])
+		if pages is False:
+			return [False]*len(soqls)
 
-				if not done:
-					url=self.server_url+content_json["nextRecordsUrl"]
-				#print records
-				#print(len(records))
-				#print done
-			else:
-				print "ERROR: Query Failed"
-				try:
-					content_json=json.loads(content)
-				except ValueError as err:
-					print content
-					print err
-					return False
-					
-				if "errorCode" in content_json[0].keys():
-					error_code=content_json[0]["errorCode"]
-					print "ERROR_CODE: "+error_code
-					if error_code=="INVALID_SESSION_ID":
-						if self.session_request():
-							self.session_info()
-							headers = {'Authorization': 'Bearer '+self.session_id}
-							continue	
-						else:
-							return False
-				if "message" in content_json[0].keys():
-					error_string=content_json[0]["message"]
-					print "ERROR_STRING: "+error_string
-				return False
+		results=[]
+		for soql,page in zip(soqls,pages):
+			if page is False:
+				results.append(False)
+				continue
 
+			records=[]
+			for page_records in self.query_pages(None,filters,0,rows,first_page=page,children=self.subqueries(soql),columns=self.select_columns(soql)):
+				if page_records is False:
+					records=False
+					break
+				records+=page_records
+			results.append(records)
 
-		return records
+		return results
 
 
 
-	# This function initiates a query using REST API
-	def query(self,table,columns,conditions=[],filters=[]):
-		""" This function creates a query and runs it using the REST API ... returns List of dictionaries (records) if successful and returns False if failed.
+	# This function describes many objects in Composite Batch requests
+	def describe_objects(self,object_names):
+		""" This function describes the fields and the relations of many objects, the objects that are not in the metadata cache are downloaded in Composite Batch requests of up to 25 objects ... returns a dictionary having the fields and child relations of each object (same as the return value of describe_object(), or False if failed)
 ARGUMENTS:
 
-	table: The Table (Object) of the query.
-	
-	columns: the list of columns (fields). This can include Child-to-Parent relations,	e.g.: Owner.Name
-	
-	conditions: A list of conditions to apply (with AND clause), if you wish to use OR use a list inside the list, 	e.g.: [condition1,condition2] => condition1 AND condition2, [condition3,[condition4,condition5]] => condition3 AND (condition4 OR condition5)
-	
-	filters: A list of conditions that will be applied AFTER the query is complete, this can be used with non filterable fields (e.g. NewValue in Casehistory). each item in the list needs to be a tuple of 2 items, first item is the column name, and the second item is a python statement that can be appied to this column.	e.g. filters=[("NewValue","==\'John.Smith\'")]
+	object_names: List of names of the Objects(Tables)
 
 EXAMPLE:
 
-	# The below example searches "CaseHistory" for items created This month and the changed field was "Owner" OR "OwnerAccepted", then applied a filter on the NewValue to only be "John.Smith"
 	sf=py_salesforce()
 
-	table="CaseHistory"
-	columns=["Id","CreatedDate","Field","OldValue","NewValue","Case.CaseNumber"]
-	conditions=['CreatedDate=THIS_MONTH',["Field=\'Owner\'","Field=\'ownerAccepted\'"]]
-	filters=[("NewValue","==\'John.Smith\'")]
-
-	records=sf.query(table=table,columns=columns,conditions=conditions,filters=filters)
+	describes=sf.describe_objects(["Case","CaseHistory","Account"])
+	fields, relations = describes["Case"]
 
 """
-		url = self.REST_url+"query/?q="
 
-		# Generate query
-		query="SELECT+"+",".join(columns)+"+FROM+"+table
-		if conditions:
-			for i in range(len(conditions)):
-				if isinstance(conditions[i],list):
-					conditions[i]='('+"+OR+".join(conditions[i])+')'
+		describes={}
+		missing=[]
+		now=time.time()
 
-			query=query+"+WHERE+"+"+AND+".join(conditions)
+		# Use the fresh cache entries
+		for object_name in object_names:
+			key,entry=self.metadata_entry(self.REST_url+"sobjects/"+object_name+"/describe")
+			if self.metadata_cache_ttl>0 and entry is not None and now-entry["fetched"]<self.metadata_cache_ttl:
+				self.cache_metadata(key,entry,write=False)
+				describes[object_name]=entry["content"]
+			else:
+				missing.append(object_name)
 
-		# convert spaces to +
-		query=query.replace(" ","+")
+		if missing:
+			results=self.batch_request([ "sobjects/"+object_name+"/describe" for object_name in missing ])
+			if results is False:
+				results=[False]*len(missing)
 
-		# Get records
-		records = self.run_query(url+query)
+			for object_name,describe in zip(missing,results):
+				describes[object_name]=describe
+				if describe is not False and self.metadata_cache_ttl>0:
+					url=self.REST_url+"sobjects/"+object_name+"/describe"
+					self.cache_metadata(self.metadata_key(url),{"url":url,"fetched":now,"etag":None,"last_modified":None,"content":describe})
 
-		# If query failed don't continue
-		if records is False:
-			return False
+		return dict([ (object_name,(describe["fields"],describe["childRelationships"]) if describe is not False else False) for object_name,describe in describes.items() ])
 
-		# Organise columns properly
-		records=[self.flatten(record) for record in records]
 
-		# Apply Filters
-		for f in filters:
-			records=eval("[ record for record in records if record[\'"+f[0]+"\'"+"] "+f[1]+"]")
 
-		# return values
-		return records
+	# This function creates records
+	def insert(self,table,records,all_or_none=False,workers=None):
+		""" This function creates records of an Object using sObject Collections requests of up to 200 records, the requests run in parallel ... returns a List having the result of each record in the same order as the records, a dictionary having the "id" of the created record, "success" (boolean) and the "errors" (List of dictionaries having the "statusCode", "message" and "fields"). If a request failed after it might have been processed (e.g. status 504), it is not sent again and its records fail with the UNKNOWN_RESULT status code, check them before sending them again.
+ARGUMENTS:
 
+	table: The Table (Object).
 
-	
-	def query_SOQL(self,soql,filters=[]):
-		""" This function runs a query using the REST API ... returns List of dictionaries (records) if successful and returns False if failed.
-ARGUMENTS:
+	records: List of dictionaries having the values of the fields, e.g. [{"Subject":"Test","Status":"New"}]. This can also be a generator, then the records are sent as they are generated.
 
-	soql: The SOQL query.
+	all_or_none: If True, the records of a request (up to 200 records) are only saved if all of them succeed.
 
-	filters: A list of conditions that will be applied AFTER the query is complete, this can be used with non filterable fields (e.g. NewValue in Casehistory). each item in the list needs to be a tuple of 2 items, first item is the column name, and the second item is a python statement that can be appied to this column.	e.g. filters=[("NewValue","==\'John.Smith\'")]
+	workers: The number of requests running at the same time, if not set the CHUNK_WORKERS value of the config file is used (default 4). The requests running against the org are also limited by MAX_CONCURRENT_REQUESTS.
 
 EXAMPLE:
 
-	# The below example searches "CaseHistory" for items created This month and the changed field was "Owner" OR "OwnerAccepted", then applied a filter on the NewValue to only be "John.Smith"
 	sf=py_salesforce()
 
-	soql="SELECT Id,CreatedDate,Field,OldValue,NewValue,Case.CaseNumber FROM CaseHistory WHERE CreatedDate = THIS_MONTH and (Field=\'Owner\' OR Field=\'ownerAccepted\')"	
-	filters=[("NewValue","==\'John.Smith\'")]
-
-	records2=sf.query_SOQL(soql=soql,filters=filters)
+	results=sf.insert("Case",[{"Subject":"Test "+str(i),"Status":"New"} for i in range(1000)])
+	ids=[result["id"] for result in results if result["success"]]
 
 """
 
-		url = self.REST_url+"query/?q="
+		return self.write_records("POST","composite/sobjects",table,records,all_or_none,workers)
 
-		# Generate query
-		query=soql.replace(" ","+")
 
-		# Get records
-		records = self.run_query(url+query)
 
-		# If query failed don't continue
-		if records is False:
-			return False
+	# This function updates records
+	def update(self,table,records,all_or_none=False,workers=None):
+		""" This function updates records of an Object using sObject Collections requests of up to 200 records, the requests run in parallel ... returns a List having the result of each record in the same order as the records (same as the insert() function).
+ARGUMENTS:
 
-		# Organise columns properly
-		records=[self.flatten(record) for record in records]
+	table: The Table (Object).
 
-		# Apply Filters
-		for f in filters:
-			records=eval("[ record for record in records if record[\'"+f[0]+"\'"+"] "+f[1]+"]")
+	records: List of dictionaries having the "Id" and the values of the fields to update, e.g. [{"Id":"5001a000002Wsb4AAC","Status":"Closed"}]. This can also be a generator (e.g. returned by iter_SOQL), then the records are sent as they are generated.
 
-		# return values
-		return records
+	all_or_none, workers: Same as the insert() function.
 
+EXAMPLE:
 
+	sf=py_salesforce()
 
-	# Put records in CSV
-	def to_CSV(self,records,out="out.csv",order=[]):
-		"""This function exports records returned from query or query_SOQL into a CSV File 
-ARGUMENTS:
+	records=( {"Id":record["Id"],"Status":"Closed"} for record in sf.iter_SOQL("SELECT Id FROM Case WHERE Status='Solved'") )
+	results=sf.update("Case",records)
 
-	records: List of dictionaries, returned from query or query_SOQL
-	
-	out: the name and path of the output file
-	
-	order: a list having the order in which the columns should be displayed (can only contain columns included in the used records)
 """
 
-		# If the CSV module is not found print error and exit
-		if "csv" not in sys.modules:
-			print "ERROR: csv module not found .. unable to create CSV file" 
-			return None
+		return self.write_records("PATCH","composite/sobjects",table,records,all_or_none,workers)
 
-		# Check if any records were returned
-		if not records:
-			print "No records were found .. ignoring CSV file creation"
-			return None
 
-		# check if columns in order are valid and correct case if needed
-		if order:
-			for i in range(len(order)):
-				if not records[0].keys().count(order[i]):
-					for k in records[0].keys():
-						if re.match(order[i],k,re.IGNORECASE):
-							order[i]=k
-							break
 
-		keys=order if order else records[0].keys()
-		enc_keys=[dict(zip(keys,[k.encode('utf8') for k in keys]))]
+	# This function creates or updates records using an external Id
+	def upsert(self,table,external_id,records,all_or_none=False,workers=None):
+		""" This function creates or updates records of an Object using sObject Collections requests of up to 200 records, the records are matched by an external Id field, the requests run in parallel ... returns a List having the result of each record in the same order as the records (same as the insert() function, "created" is also True if the record was created).
+ARGUMENTS:
+
+	table: The Table (Object).
 
-		# encode Unicode
-		enc_records=[]
-		for record in records:
-			enc_record={}
-			for key in keys:
-				enc_record[key]=record[key].encode('utf8') if isinstance(record[key],unicode) else record[key]
-			enc_records.append(enc_record)
-				
-				
+	external_id: The name of the external Id field (or "Id").
 
-		with open(out, 'w') as output_file:
-			dict_writer = csv.DictWriter(output_file, keys,quoting=csv.QUOTE_ALL)
-			dict_writer.writerows(enc_keys)
-			dict_writer.writerows(enc_records)
+	records: List of dictionaries having the external Id and the values of the fields. This can also be a generator.
 
+	all_or_none, workers: Same as the insert() function.
 
-	# This function runs the query and puts the output in a CSV file
-	def query_to_CSV(self,table,columns,conditions=[],filters=[],out="out.csv"):
-		""" This function creates a query and runs it using the REST API, then exports the output to a CSV file.
+EXAMPLE:
+
+	sf=py_salesforce()
+
+	results=sf.upsert("Account","External_Id__c",[{"External_Id__c":"A-1","Name":"Acme"},{"External_Id__c":"A-2","Name":"Globex"}])
+
+"""
+
+		return self.write_records("PATCH","composite/sobjects/"+table+"/"+external_id,table,records,all_or_none,workers)
+
+
+
+	# This function deletes records
+	def delete(self,ids,all_or_none=False,workers=None):
+		""" This function deletes records (of any Object) using sObject Collections requests of up to 200 records, the requests run in parallel ... returns a List having the result of each record in the same order as the Ids (same as the insert() function).
 ARGUMENTS:
 
-	table,columns,conditions,filters: Same as the query() function.
+	ids: List of Ids of the records. This can also be a generator.
 
-	out:  the name and path of the output file.
+	all_or_none, workers: Same as the insert() function.
 
 EXAMPLE:
 
-    # The below example searches "CaseHistory" for items created This month and the changed field was "Owner" OR "OwnerAccepted", then applied a filter on the NewValue to only be "John.Smith"
-    sf=py_salesforce()
-
-    table="CaseHistory"
-    columns=["Id","CreatedDate","Field","OldValue","NewValue","Case.CaseNumber"]
-    conditions=['CreatedDate=THIS_MONTH',["Field=\'Owner\'","Field=\'ownerAccepted\'"]]
-    filters=[("NewValue","==\'John.Smith\'")]
-	out="casehist.csv"
+	sf=py_salesforce()
 
-	sf.query_to_CSV(table=table,columns=columns,conditions=conditions,filters=filters,out=out)
+	results=sf.delete([ record["Id"] for record in sf.query_SOQL("SELECT Id FROM Case WHERE Subject LIKE 'Test %'") ])
 
 """
 
+		return self.write_records("DELETE","composite/sobjects",None,ids,all_or_none,workers)
 
-		records=self.query(table,columns,conditions,filters)
 
-		self.to_CSV(records,out,columns)	
 
+	# (Internal usage) This function writes records in batches running in parallel
+	def write_records(self,method,path,table,records,all_or_none=False,workers=None):
+		"""(Internal usage) This function sends the records (or the Ids if table is None) in sObject Collections requests of up to 200 records, running "workers" requests at the same time. The records are read from the List or generator as the requests are sent, so only a few batches are kept in memory ... returns a List having the result of each record in the same order as the records"""
 
+		from multiprocessing.pool import ThreadPool
+		import itertools
 
-	# This function runs the query with SOQL and puts the output in a CSV file
-	def query_SOQL_to_CSV(self,soql,filters=[],order=[],out="out.csv"):
-		""" This function runs a query using the REST API, and exports the output to a CSV file.
-ARGUMENTS:
+		workers=workers if workers else self.chunk_workers
+		url=self.latest_REST_url+path
 
-    soql: The SOQL query.
+		records=iter(records)
+		batches=iter(lambda: list(itertools.islice(records,200)),[])
 
-    filters: same as the query and query_SOQL functions.
+		start=time.time()
+		results=[]
+		pending=collections.deque()
+		pool=ThreadPool(workers)
+		try:
+			for batch in batches:
+				pending.append(pool.apply_async(self.write_batch,(method,url,table,batch,all_or_none)))
 
-	order: a list having the order in which the columns should be displayed (can only contain columns included in the used records)
- 
-	out: the name and path of the output file.
- 
-EXAMPLE:
+				# Don't read more records than the running requests need
+				if len(pending)>=workers*2:
+					results+=pending.popleft().get()
 
-    # The below example searches "CaseHistory" for items created This month and the changed field was "Owner" OR "OwnerAccepted", then applied a filter on the NewValue to only be "John.Smith"
-    sf=py_salesforce()
+			while pending:
+				results+=pending.popleft().get()
+		finally:
+			pool.terminate()
 
-    soql="SELECT Id,CreatedDate,Field,OldValue,NewValue,Case.CaseNumber FROM CaseHistory WHERE CreatedDate = THIS_MONTH and (Field=\'Owner\' OR Field=\'ownerAccepted\')"
-    filters=[("NewValue","==\'John.Smith\'")]
-	order=["Id","CreatedDate","Field","OldValue","NewValue","Case.CaseNumber"]
-	out="casehist.csv"
+		failed=len([ result for result in results if not result.get("success") ])
+		elapsed=time.time()-start
+		print str(len(results)-failed)+" records saved, "+str(failed)+" failed in "+("%.1f" % elapsed)+" seconds"
 
-	sf.query_SOQL_to_CSV(soql=soql,filters=filters,order=order,out=out)
+		return results
 
-"""
 
-		records=self.query_SOQL(soql,filters)
-				
-		self.to_CSV(records,out,order)	
 
+	# (Internal usage) This function writes one batch of records
+	def write_batch(self,method,url,table,batch,all_or_none=False):
+		"""(Internal usage) This function sends one sObject Collections request having up to 200 records (or Ids if table is None), the request is not sent again if it failed after it might have been processed (see rest_request()) ... returns a List having the result of each record, if the request failed all the records fail with the REQUEST_FAILED status code, or with the UNKNOWN_RESULT status code if the records might have been saved"""
 
+		if table is None:
+			result=self.request_json(url+"?ids="+",".join(batch)+"&allOrNone="+("true" if all_or_none else "false"),method=method)
+		else:
+			body={"allOrNone":all_or_none,"records":[ self.write_record(table,record) for record in batch ]}
+			result=self.request_json(url,method=method,body=body)
+
+		if result is False and self.request_state.uncertain:
+			print "WARNING: A batch of "+str(len(batch))+" records failed after it might have been processed .. check the records before sending them again"
+			return [ {"id":record if table is None else record.get("Id"),"success":False,"errors":[{"statusCode":"UNKNOWN_RESULT","message":"The request failed after it was sent, the record might have been saved","fields":[]}]} for record in batch ]
+		if result is False or not isinstance(result[1],list):
+			return [ {"id":record if table is None else record.get("Id"),"success":False,"errors":[{"statusCode":"REQUEST_FAILED","message":"The request failed","fields":[]}]} for record in batch ]
+
+		return result[1]
+
+
+
+	# (Internal usage) This function converts a record to be sent to salesforce
+	def write_record(self,table,record):
+		"""(Internal usage) This function converts a record (dictionary or record_row) to the JSON format of the sObject Collections requests, with the type of the Object in the "attributes", the dates of the typed records are formatted as salesforce dates ... returns a dictionary"""
+
+		values=dict([ (key,self.format_date(value) if isinstance(value,datetime.date) else value) for key,value in record.items() if key!="attributes" ])
+		values["attributes"]={"type":table}
+
+		return values
 
-	# This is a function used to flatten nested dicts to create a list
-	def flatten(self, d, parent_key='', sep='.'):
-		""" (Internal Usage) This is a function used to flatten nested dicts to create a list """
-		items = []
-		for k, v in d.items():
-			if k=='attributes' and type(v) is dict:
-				continue
-			new_key = parent_key + sep + k if parent_key else k
-			if isinstance(v, collections.MutableMapping):
-				items.extend(self.flatten(v, new_key, sep=sep).items())
-			else:
-				items.append((new_key, v))
-		return dict(items)
 
-		
 
 	# This function shows all available objects for your environment
 	def show_all_objects(self,print_all=True):
@@ -502,15 +4218,15 @@ ARGUMENTS:
 
 """
 
-		url = self.REST_url+"sobjects"
-
 		# Get objects
-		objects = self.run_query(url=url,key="sobjects")
+		sobjects = self.get_metadata("sobjects")
 
 		# If query failed don't continue
-		if objects is False:
+		if sobjects is False:
 			return False
 
+		objects = sobjects["sobjects"]
+
 		if print_all:
 			for obj in objects:
 				if obj["queryable"]:
@@ -615,16 +4331,16 @@ EXAMPLES:
 	
 """
 
-		url = self.REST_url+"sobjects/"+object_name+"/describe"
-
 		# Get objects
-		fields = self.run_query(url=url,key="fields")
-		child_relations= self.run_query(url=url,key="childRelationships")
+		describe = self.get_metadata("sobjects/"+object_name+"/describe")
 
 		# If query failed don't continue
-		if fields is False or child_relations is False :
+		if describe is False:
 			return False
 
+		fields = describe["fields"]
+		child_relations = describe["childRelationships"]
+
 		# Get longest name to justify
 		#longest_field=len(max([field["name"]+field["type"] for field in fields],key=len))+4
 		
@@ -659,33 +4375,185 @@ EXAMPLES:
 
 
 	# fucntion to select all columns (fields) from an Object
-	def select_all(self,table,conditions=[],filters=[]):
+	def select_all(self,table,conditions=[],filters=[],chunk_by=None,workers=None,bulk=None,cache=None,typed=False):
 		""" This function generates a query that shows all possible columns of an Object ... returns List of dictionaries (records) if successful and returns False if failed.
 ARGUMENTS:
 
 	table, conditions, filters: same as query() functions.
 
+	chunk_by, workers: If chunk_by is set, the query is split into chunks that run in parallel, same as the query_chunked() function.
+
+	bulk, cache, typed: same as query() function (bulk, cache and typed are not used with chunk_by).
+
 """
 		
-		columns=[field["name"] for field in self.describe_object(table,print_fields=False,print_child_rel=False)[0]]	
-		records=self.query(table=table,columns=columns,conditions=conditions,filters=filters)
+		columns=self.select_all_columns(table)
+		if columns is False:
+			return False
+
+		if chunk_by:
+			records=self.query_chunked(table=table,columns=columns,conditions=conditions,filters=filters,chunk_by=chunk_by,workers=workers)
+		else:
+			records=self.query(table=table,columns=columns,conditions=conditions,filters=filters,bulk=bulk,cache=cache,typed=typed)
 		
 		return records
 	
 
 
+	# (Internal usage) This function returns all the columns (fields) of an Object
+	def select_all_columns(self,table):
+		"""(Internal usage) This function returns the names of all the columns (fields) of an Object ... returns a List of names if successful and returns False if failed"""
+
+		describe=self.describe_object(table,print_fields=False,print_child_rel=False)
+		if describe is False:
+			return False
+
+		return [field["name"] for field in describe[0]]
+
+
+
 	# fucntion to select all columns (fields) from an Object to a CSV file
-	def select_all_to_CSV(self,table,conditions=[],filters=[],order=[],out="out.csv"):
-		""" This function generates a query that shows all possible columns of an Object and exports the output to a CSV file
+	def select_all_to_CSV(self,table,conditions=[],filters=[],order=[],out="out.csv",compress=False,resume=False):
+		""" This function generates a query that shows all possible columns of an Object and exports the output to a CSV file. The records are written as the pages arrive, so the memory used doesn't depend on the number of records.
 ARGUMENTS:
 
 	table, conditions, filters: same as query() functions.
 
-	order: a list having the order in which the columns should be displayed (can only contain columns included in the used records)
+	order: a list having the order in which the columns should be displayed (can only contain columns included in the used records), by default all the columns of the Object
 
 	out: the name and path of the output file 
 
+	compress: If True, the output file is compressed with gzip (e.g. out="case.csv.gz")
+
+	resume: Same as the query_SOQL_to_CSV() function.
+
 """
-		records=self.select_all(table=table,conditions=conditions,filters=filters)
-		self.to_CSV(records,out,order)	
-		
+		columns=self.select_all_columns(table)
+		if columns is False:
+			return False
+
+		if resume:
+			return self.resumable_CSV(self.generate_query(table,columns,conditions),filters,order,out,compress)
+
+		records=self.iter_query(table=table,columns=columns,conditions=conditions,filters=filters,rows=True)
+		return self.to_CSV(records,out,order or columns,compress)	
+
+
+
+	# fucntion to select all columns (fields) from an Object to a columnar file
+	def select_all_to_columnar(self,table,conditions=[],filters=[],order=[],out="out.parquet",format=None,bulk=None):
+		""" This function generates a query that shows all possible columns of an Object and exports the output to a columnar file (see to_columnar()). The records are written as the pages arrive.
+ARGUMENTS:
+
+	table, conditions, filters, bulk: same as query() functions.
+
+	order: a list having the columns to write and their order, all the columns are used if not set.
+
+	out, format: Same as the to_columnar() function.
+
+"""
+		columns=self.select_all_columns(table)
+		if columns is False:
+			return False
+
+		return self.query_SOQL_to_columnar(self.generate_query(table,columns,conditions),filters,order,out,format,bulk)
+
+
+
+	# (Internal usage) This function returns the thread pool running the asynchronous requests
+	def async_pool(self):
+		"""(Internal usage) This function returns the thread pool running the asynchronous requests, it has MAX_CONCURRENT_REQUESTS threads (config file) and is created on first use"""
+
+		from multiprocessing.pool import ThreadPool
+
+		with self.http_pool_lock:
+			if self.async_workers is None:
+				self.async_workers=ThreadPool(self.max_concurrent_requests)
+		return self.async_workers
+
+
+
+	# This function runs the query() function in the background
+	def query_async(self,table,columns,conditions=[],filters=[]):
+		""" This function runs the query() function in the background, so many queries can run at the same time using the same session ... returns an AsyncResult, call its get() function to wait for the records (same as the return value of query()).
+ARGUMENTS:
+
+	table,columns,conditions,filters: Same as the query() function.
+
+EXAMPLE:
+
+	sf=py_salesforce()
+
+	cases=sf.query_async(table="Case",columns=["Id","CaseNumber"],conditions=["CreatedDate=TODAY"])
+	history=sf.query_async(table="CaseHistory",columns=["Id","Field"],conditions=["CreatedDate=TODAY"])
+
+	cases=cases.get()
+	history=history.get()
+
+"""
+
+		return self.async_pool().apply_async(self.query,(table,columns,conditions,filters,0))
+
+
+
+	# This function runs the query_SOQL() function in the background
+	def query_SOQL_async(self,soql,filters=[]):
+		""" This function runs the query_SOQL() function in the background, so many queries can run at the same time using the same session ... returns an AsyncResult, call its get() function to wait for the records (same as the return value of query_SOQL()).
+ARGUMENTS:
+
+	soql,filters: Same as the query_SOQL() function.
+
+"""
+
+		return self.async_pool().apply_async(self.query_SOQL,(soql,filters,0))
+
+
+
+	# This function runs many SOQL queries at the same time
+	def query_SOQL_many(self,soqls,filters=[]):
+		""" This function runs many SOQL queries at the same time, the number of running requests is limited by the MAX_CONCURRENT_REQUESTS value of the config file ... returns a List having the result of each query (same as the return value of query_SOQL()) in the same order as the queries.
+ARGUMENTS:
+
+	soqls: List of SOQL queries.
+
+	filters: Same as the query_SOQL() function, applied to all the queries.
+
+EXAMPLE:
+
+	sf=py_salesforce()
+
+	soqls=["SELECT Id,Status FROM Case WHERE CaseNumber=\'"+number+"\'" for number in ["00001001","00001002","00001003"]]
+
+	results=sf.query_SOQL_many(soqls)
+
+"""
+
+		results=[ self.query_SOQL_async(soql,filters) for soql in soqls ]
+		return [ result.get() for result in results ]
+
+
+
+	# This function runs the describe_object() function in the background
+	def describe_object_async(self,object_name,print_fields=False,print_child_rel=False):
+		""" This function runs the describe_object() function in the background ... returns an AsyncResult, call its get() function to wait for the fields and child relations (same as the return value of describe_object()).
+ARGUMENTS:
+
+	object_name,print_fields,print_child_rel: Same as the describe_object() function, except that nothing is printed by default.
+
+"""
+
+		return self.async_pool().apply_async(self.describe_object,(object_name,print_fields,print_child_rel))
+
+
+
+	# This function runs the show_all_objects() function in the background
+	def show_all_objects_async(self,print_all=False):
+		""" This function runs the show_all_objects() function in the background ... returns an AsyncResult, call its get() function to wait for the objects (same as the return value of show_all_objects()).
+ARGUMENTS:
+
+	print_all: Same as the show_all_objects() function, except that nothing is printed by default.
+
+"""
+
+		return self.async_pool().apply_async(self.show_all_objects,(print_all,))
+